@@ -0,0 +1,67 @@
+"""
+Authenticated users resolved from the cache instead of the database.
+
+Django loads request.user with a query on every request, and Channels does
+the same on every WebSocket connect, for the whole row with its stats.
+CachedModelBackend keeps a projection of the row holding the fields needed
+to authenticate and authorize (USER_FIELDS) in the cache for
+AUTH_USER_CACHE_TTL seconds, so a polling player costs no auth query in
+steady state. The session auth hash is still checked against the cached
+password hash on every request, so changing the password ends the user's
+other sessions as before. Logging out is up to the session engine (see
+SESSION_ENGINE in settings).
+
+Saving or deleting a user drops their entry, and again once the
+transaction commits; processes with their own local cache see the change
+after the TTL. The stats columns are left out of the projection and reading
+one from request.user costs a query, so views that show them load the full
+row.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+USER_FIELDS = (
+    'id', 'password', 'last_login', 'is_superuser', 'is_staff', 'is_active',
+    'username', 'first_name', 'last_name', 'email', 'google_id', 'avatar_url',
+)
+
+
+def _key(user_id):
+    return f'auth:user:{user_id}'
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend whose get_user() serves a cached projection of the user row"""
+
+    def get_user(self, user_id):
+        user = cache.get(_key(user_id))
+        if user is None:
+            try:
+                user = get_user_model()._default_manager.only(*USER_FIELDS).get(pk=user_id)
+            except get_user_model().DoesNotExist:
+                return None
+            cache.set(_key(user_id), user, getattr(settings, 'AUTH_USER_CACHE_TTL', 60))
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        user = await cache.aget(_key(user_id))
+        if user is None:
+            try:
+                user = await get_user_model()._default_manager.only(*USER_FIELDS).aget(pk=user_id)
+            except get_user_model().DoesNotExist:
+                return None
+            await cache.aset(_key(user_id), user, getattr(settings, 'AUTH_USER_CACHE_TTL', 60))
+        return user if self.user_can_authenticate(user) else None
+
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def forget_user(sender, instance, using=None, **kwargs):
+    key = _key(instance.pk)
+    # Now, and again once committed in case a request cached the old row meanwhile
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key), using=using)
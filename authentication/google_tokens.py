@@ -0,0 +1,189 @@
+"""
+Google ID token verification without a network round trip per login.
+
+id_token.verify_oauth2_token() downloads Google's signing certificates on
+every call. GoogleCerts keeps them in memory and in a JSON file
+(GOOGLE_OAUTH2_CERTS_FILE) for as long as the Cache-Control max-age of the
+response allows. Certificates close to expiry are refreshed in a background
+thread. Expired ones keep being used for GOOGLE_OAUTH2_CERTS_GRACE seconds
+while Google can't be reached, so logins survive brief outages. A token
+signed with an unknown key id, as after a key rotation, triggers one
+synchronous refresh, at most every UNKNOWN_KEY_REFETCH seconds.
+
+verify_google_token() then checks the signature, expiry and audience
+locally with google.auth.jwt, and the issuer like verify_oauth2_token().
+google.auth and requests are imported on first use, keeping them out of
+worker start up.
+"""
+import email.utils
+import json
+import logging
+import os
+import re
+import threading
+import time
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CERTS_URL = 'https://www.googleapis.com/oauth2/v1/certs'
+ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+DEFAULT_MAX_AGE = 3600  # When the response has no caching headers
+REFRESH_BEFORE = 300  # Seconds before expiry to refresh in the background
+UNKNOWN_KEY_REFETCH = 60
+FETCH_TIMEOUT = 5
+CLOCK_SKEW = 10
+
+
+def max_age(headers):
+    """Seconds a certificates response may be cached for, from its Cache-Control, Age and Expires headers"""
+    headers = {name.lower(): value for name, value in headers.items()}
+    cache_control = headers.get('cache-control', '')
+    if re.search(r'\bno-(cache|store)\b', cache_control):
+        return 0
+    match = re.search(r'\bmax-age=(\d+)', cache_control)
+    if match:
+        try:
+            age = int(headers.get('age', 0))
+        except ValueError:
+            age = 0
+        return max(0, int(match.group(1)) - age)
+    if 'expires' in headers:
+        try:
+            return max(0, email.utils.parsedate_to_datetime(headers['expires']).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return 0
+    return DEFAULT_MAX_AGE
+
+
+class GoogleCerts:
+    """Google's signing certificates by key id, cached in memory and on disk"""
+
+    def __init__(self, url=None, path=None, grace=None):
+        self._url = url
+        self._path = path
+        self._grace = grace
+        self.lock = threading.Lock()
+        self.fetch_lock = threading.Lock()
+        self.certs = None
+        self.expires_at = 0.0  # Wall clock, so it survives in the file
+        self.fetched_at = 0.0
+        self.refreshing = False
+        self.fetches = 0
+
+    @property
+    def url(self):
+        return self._url or getattr(settings, 'GOOGLE_OAUTH2_CERTS_URL', CERTS_URL)
+
+    @property
+    def path(self):
+        return self._path if self._path is not None else getattr(settings, 'GOOGLE_OAUTH2_CERTS_FILE', None)
+
+    @property
+    def grace(self):
+        return self._grace if self._grace is not None else getattr(settings, 'GOOGLE_OAUTH2_CERTS_GRACE', 86400)
+
+    def _load(self):
+        """Call with the lock held"""
+        if not self.path:
+            return
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+            self.certs, self.expires_at = dict(saved['certs']), float(saved['expires_at'])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError):
+            logger.warning('Ignoring unreadable Google certificates cache %s', self.path)
+
+    def _save(self, certs, expires_at):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            partial = f'{self.path}.{os.getpid()}.tmp'
+            with open(partial, 'w') as f:
+                json.dump({'expires_at': expires_at, 'certs': certs}, f)
+            os.replace(partial, self.path)
+        except OSError:
+            logger.warning('Could not write the Google certificates cache %s', self.path, exc_info=True)
+
+    def fetch(self):
+        """Download the certificates; concurrent callers share one download"""
+        from google.auth import exceptions
+        from google.auth.transport import requests
+
+        started = time.monotonic()
+        with self.fetch_lock:
+            if self.fetched_at > started:
+                return self.certs
+            response = requests.Request()(self.url, method='GET', timeout=FETCH_TIMEOUT)
+            if response.status != 200:
+                raise exceptions.TransportError(f'Could not fetch certificates at {self.url}: HTTP {response.status}')
+            certs = json.loads(response.data.decode('utf-8'))
+            expires_at = time.time() + max_age(response.headers)
+            with self.lock:
+                self.certs, self.expires_at, self.fetched_at = certs, expires_at, time.monotonic()
+                self.fetches += 1
+            self._save(certs, expires_at)
+            return certs
+
+    def _refresh(self):
+        try:
+            self.fetch()
+        except Exception:
+            logger.warning('Background refresh of Google certificates failed', exc_info=True)
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def _refresh_in_background(self):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        threading.Thread(target=self._refresh, name='google-certs', daemon=True).start()
+
+    def get(self, key_id=None):
+        """Certificates by key id, fetched only when missing, long expired, or lacking key_id"""
+        with self.lock:
+            if self.certs is None:
+                self._load()
+            certs, expires_at, fetched_at = self.certs, self.expires_at, self.fetched_at
+        now = time.time()
+        usable = certs is not None and now < expires_at + self.grace
+        unknown_key = (usable and key_id is not None and key_id not in certs
+                       and time.monotonic() - fetched_at > UNKNOWN_KEY_REFETCH)
+        if not usable or unknown_key:
+            try:
+                return self.fetch()
+            except Exception:
+                if not usable:
+                    raise
+                logger.warning('Could not refetch Google certificates for key %s', key_id, exc_info=True)
+        elif now >= expires_at - REFRESH_BEFORE:
+            self._refresh_in_background()
+        return certs
+
+    def clear(self):
+        with self.lock:
+            self.certs, self.expires_at, self.fetched_at = None, 0.0, 0.0
+
+
+google_certs = GoogleCerts()
+
+
+def verify_google_token(token, audience, certs=None):
+    """
+    The claims of a Google ID token issued for audience. Raises ValueError
+    if the token is malformed, badly signed, expired or for someone else,
+    and GoogleAuthError if Google did not issue it.
+    """
+    from google.auth import exceptions, jwt
+
+    certs = certs or google_certs
+    key_id = jwt.decode_header(token).get('kid')
+    claims = jwt.decode(token, certs=certs.get(key_id), audience=audience, clock_skew_in_seconds=CLOCK_SKEW)
+    if claims.get('iss') not in ISSUERS:
+        raise exceptions.GoogleAuthError(f"Wrong issuer. 'iss' should be one of {ISSUERS}")
+    return claims
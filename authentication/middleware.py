@@ -0,0 +1,35 @@
+import re
+import time
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+
+REFRESHED_AT_KEY = '_refreshed_at'
+
+
+class SessionRefreshMiddleware(MiddlewareMixin):
+    """
+    Sliding session expiry without a session save on every request, which
+    SESSION_SAVE_EVERY_REQUEST did for each one-second game state poll.
+
+    A session is saved, and its expiry pushed back, at most every
+    SESSION_REFRESH_INTERVAL seconds, and never on the read-only routes in
+    SESSION_READ_ONLY_PATHS. Goes after SessionMiddleware, so its response
+    hook runs first and SessionMiddleware saves the session it marks.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.read_only = [re.compile(path) for path in getattr(settings, 'SESSION_READ_ONLY_PATHS', ())]
+
+    def process_response(self, request, response):
+        session = getattr(request, 'session', None)
+        if session is None or session.is_empty():
+            return response
+        if session.modified:
+            # Saved anyway, so stamp it for free
+            session[REFRESHED_AT_KEY] = int(time.time())
+        elif not any(path.match(request.path_info) for path in self.read_only):
+            now = int(time.time())
+            if now - session.get(REFRESHED_AT_KEY, 0) >= getattr(settings, 'SESSION_REFRESH_INTERVAL', 900):
+                session[REFRESHED_AT_KEY] = now
+        return response
@@ -1,3 +1,273 @@
-from django.test import TestCase
+import datetime
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from google.auth import crypt, exceptions, jwt
+from game.models import GameSession
+from .google_tokens import GoogleCerts, google_certs, max_age, verify_google_token
+from .middleware import REFRESHED_AT_KEY
+from .models import User
 
-# Create your tests here.
+CLIENT_ID = 'shield-defense.apps.googleusercontent.com'
+
+
+def signing_key(key_id):
+    """A private key signer and the self-signed certificate Google would publish for it"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, key_id)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=1))
+            .sign(key, hashes.SHA256()))
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    return crypt.RSASigner.from_string(pem, key_id), cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+class KeyServer:
+    """Stands in for Google's certificates endpoint"""
+
+    def __init__(self):
+        self.certs = {}
+        self.headers = {'Cache-Control': 'public, max-age=3600'}
+        self.down = False
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                if server.down:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                body = json.dumps(server.certs).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                for name, value in server.headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}/oauth2/v1/certs'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class GoogleTokenTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.keys = {key_id: signing_key(key_id) for key_id in ('key-1', 'key-2')}
+
+    def setUp(self):
+        self.server = KeyServer()
+        self.addCleanup(self.server.close)
+        self.server.certs = {'key-1': self.keys['key-1'][1]}
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.path = os.path.join(self.dir.name, 'certs.json')
+        self.certs = GoogleCerts(url=self.server.url, path=self.path, grace=600)
+
+    def token(self, key_id='key-1', **claims):
+        now = int(time.time())
+        payload = {'iss': 'https://accounts.google.com', 'aud': CLIENT_ID, 'sub': '1234', 'iat': now, 'exp': now + 600,
+                   'email': 'steve@example.com', 'name': 'Steve Rogers', **claims}
+        return jwt.encode(self.keys[key_id][0], payload)
+
+    def test_verifies_locally_once_keys_are_cached(self):
+        for _ in range(3):
+            claims = verify_google_token(self.token(), CLIENT_ID, certs=self.certs)
+        self.assertEqual(claims['sub'], '1234')
+        self.assertEqual(self.server.requests, 1)
+
+        # Another process starts from the file
+        self.assertEqual(verify_google_token(self.token(), CLIENT_ID, certs=GoogleCerts(url=self.server.url, path=self.path))['sub'], '1234')
+        self.assertEqual(self.server.requests, 1)
+
+    def test_rejects_bad_tokens(self):
+        with self.assertRaises(ValueError):
+            verify_google_token(self.token(aud='someone-else'), CLIENT_ID, certs=self.certs)
+        with self.assertRaises(ValueError):
+            verify_google_token(self.token(exp=int(time.time()) - 3600), CLIENT_ID, certs=self.certs)
+        with self.assertRaises(exceptions.GoogleAuthError):
+            verify_google_token(self.token(iss='https://evil.example.com'), CLIENT_ID, certs=self.certs)
+        forged = self.token().rsplit(b'.', 1)[0] + b'.' + self.token(sub='other').rsplit(b'.', 1)[1]
+        with self.assertRaises(ValueError):
+            verify_google_token(forged, CLIENT_ID, certs=self.certs)
+
+    def test_rotated_key_is_fetched_once(self):
+        verify_google_token(self.token(), CLIENT_ID, certs=self.certs)
+        self.server.certs['key-2'] = self.keys['key-2'][1]
+        self.certs.fetched_at -= 120
+        self.assertEqual(verify_google_token(self.token('key-2'), CLIENT_ID, certs=self.certs)['sub'], '1234')
+        self.assertEqual(self.server.requests, 2)
+
+        # A token claiming an unknown key does not refetch on every attempt
+        del self.server.certs['key-2']
+        os.remove(self.path)
+        self.certs.clear()
+        verify_google_token(self.token(), CLIENT_ID, certs=self.certs)
+        for _ in range(3):
+            with self.assertRaises(ValueError):
+                verify_google_token(self.token('key-2'), CLIENT_ID, certs=self.certs)
+        self.assertEqual(self.server.requests, 3)
+
+    def test_expired_keys_serve_through_an_outage(self):
+        verify_google_token(self.token(), CLIENT_ID, certs=self.certs)
+        self.server.down = True
+        self.certs.expires_at = time.time() - 60
+
+        with self.assertLogs('authentication.google_tokens', 'WARNING'):
+            self.assertEqual(verify_google_token(self.token(), CLIENT_ID, certs=self.certs)['sub'], '1234')
+            deadline = time.monotonic() + 5
+            while self.certs.refreshing and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(self.server.requests, 2)  # The background refresh
+
+        self.certs.expires_at = time.time() - 3600  # Past the grace period
+        with self.assertRaises(exceptions.TransportError):
+            verify_google_token(self.token(), CLIENT_ID, certs=self.certs)
+
+        self.server.down = False
+        self.assertEqual(verify_google_token(self.token(), CLIENT_ID, certs=self.certs)['sub'], '1234')
+        self.assertGreater(self.certs.expires_at, time.time() + 3000)
+
+    def test_cache_lifetime_follows_headers(self):
+        self.assertEqual(max_age({'Cache-Control': 'public, max-age=19845, must-revalidate', 'Age': '45'}), 19800)
+        self.assertEqual(max_age({'cache-control': 'no-cache'}), 0)
+        self.assertAlmostEqual(max_age({'Expires': 'Thu, 01 Jan 2099 00:00:00 GMT'}),
+                               datetime.datetime(2099, 1, 1, tzinfo=datetime.timezone.utc).timestamp() - time.time(),
+                               delta=5)
+        self.assertEqual(max_age({}), 3600)
+
+
+class GoogleLoginTests(TestCase):
+    def test_login_with_a_google_token(self):
+        server = KeyServer()
+        self.addCleanup(server.close)
+        signer, cert = signing_key('key-1')
+        server.certs = {'key-1': cert}
+        now = int(time.time())
+        token = jwt.encode(signer, {
+            'iss': 'accounts.google.com', 'aud': CLIENT_ID, 'sub': 'g-42', 'iat': now, 'exp': now + 600,
+            'email': 'sam@example.com', 'name': 'Sam Wilson', 'picture': 'https://example.com/sam.png',
+        }).decode()
+
+        with tempfile.TemporaryDirectory() as path, override_settings(
+            GOOGLE_OAUTH2_CLIENT_ID=CLIENT_ID, GOOGLE_OAUTH2_CERTS_URL=server.url,
+            GOOGLE_OAUTH2_CERTS_FILE=os.path.join(path, 'certs.json'),
+        ):
+            google_certs.clear()
+            self.addCleanup(google_certs.clear)
+            for _ in range(2):
+                response = self.client.post('/auth/google-auth/', json.dumps({'token': token}), content_type='application/json')
+                self.assertTrue(response.json()['success'], response.json())
+
+        user = User.objects.get(google_id='g-42')
+        self.assertEqual((user.username, user.first_name, user.avatar_url), ('sam', 'Sam', 'https://example.com/sam.png'))
+        self.assertEqual(server.requests, 1)
+
+
+class SessionRefreshTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='poller')
+        self.game = GameSession.objects.create(player=self.user, status='lost')
+
+    def session_writes(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response, [q['sql'] for q in queries if 'django_session' in q['sql'] and not q['sql'].startswith('SELECT')]
+
+    def test_polling_does_not_save_the_session(self):
+        self.client.force_login(self.user)
+        for path in (f'/game/api/game/state/{self.game.id}/', f'/api/game/state/{self.game.id}/'):
+            for _ in range(3):
+                response, writes = self.session_writes(path)
+                self.assertEqual(writes, [])
+                self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+        # Other routes push the expiry back once per interval
+        self.assertEqual(len(self.session_writes('/game/leaderboard/')[1]), 1)
+        self.assertEqual(self.session_writes('/game/leaderboard/')[1], [])
+        session = self.client.session
+        session[REFRESHED_AT_KEY] -= settings.SESSION_REFRESH_INTERVAL
+        session.save()
+        self.assertEqual(len(self.session_writes('/game/leaderboard/')[1]), 1)
+
+    def test_logging_out_revokes_a_copied_session_cookie(self):
+        self.client.force_login(self.user)
+        copied = Client()
+        copied.cookies[settings.SESSION_COOKIE_NAME] = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.assertTrue(copied.get('/auth/profile/').wsgi_request.user.is_authenticated)
+        self.client.get('/auth/logout/')
+        self.assertFalse(copied.get('/game/leaderboard/').wsgi_request.user.is_authenticated)
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_signed_cookie_sessions_stay_out_of_the_database(self):
+        self.client.force_login(self.user)
+        self.assertFalse(self.session_writes('/game/leaderboard/')[1])
+        self.assertTrue(self.client.get('/auth/profile/').wsgi_request.user.is_authenticated)
+        self.client.get('/auth/logout/')
+        self.assertFalse(self.client.get('/game/leaderboard/').wsgi_request.user.is_authenticated)
+
+
+class CachedUserTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='cached', password='secret', total_score=1234)
+        self.game = GameSession.objects.create(player=self.user, status='lost')
+        self.client.force_login(self.user)
+
+    def user_queries(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        return response, [q['sql'] for q in queries if 'authentication_user' in q['sql']]
+
+    def test_polling_resolves_the_user_without_queries(self):
+        for path in (f'/game/api/game/state/{self.game.id}/', f'/api/game/state/{self.game.id}/'):
+            self.user_queries(path)
+            response, queries = self.user_queries(path)
+            self.assertTrue(response.json()['success'])
+            self.assertEqual(queries, [])
+
+    def test_changes_reach_the_cached_user(self):
+        self.user_queries('/game/leaderboard/')
+        self.user.avatar_url = 'https://example.com/new.png'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        response, queries = self.user_queries('/game/leaderboard/')
+        self.assertEqual(response.wsgi_request.user.avatar_url, 'https://example.com/new.png')
+        self.assertEqual(len(queries), 1)
+
+        # A new password still ends the session
+        self.user.set_password('changed')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.client.get('/game/leaderboard/').status_code, 302)
+
+    def test_profile_shows_the_full_row(self):
+        self.user_queries('/game/leaderboard/')
+        response = self.client.get('/auth/profile/')
+        self.assertContains(response, '1234')
@@ -5,11 +5,11 @@ from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from google.auth.transport import requests
-from google.oauth2 import id_token
 from django.conf import settings
 from .models import User
+from .google_tokens import verify_google_token
 from django.contrib import messages
+from game.history import player_games
 
 def login_view(request):
     if request.user.is_authenticated:
@@ -60,10 +60,8 @@ def google_auth(request):
         data = json.loads(request.body)
         token = data.get('token')
         
-        # Verify the Google token
-        idinfo = id_token.verify_oauth2_token(
-            token, requests.Request(), settings.GOOGLE_OAUTH2_CLIENT_ID
-        )
+        # Verify the Google token against cached signing keys
+        idinfo = verify_google_token(token, settings.GOOGLE_OAUTH2_CLIENT_ID)
         
         # Get user info from Google
         google_id = idinfo['sub']
@@ -114,5 +112,7 @@ def logout_view(request):
 @login_required
 def profile_view(request):
     return render(request, 'authentication/profile.html', {
-        'user': request.user
+        # request.user leaves out the stats columns, see backends.py
+        'user': User.objects.get(pk=request.user.pk),
+        'recent_games': player_games(request.user)
     })
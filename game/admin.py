@@ -1,26 +1,63 @@
+from django.conf import settings
 from django.contrib import admin
-from .models import GameSession, Shield, GameEvent, Leaderboard
+from .changelist import EstimatedCountPaginator, IndexedDateQuerySet
+from .events import archive_events, retention_cutoff
+from .models import GameSession, Shield, GameEvent, Leaderboard, LeaderboardRollup, ArchivedGame, PostGameJob
+from .reaper import end_abandoned_games, idle_cutoff
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables with millions of rows, see changelist.py"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return IndexedDateQuerySet(model=queryset.model, query=queryset.query.chain(), using=queryset._db)
 
 @admin.register(GameSession)
-class GameSessionAdmin(admin.ModelAdmin):
+class GameSessionAdmin(LargeTableAdmin):
     list_display = ('id', 'player', 'status', 'score', 'hostage_timer', 'time_survived', 'game_start_time')
     list_filter = ('status', 'game_start_time')
+    list_select_related = ('player',)
+    raw_id_fields = ('player',)
     search_fields = ('player__username',)
     readonly_fields = ('game_start_time', 'game_end_time')
+    date_hierarchy = 'game_start_time'
     ordering = ('-game_start_time',)
+    actions = ['end_stale_games']
+    
+    @admin.action(description='End selected games idle past the idle timeout')
+    def end_stale_games(self, request, queryset):
+        # In batches with one bulk update each, scored like the reaper does
+        ended = end_abandoned_games(queryset.filter(status='active', last_activity__lt=idle_cutoff()), reason='ended_by_admin')
+        self.message_user(request, f'Ended {ended} stale games.')
 
 @admin.register(Shield)
-class ShieldAdmin(admin.ModelAdmin):
+class ShieldAdmin(LargeTableAdmin):
     list_display = ('id', 'game_session', 'shield_type', 'position_x', 'position_y', 'placed_at', 'is_active')
     list_filter = ('shield_type', 'is_active', 'placed_at')
+    list_select_related = ('game_session__player',)
+    raw_id_fields = ('game_session',)
     search_fields = ('game_session__player__username',)
+    date_hierarchy = 'placed_at'
 
 @admin.register(GameEvent)
-class GameEventAdmin(admin.ModelAdmin):
+class GameEventAdmin(LargeTableAdmin):
     list_display = ('id', 'game_session', 'event_type', 'timestamp')
     list_filter = ('event_type', 'timestamp')
+    list_select_related = ('game_session__player',)
+    raw_id_fields = ('game_session',)
     search_fields = ('game_session__player__username',)
     readonly_fields = ('timestamp',)
+    date_hierarchy = 'timestamp'
+    actions = ['purge_old_events']
+    
+    @admin.action(description='Archive and delete selected events past the retention window')
+    def purge_old_events(self, request, queryset):
+        # Chunked like archive_events, so the rows land in the cold archive first
+        moved = archive_events(retention_cutoff(), events=queryset.order_by())
+        self.message_user(request, f'Archived {moved} events older than {settings.GAME_EVENT_RETENTION_DAYS} days.')
 
 @admin.register(Leaderboard)
 class LeaderboardAdmin(admin.ModelAdmin):
@@ -28,3 +65,27 @@ class LeaderboardAdmin(admin.ModelAdmin):
     search_fields = ('player__username',)
     readonly_fields = ('last_played',)
     ordering = ('-highest_score',)
+
+@admin.register(LeaderboardRollup)
+class LeaderboardRollupAdmin(admin.ModelAdmin):
+    list_display = ('player', 'period', 'period_start', 'highest_score', 'total_games', 'games_won', 'last_played')
+    list_filter = ('period',)
+    search_fields = ('player__username',)
+    ordering = ('-period_start', '-highest_score')
+
+@admin.register(ArchivedGame)
+class ArchivedGameAdmin(admin.ModelAdmin):
+    list_display = ('id', 'player', 'status', 'score', 'time_survived', 'game_end_time', 'archived_at')
+    list_filter = ('status',)
+    search_fields = ('player__username',)
+    exclude = ('payload',)
+    readonly_fields = ('archived_at',)
+    ordering = ('-game_end_time',)
+
+@admin.register(PostGameJob)
+class PostGameJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'game', 'created_at', 'attempts', 'last_error')
+    list_filter = ('attempts',)
+    raw_id_fields = ('game',)
+    readonly_fields = ('created_at',)
+    ordering = ('id',)
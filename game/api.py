@@ -0,0 +1,198 @@
+"""
+The game API without its request handling.
+
+views.py serves these from sync views under WSGI and async_views.py from
+async views under ASGI. Both only unpack the request, run the functions
+marked as writes on the group commit writer (see writer.py) and wrap the
+returned dicts in a JsonResponse.
+"""
+from django.http import Http404
+from django.utils import timezone
+from .events import record_event
+from .jobs import enqueue
+from .models import GameSession, Leaderboard
+from .reaper import end_abandoned_games
+from .replay import ReplayReader
+from .rollups import PERIODS, window_page
+from . import ranking
+import json
+
+RANKED_FIELDS = ('rank', 'highest_score', 'games_won', 'total_games', 'win_rate')
+
+
+def new_game(user):
+    """Write: end the player's active games, scoring them as losses, and start a new one"""
+    end_abandoned_games(GameSession.objects.filter(
+        player=user,
+        status='active'
+    ), reason='new_game')
+
+    return GameSession.objects.create(
+        player=user,
+        status='active',
+        hostage_timer=40.0,
+        ultron_position_x=0,
+        ultron_position_y=0,
+        ultron_target_x=13,
+        ultron_target_y=13
+    )
+
+
+def game_started(game):
+    return {
+        'success': True,
+        'game_id': game.id,
+        'ultron_position': [game.ultron_position_x, game.ultron_position_y],
+        'target_position': [game.ultron_target_x, game.ultron_target_y],
+        'hostage_timer': game.hostage_timer
+    }
+
+
+def placement_error(game, position_x, position_y):
+    """Why a shield cannot be placed on a cell, None if it can"""
+    if not (0 <= position_x <= 14 and 0 <= position_y <= 14):
+        return 'Invalid position'
+    if (position_x, position_y) in game.board_state:
+        return 'Position already occupied'
+    if position_x == game.ultron_position_x and position_y == game.ultron_position_y:
+        return 'Cannot place shield on Ultron'
+    return None
+
+
+def shield_placed(game, shield, shield_type, position_x, position_y):
+    record_event(game, 'shield_placed', {
+        'shield_type': shield_type,
+        'position': [position_x, position_y]
+    })
+    return {
+        'success': True,
+        'shield_id': shield.id
+    }
+
+
+def advance_game(game):
+    """
+    Write: move a polled game on in place. The HTTP API has no tick loop, so
+    polling drives the game (e.g. on PythonAnywhere's free tier). The game is
+    reloaded first, so a retried group commit moves it on only once. The
+    caller records the tick with replay.record_tick once the write has
+    committed.
+    """
+    from game.management.commands.run_game_loop import Command as GameLoopCommand
+
+    game.refresh_from_db()
+    if game.status != 'active':
+        return
+    game.last_activity = timezone.now()  # Saved by advance_game
+    GameLoopCommand().advance_game(game)
+
+
+def game_state(game):
+    return {
+        'success': True,
+        'game_status': game.status,
+        'ultron_position': [game.ultron_position_x, game.ultron_position_y],
+        'target_position': [game.ultron_target_x, game.ultron_target_y],
+        'hostage_timer': game.hostage_timer,
+        'score': game.score,
+        'shields': game.board_state.shields()
+    }
+
+
+def score_game(game, won):
+    """Set the result of a game the client ended"""
+    game.time_survived = (timezone.now() - game.game_start_time).total_seconds()
+    if won:
+        game.status = 'won'
+        game.score = int(game.hostage_timer * 10)  # Score based on final timer
+    else:
+        game.status = 'lost'
+        game.score = int(game.time_survived * 5)  # Score based on survival time
+    game.game_end_time = timezone.now()
+
+
+def save_result(game):
+    """
+    Write: only the result is written here; the leaderboard and player stats
+    are applied in batches by the post-game queue (see jobs.py)
+    """
+    game.save()
+    enqueue(game)
+
+
+def game_ended(game, won):
+    record_event(game, 'game_won' if won else 'game_lost', {
+        'final_score': game.score,
+        'time_survived': game.time_survived,
+        'hostage_timer': game.hostage_timer
+    })
+    return {
+        'success': True,
+        'final_score': game.score,
+        'time_survived': game.time_survived,
+        'won': won
+    }
+
+
+def open_replay(game_id):
+    """ReplayReader of a finished game, Http404 without one"""
+    try:
+        reader = ReplayReader(game_id)
+    except (FileNotFoundError, ValueError):
+        raise Http404('No replay for this game')
+    if not reader.finished():
+        reader.close()
+        raise Http404('Game is still in progress')
+    return reader
+
+
+def replay_lines(reader, params):
+    """Frames as newline-delimited JSON from ?from=<tick>, closing the reader once done"""
+    try:
+        start = int(params.get('from', 0))
+    except ValueError:
+        start = 0
+    with reader:
+        for frame in reader.frames(start):
+            yield json.dumps(frame) + '\n'
+
+
+def _ranked_entry(entry):
+    return dict(
+        {name: getattr(entry, name) for name in RANKED_FIELDS},
+        player=entry.player.username
+    )
+
+
+def leaderboard_page(params, user):
+    """
+    Ranked leaderboard entries for the query parameters, see the leaderboard
+    views. Raises ValueError for a malformed cursor or limit.
+    """
+    limit = min(max(int(params.get('limit', ranking.PAGE_SIZE)), 1), 100)
+    period = params.get('period')
+    if period in PERIODS:
+        page = window_page(period, params.get('after'), limit)
+        return {
+            'success': True,
+            'entries': [
+                dict({name: entry[name] for name in RANKED_FIELDS}, player=entry['player']['username'])
+                for entry in page['entries']
+            ],
+            'next': page['next']
+        }
+    if params.get('around') == 'me':
+        entry = Leaderboard.objects.select_related('player').filter(player=user).first()
+        if entry is None:
+            return {'success': True, 'entries': [], 'next': None}
+        entries = ranking.around(entry, count=limit // 2)
+        next_cursor = None
+    else:
+        cursor = params.get('after')
+        cursor = ranking.parse_cursor(cursor) if cursor else None
+        entries, next_cursor = ranking.page(cursor, limit)
+    return {
+        'success': True,
+        'entries': [_ranked_entry(entry) for entry in entries],
+        'next': next_cursor
+    }
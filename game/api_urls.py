@@ -1,9 +1,18 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+
+# The async views under an ASGI server (asgi.py turns GAME_API_ASYNC on),
+# the sync ones under WSGI, where async views would cost a thread hop each
+if settings.GAME_API_ASYNC:
+    from . import async_views as views
+else:
+    from . import views
 
 urlpatterns = [
     path('start/', views.start_game, name='api_start_game'),
     path('place-shield/', views.place_shield, name='api_place_shield'),
     path('state/<int:game_id>/', views.get_game_state, name='api_game_state'),
     path('end/', views.end_game, name='api_end_game'),
+    path('replay/<int:game_id>/', views.replay, name='api_game_replay'),
+    path('leaderboard/', views.leaderboard, name='api_leaderboard'),
 ]
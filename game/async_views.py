@@ -0,0 +1,130 @@
+"""
+Async versions of the game API views, served under ASGI (see api_urls.py).
+
+These serve the same JSON as the views in views.py, both built from api.py,
+but use Django's async ORM methods for reads, so under ASGI a single worker
+can handle many polling clients without a thread hop per request. Writes
+are awaited on the group commit writer (see writer.py).
+"""
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from .models import GameSession
+from .writer import awrite
+from .replay import record_tick
+from .jobs import schedule_drain
+from . import api
+from asgiref.sync import sync_to_async
+import json
+
+@login_required
+@csrf_exempt
+@require_http_methods(["POST"])
+async def start_game(request):
+    """Start a new game session"""
+    try:
+        game = await awrite(api.new_game, await request.auser())
+        return JsonResponse(api.game_started(game))
+
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+
+@login_required
+@csrf_exempt
+@require_http_methods(["POST"])
+async def place_shield(request):
+    """Place a shield on the game board"""
+    try:
+        user = await request.auser()
+        data = json.loads(request.body)
+        game_id = data.get('game_id')
+        shield_type = data.get('shield_type')
+        position_x = data.get('position_x')
+        position_y = data.get('position_y')
+
+        game = await aget_object_or_404(GameSession, id=game_id, player=user, status='active')
+        error = api.placement_error(game, position_x, position_y)
+        if error:
+            return JsonResponse({'success': False, 'error': error})
+
+        # Every shield type is destroyed after one hit
+        shield = await awrite(game.place_shield, shield_type, position_x, position_y)
+        return JsonResponse(api.shield_placed(game, shield, shield_type, position_x, position_y))
+
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+
+@login_required
+@require_http_methods(["GET"])
+async def get_game_state(request, game_id):
+    """Get current game state - also processes game logic for PythonAnywhere compatibility"""
+    try:
+        user = await request.auser()
+        game = await aget_object_or_404(GameSession, id=game_id, player=user)
+
+        if game.status == 'active':
+            try:
+                await awrite(api.advance_game, game)  # Updates game in place
+                await sync_to_async(record_tick)(game)
+                if game.status != 'active':
+                    schedule_drain()
+            except Exception as e:
+                print(f"Error processing game: {e}")
+
+        return JsonResponse(api.game_state(game))
+
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+
+@login_required
+@csrf_exempt
+@require_http_methods(["POST"])
+async def end_game(request):
+    """End the current game"""
+    try:
+        user = await request.auser()
+        data = json.loads(request.body)
+        game_id = data.get('game_id')
+        won = data.get('won', False)
+
+        game = await aget_object_or_404(GameSession, id=game_id, player=user, status='active')
+        api.score_game(game, won)
+        await awrite(api.save_result, game)
+        schedule_drain()
+        return JsonResponse(api.game_ended(game, won))
+
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+
+@require_http_methods(["GET"])
+async def replay(request, game_id):
+    """
+    Stream a finished game's recorded frames as newline-delimited JSON.
+    Frames are read from the replay files only; ?from=<tick> starts mid-game.
+    """
+    reader = api.open_replay(game_id)
+
+    async def frames():
+        for line in api.replay_lines(reader, request.GET):
+            yield line
+
+    response = StreamingHttpResponse(frames(), content_type='application/x-ndjson')
+    response['X-Replay-Ticks'] = str(len(reader))
+    return response
+
+@login_required
+@require_http_methods(["GET"])
+async def leaderboard(request):
+    """
+    Ranked leaderboard entries. ?after=<cursor> pages on from the cursor a
+    previous response returned as 'next'; ?around=me returns the players
+    just above and below the current user instead. ?period=day|week ranks
+    today's or this week's results rather than all time.
+    """
+    try:
+        page = await sync_to_async(api.leaderboard_page)(request.GET, await request.auser())
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid cursor or limit'}, status=400)
+    return JsonResponse(page)
@@ -0,0 +1,121 @@
+"""
+Compact binary encoding of a game's active shields.
+
+The board is stored on GameSession as one bitmask per shield type (225 bits
+each for the 15x15 grid) plus an optional list of cells whose durability is
+not the default, so reading a game's full state is a single-row read.
+
+Layout: version byte, then a little-endian mask per type in SHIELD_TYPES
+order, then (cell, durability) byte pairs. Cell index is y * GRID_SIZE + x.
+"""
+from typing import Dict, List, Optional, Tuple
+
+GRID_SIZE = 15
+CELLS = GRID_SIZE * GRID_SIZE
+MASK_BYTES = (CELLS + 7) // 8
+SHIELD_TYPES = ('blue', 'yellow', 'red')
+VERSION = 1
+DEFAULT_DURABILITY = 1
+
+
+def cell_index(x: int, y: int) -> int:
+    return y * GRID_SIZE + x
+
+
+def cell_position(cell: int) -> Tuple[int, int]:
+    return cell % GRID_SIZE, cell // GRID_SIZE
+
+
+def iter_cells(mask: int):
+    """Yield the cell index of every set bit, lowest first"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class Board:
+    """Active shields of one game as a bitmask per shield type"""
+
+    def __init__(self):
+        self.masks: Dict[str, int] = {shield_type: 0 for shield_type in SHIELD_TYPES}
+        self.durability: Dict[int, int] = {}  # Only cells not at DEFAULT_DURABILITY
+
+    @classmethod
+    def decode(cls, data) -> 'Board':
+        board = cls()
+        if not data:
+            return board
+        data = bytes(data)
+        if data[0] != VERSION:
+            raise ValueError(f'Unknown board encoding version {data[0]}')
+        offset = 1
+        for shield_type in SHIELD_TYPES:
+            board.masks[shield_type] = int.from_bytes(data[offset:offset + MASK_BYTES], 'little')
+            offset += MASK_BYTES
+        for i in range(offset, len(data) - 1, 2):
+            board.durability[data[i]] = data[i + 1]
+        return board
+
+    @classmethod
+    def from_shields(cls, shields: List[dict]) -> 'Board':
+        """Build a board from shield dicts with 'type' and 'position' keys"""
+        board = cls()
+        for shield in shields:
+            board.add(shield['type'], *shield['position'], durability=shield.get('durability', DEFAULT_DURABILITY))
+        return board
+
+    def encode(self) -> bytes:
+        parts = [bytes([VERSION])]
+        for shield_type in SHIELD_TYPES:
+            parts.append(self.masks[shield_type].to_bytes(MASK_BYTES, 'little'))
+        for cell, durability in sorted(self.durability.items()):
+            parts.append(bytes([cell, max(0, min(durability, 255))]))
+        return b''.join(parts)
+
+    def add(self, shield_type: str, x: int, y: int, durability: int = DEFAULT_DURABILITY):
+        """Put a shield on a cell, replacing whatever was there"""
+        self.remove(x, y)
+        cell = cell_index(x, y)
+        self.masks[shield_type] |= 1 << cell
+        if durability != DEFAULT_DURABILITY:
+            self.durability[cell] = durability
+
+    def remove(self, x: int, y: int):
+        cell = cell_index(x, y)
+        bit = 1 << cell
+        for shield_type in SHIELD_TYPES:
+            self.masks[shield_type] &= ~bit
+        self.durability.pop(cell, None)
+
+    def shield_at(self, x: int, y: int) -> Optional[str]:
+        bit = 1 << cell_index(x, y)
+        for shield_type in SHIELD_TYPES:
+            if self.masks[shield_type] & bit:
+                return shield_type
+        return None
+
+    def durability_at(self, x: int, y: int) -> int:
+        return self.durability.get(cell_index(x, y), DEFAULT_DURABILITY)
+
+    def __contains__(self, position) -> bool:
+        return self.shield_at(*position) is not None
+
+    def __len__(self) -> int:
+        return sum(bin(mask).count('1') for mask in self.masks.values())
+
+    def positions(self, shield_type: str) -> List[Tuple[int, int]]:
+        return [cell_position(cell) for cell in iter_cells(self.masks[shield_type])]
+
+    def obstacles(self) -> List[Tuple[int, int]]:
+        """Blocked cells in the format UltronAI.find_path expects"""
+        return self.positions('blue')
+
+    def shields(self) -> List[dict]:
+        """Shield dicts in the format sent to clients and UltronAI.get_next_move"""
+        shields = []
+        for shield_type in SHIELD_TYPES:
+            for cell in iter_cells(self.masks[shield_type]):
+                x, y = cell_position(cell)
+                shields.append({'type': shield_type, 'position': [x, y]})
+        return shields
@@ -0,0 +1,94 @@
+"""
+Admin changelists that stay fast on tables with millions of rows.
+
+The admin paginates with a COUNT(*) of the whole list, and its date
+hierarchy finds the years, months or days to offer with a SELECT DISTINCT
+over every matching row. EstimatedCountPaginator counts exactly only up to
+ADMIN_COUNT_LIMIT rows. Past that, an unfiltered list is estimated from its
+primary key range and a filtered one is cut at the limit, so pages past it
+are not linked. IndexedDateQuerySet lists the periods of the date hierarchy
+with one ordered, LIMIT 1 lookup per period on the field's index instead.
+"""
+import datetime
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import models
+from django.db.models import Max, Min
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+KINDS = ('year', 'month', 'day')
+
+
+def estimated_rows(queryset):
+    """Rows in the queryset's table estimated from its integer primary key range, None if it has none"""
+    if not isinstance(queryset.model._meta.pk, models.IntegerField):
+        return None
+    span = queryset.model._default_manager.using(queryset.db).aggregate(first=Min('pk'), last=Max('pk'))
+    if span['first'] is None:
+        return 0
+    return span['last'] - span['first'] + 1
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator counting at most ADMIN_COUNT_LIMIT rows, see the module docstring"""
+
+    @cached_property
+    def count(self):
+        limit = getattr(settings, 'ADMIN_COUNT_LIMIT', 10000)
+        queryset = self.object_list
+        counted = queryset.order_by()[:limit + 1].count()
+        if counted <= limit:
+            return counted
+        if not queryset.query.where:
+            return max(estimated_rows(queryset) or 0, limit)
+        return limit
+
+
+def _truncate(value, kind, tz):
+    if isinstance(value, datetime.datetime) and tz is not None:
+        value = timezone.localtime(value, tz).replace(tzinfo=None)
+    value = value.replace(month=1 if kind == 'year' else value.month, day=1 if kind != 'day' else value.day)
+    if isinstance(value, datetime.datetime):
+        value = value.replace(hour=0, minute=0, second=0, microsecond=0)
+    return value
+
+
+def _following(start, kind):
+    if kind == 'day':
+        return start + datetime.timedelta(days=1)
+    if kind == 'month' and start.month < 12:
+        return start.replace(month=start.month + 1)
+    return start.replace(year=start.year + 1, month=1)
+
+
+class IndexedDateQuerySet(models.QuerySet):
+    """QuerySet whose dates() and datetimes() make one index lookup per period instead of reading every row"""
+
+    def _periods(self, field_name, kind, order, tz):
+        if kind not in KINDS:
+            return None
+        rows = self.order_by(field_name).values_list(field_name, flat=True)
+        periods = []
+        value = rows.filter(**{f'{field_name}__isnull': False}).first()
+        while value is not None:
+            start = _truncate(value, kind, tz)
+            following = _following(start, kind)
+            periods.append(timezone.make_aware(start, tz) if tz is not None else start)
+            value = rows.filter(**{
+                f'{field_name}__gte': timezone.make_aware(following, tz) if tz is not None else following,
+            }).first()
+        return periods[::-1] if order == 'DESC' else periods
+
+    def dates(self, field_name, kind, order='ASC'):
+        periods = self._periods(field_name, kind, order, None)
+        if periods is None:
+            return super().dates(field_name, kind, order)
+        return [period.date() if isinstance(period, datetime.datetime) else period for period in periods]
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None):
+        tz = (tzinfo or timezone.get_current_timezone()) if settings.USE_TZ else None
+        periods = self._periods(field_name, kind, order, tz)
+        if periods is None:
+            return super().datetimes(field_name, kind, order, tzinfo)
+        return periods
@@ -0,0 +1,357 @@
+"""
+Channel layer for running several worker processes on one host without Redis.
+
+Every layer instance binds a Unix datagram socket under ``path``. Group
+membership is kept as empty files in ``path/groups/<group>/<channel>``, so any
+process can see where a group's channels live. group_send puts one entry per
+destination process (not per channel) on an outgoing queue, and everything
+queued for the same process during one event loop iteration is packed into as
+few datagrams as possible.
+
+Process-specific channels (the ``<prefix>.<process>!<id>`` names consumers get
+from new_channel) are delivered straight to their owning process. Plain named
+channels go to one of the processes currently receiving on them, or are kept
+locally if nobody is.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import socket
+import string
+import tempfile
+import time
+import uuid
+from copy import deepcopy
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+MAX_DATAGRAM = 64 * 1024
+# Directory mtimes come from a coarse clock, so a listing cached within this
+# many nanoseconds of the last change may miss an entry
+MTIME_GRANULARITY_NS = 20_000_000
+CLEANUP_INTERVAL = 1.0  # Seconds between sweeps of expired local messages
+
+
+def encode(batch):
+    if msgpack is not None:
+        return msgpack.packb(batch, use_bin_type=True)
+    return json.dumps(batch).encode()
+
+
+def decode(data):
+    if msgpack is not None:
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+class LocalChannelLayer(BaseChannelLayer):
+    """Channel layer shared by the processes on one host through Unix sockets"""
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path=None, expiry=60, group_expiry=86400, capacity=100,
+                 channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.path = str(path or os.path.join(tempfile.gettempdir(), 'shield_defense_channels'))
+        self.group_expiry = group_expiry
+        self.dropped = 0
+        self._reset()
+
+    def _reset(self):
+        self.client_prefix = uuid.uuid4().hex[:12]
+        self.socket_path = self._socket_path(self.client_prefix)
+        self.channels = {}  # Local channel name -> asyncio.Queue
+        self.outgoing = {}  # Process prefix -> [[channels, expires, message], ...]
+        self.group_cache = {}  # Group -> (directory mtime or None, channel names)
+        self.receiving = set()  # Plain channels this process is registered for
+        self._pid = os.getpid()
+        self._sock = None
+        self._loop = None
+        self._flush_scheduled = False
+        self._last_cleanup = time.monotonic()
+
+    # Paths
+
+    def _socket_path(self, process):
+        return os.path.join(self.path, 'sockets', f'{process}.sock')
+
+    def _group_dir(self, group):
+        return os.path.join(self.path, 'groups', group)
+
+    def _receivers_dir(self, channel):
+        return os.path.join(self.path, 'receivers', channel)
+
+    def process_of(self, channel):
+        """Return the process owning a specific channel, or None for a plain channel"""
+        if '!' not in channel:
+            return None
+        return channel[:channel.index('!')].rsplit('.', 1)[-1]
+
+    # Socket handling
+
+    def _bind(self):
+        """Bind our socket and read from it on the running event loop"""
+        if self._pid != os.getpid():
+            # Forked after binding; the socket belongs to the parent
+            self._reset()
+        loop = asyncio.get_running_loop()
+        if self._sock is None:
+            os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            sock.bind(self.socket_path)
+            self._sock = sock
+        if self._loop is not loop:
+            if self._loop is not None and not self._loop.is_closed():
+                self._loop.remove_reader(self._sock.fileno())
+            # Queues created on another loop cannot be awaited on this one
+            self.channels = {}
+            self.outgoing = {}
+            self._flush_scheduled = False
+            loop.add_reader(self._sock.fileno(), self._on_readable)
+            self._loop = loop
+
+    def _on_readable(self):
+        while True:
+            try:
+                data = self._sock.recv(MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                return
+            for channels, expires, message in decode(data):
+                for channel in channels:
+                    self._deliver(channel, expires, message)
+
+    def _schedule_flush(self):
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._loop.call_soon(self._flush_outgoing)
+
+    def _flush_outgoing(self):
+        """Send everything queued this loop iteration, one batch per process"""
+        self._flush_scheduled = False
+        outgoing, self.outgoing = self.outgoing, {}
+        for process, entries in outgoing.items():
+            for datagram in self._pack(entries):
+                self._send_datagram(process, datagram)
+
+    def _pack(self, entries):
+        """Encode entries into datagrams no larger than MAX_DATAGRAM"""
+        data = encode(entries)
+        if len(data) <= MAX_DATAGRAM:
+            return [data]
+        if len(entries) == 1:
+            logger.warning('Dropping %d byte message: too large for the local channel layer', len(data))
+            self.dropped += 1
+            return []
+        middle = len(entries) // 2
+        return self._pack(entries[:middle]) + self._pack(entries[middle:])
+
+    def _send_datagram(self, process, data):
+        try:
+            self._sock.sendto(data, self._socket_path(process))
+        except (FileNotFoundError, ConnectionRefusedError):
+            # The process is gone
+            self._forget_process(process)
+        except BlockingIOError:
+            # The receiver is not keeping up; treat it like a full channel
+            self.dropped += 1
+
+    def _forget_process(self, process):
+        """Remove a dead process's socket and group memberships"""
+        try:
+            os.unlink(self._socket_path(process))
+        except FileNotFoundError:
+            pass
+        for group, (mtime, channels) in list(self.group_cache.items()):
+            for channel in channels:
+                if self.process_of(channel) == process:
+                    self._unlink(os.path.join(self._group_dir(group), channel))
+            self.group_cache.pop(group, None)
+
+    # Local queues
+
+    def _queue(self, channel):
+        queue = self.channels.get(channel)
+        if queue is None:
+            queue = self.channels[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+        return queue
+
+    def _deliver(self, channel, expires, message, raise_full=False):
+        try:
+            self._queue(channel).put_nowait((expires, deepcopy(message)))
+        except asyncio.QueueFull:
+            if raise_full:
+                raise ChannelFull(channel)
+            self.dropped += 1
+
+    def _clean_expired(self):
+        """Drop local queues whose oldest message has expired"""
+        now = time.monotonic()
+        if now - self._last_cleanup < CLEANUP_INTERVAL:
+            return
+        self._last_cleanup = now
+        expired_before = time.time()
+        for channel, queue in list(self.channels.items()):
+            while not queue.empty() and queue._queue[0][0] < expired_before:
+                queue.get_nowait()
+            if queue.empty() and not queue._getters:
+                self.channels.pop(channel, None)
+
+    def _route(self, process, channels, message, raise_full=False):
+        expires = time.time() + self.expiry
+        if process == self.client_prefix:
+            for channel in channels:
+                self._deliver(channel, expires, message, raise_full)
+            return
+        self.outgoing.setdefault(process, []).append([channels, expires, message])
+        self._schedule_flush()
+
+    def _pick_receiver(self, channel):
+        """Choose a process receiving on a plain channel, preferring this one"""
+        if channel in self.receiving:
+            return self.client_prefix
+        try:
+            processes = os.listdir(self._receivers_dir(channel))
+        except FileNotFoundError:
+            processes = []
+        return random.choice(processes) if processes else self.client_prefix
+
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    # Channel layer API
+
+    async def new_channel(self, prefix='specific.'):
+        """Return a new channel name owned by this process"""
+        return '%s.%s!%s' % (
+            prefix,
+            self.client_prefix,
+            ''.join(random.choice(string.ascii_letters) for i in range(12)),
+        )
+
+    async def send(self, channel, message):
+        """Send a message onto a (general or specific) channel"""
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        assert '__asgi_channel__' not in message
+        self._bind()
+        process = self.process_of(channel) or self._pick_receiver(channel)
+        self._route(process, [channel], message, raise_full=True)
+
+    async def receive(self, channel):
+        """Receive the first message that arrives on the channel"""
+        self.require_valid_channel_name(channel)
+        self._bind()
+        if self.process_of(channel) is None and channel not in self.receiving:
+            directory = self._receivers_dir(channel)
+            os.makedirs(directory, exist_ok=True)
+            open(os.path.join(directory, self.client_prefix), 'a').close()
+            self.receiving.add(channel)
+
+        queue = self._queue(channel)
+        try:
+            while True:
+                expires, message = await queue.get()
+                if expires >= time.time():
+                    return message
+        finally:
+            if queue.empty() and not queue._getters:
+                self.channels.pop(channel, None)
+
+    async def group_add(self, group, channel):
+        """Add a channel to a group"""
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        directory = self._group_dir(group)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, channel)
+        open(path, 'a').close()
+        os.utime(path)
+        self.group_cache.pop(group, None)
+
+    async def group_discard(self, group, channel):
+        """Remove a channel from a group"""
+        self.require_valid_channel_name(channel)
+        self.require_valid_group_name(group)
+        self._unlink(os.path.join(self._group_dir(group), channel))
+        self.group_cache.pop(group, None)
+
+    async def group_send(self, group, message):
+        """Send a message to every channel in a group, batched per process"""
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_group_name(group)
+        self._bind()
+        self._clean_expired()
+        by_process = {}
+        for channel in self._group_channels(group):
+            process = self.process_of(channel) or self._pick_receiver(channel)
+            by_process.setdefault(process, []).append(channel)
+        for process, channels in by_process.items():
+            self._route(process, channels, message)
+
+    def _group_channels(self, group):
+        """List a group's channels, reusing the last listing while the directory is unchanged"""
+        directory = self._group_dir(group)
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        cached = self.group_cache.get(group)
+        if cached and cached[0] is not None and cached[0] == mtime:
+            return cached[1]
+
+        channels = []
+        expired_before = time.time() - self.group_expiry
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.stat().st_mtime < expired_before:
+                        self._unlink(entry.path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                channels.append(entry.name)
+
+        # Only reuse the listing once the directory's mtime has settled
+        mtime = os.stat(directory).st_mtime_ns
+        if time.time_ns() - mtime < MTIME_GRANULARITY_NS:
+            mtime = None
+        self.group_cache[group] = (mtime, channels)
+        return channels
+
+    async def flush(self):
+        """Drop every queued message and all groups"""
+        self.channels = {}
+        self.outgoing = {}
+        self.group_cache = {}
+        shutil.rmtree(os.path.join(self.path, 'groups'), ignore_errors=True)
+        shutil.rmtree(os.path.join(self.path, 'receivers'), ignore_errors=True)
+        self.receiving = set()
+
+    async def close(self):
+        """Stop receiving and remove this process's socket"""
+        if self._sock is None:
+            return
+        if self.outgoing:
+            self._flush_outgoing()
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.remove_reader(self._sock.fileno())
+        self._sock.close()
+        self._unlink(self.socket_path)
+        for channel in self.receiving:
+            self._unlink(os.path.join(self._receivers_dir(channel), self.client_prefix))
+        self._reset()
@@ -1,337 +1,134 @@
 import json
-import asyncio
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
-from django.contrib.auth import get_user_model
-from .models import GameSession, Shield, GameEvent
-from .game_logic import UltronAI
+from . import tick
+from .ratelimit import TokenBucket
 
-User = get_user_model()
+# Per-connection inbound message limit
+MESSAGE_RATE = 10  # Messages per second
+MESSAGE_BURST = 20
 
 class GameConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.game_id = self.scope['url_route']['kwargs']['game_id']
-        self.game_group_name = f'game_{self.game_id}'
-        self.ultron_ai = UltronAI()
-        self.game_task = None
-        
+        self.game_group_name = tick.group_name(self.game_id)
+        self.ticker = None
+        self.is_player = False
+        self.rate_limit = TokenBucket(MESSAGE_RATE, MESSAGE_BURST)
+        self.throttled = False
+
         # Join game group
         await self.channel_layer.group_add(
             self.game_group_name,
             self.channel_name
         )
-        
+
         await self.accept()
-        
-        # Initialize game state
-        await self.initialize_game()
-    
+
+        # Attach to the shared game loop for this game
+        self.ticker = await tick.acquire(self.game_id, self.channel_layer)
+        if not self.ticker.exists:
+            return
+
+        # Only the game's owner controls it; everyone else watches
+        if not self.wants_spectator() and self.owns_game():
+            self.is_player = True
+            tick.join_player(self.ticker)
+
+        # Resume from the client's last seen frame when possible
+        last_seq = self.query_param('last_seq')
+        if last_seq is not None and last_seq.isdigit():
+            await self.send_missed_frames(int(last_seq))
+        else:
+            await self.send_game_state()
+
     async def disconnect(self, close_code):
-        # Cancel game loop
-        if self.game_task:
-            self.game_task.cancel()
-        
+        # Release the shared game loop
+        if self.ticker:
+            await tick.release(self.ticker, player=self.is_player)
+            self.ticker = None
+
         # Leave game group
         await self.channel_layer.group_discard(
             self.game_group_name,
             self.channel_name
         )
-    
+
     async def receive(self, text_data):
+        # Drop floods before parsing or touching the game
+        if not self.rate_limit.consume():
+            if not self.throttled:
+                self.throttled = True
+                await self.send_error('Rate limit exceeded')
+            return
+        self.throttled = False
+
         try:
             data = json.loads(text_data)
             message_type = data.get('type')
-            
-            if message_type == 'place_shield':
+            if self.is_player:
+                self.ticker.touch()
+
+            if message_type == 'resume':
+                await self.send_missed_frames(data.get('last_seq'))
+            elif not self.is_player:
+                await self.send_error('Spectators cannot control the game')
+            elif message_type == 'place_shield':
                 await self.handle_place_shield(data)
             elif message_type == 'start_game':
-                await self.handle_start_game()
+                await self.ticker.reset()
             elif message_type == 'pause_game':
-                await self.handle_pause_game()
+                await self.ticker.pause()
             elif message_type == 'resume_game':
-                await self.handle_resume_game()
-                
+                await self.ticker.resume()
+
         except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': 'Invalid JSON'
-            }))
-    
-    async def initialize_game(self):
-        """Initialize game state and start the game loop"""
-        game = await self.get_game()
-        if game:
-            # Set up Ultron AI
-            self.ultron_ai.set_position(game.ultron_position_x, game.ultron_position_y)
-            self.ultron_ai.set_target(game.ultron_target_x, game.ultron_target_y)
-            
-            # Send initial game state
-            await self.send_game_state()
-            
-            # Start game loop if game is active
-            if game.status == 'active':
-                self.game_task = asyncio.create_task(self.game_loop())
-    
-    async def game_loop(self):
-        """Main game loop for Ultron movement"""
-        try:
-            while True:
-                game = await self.get_game()
-                if not game or game.status != 'active':
-                    break
-                
-                # Check if Ultron can move (not paused)
-                if self.ultron_ai.update_pause_status(0.8):
-                    # Get current shields
-                    shields = await self.get_shields_data()
-                    
-                    # Get Ultron's next move
-                    next_move = self.ultron_ai.get_next_move(shields)
-                    
-                    if next_move:
-                        # Update Ultron position in database
-                        await self.update_ultron_position(next_move[0], next_move[1])
-                        
-                        # Check for shield effects
-                        shield_effect = await self.check_shield_at_position(next_move[0], next_move[1])
-                        if shield_effect:
-                            effect_result = self.ultron_ai.handle_shield_effect(shield_effect['type'])
-                            await self.handle_shield_effect(shield_effect, effect_result)
-                        
-                        # Check win/lose conditions
-                        if next_move == self.ultron_ai.target_position:
-                            await self.end_game(won=False)
-                            break
-                        
-                        # Send updated game state
-                        await self.send_game_state()
-                    else:
-                        # No path available - player wins
-                        await self.end_game(won=True)
-                        break
-                
-                # Wait for next move (0.8 seconds per tile)
-                await asyncio.sleep(0.8)
-                
-        except asyncio.CancelledError:
-            pass
-    
+            await self.send_error('Invalid JSON')
+
+    def query_param(self, name):
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        return query.get(name, [None])[0]
+
+    def wants_spectator(self):
+        return self.query_param('role') == 'spectator'
+
+    def owns_game(self):
+        user = self.scope.get('user')
+        return bool(user and user.is_authenticated and user.pk == self.ticker.state['player_id'])
+
     async def handle_place_shield(self, data):
-        """Handle shield placement"""
-        shield_type = data.get('shield_type')
-        position_x = data.get('position_x')
-        position_y = data.get('position_y')
-        
-        # Validate and place shield
-        success = await self.place_shield(shield_type, position_x, position_y)
-        
-        if success:
-            await self.send_game_state()
-        else:
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': 'Cannot place shield at this position'
-            }))
-    
-    async def handle_start_game(self):
-        """Handle game start"""
-        await self.reset_game()
-        await self.send_game_state()
-        
-        # Start game loop
-        if self.game_task:
-            self.game_task.cancel()
-        self.game_task = asyncio.create_task(self.game_loop())
-    
-    async def handle_pause_game(self):
-        """Handle game pause"""
-        if self.game_task:
-            self.game_task.cancel()
-        await self.update_game_status('paused')
-    
-    async def handle_resume_game(self):
-        """Handle game resume"""
-        await self.update_game_status('active')
-        self.game_task = asyncio.create_task(self.game_loop())
-    
-    async def handle_shield_effect(self, shield_data, effect_result):
-        """Handle shield effects on Ultron"""
-        if effect_result['type'] == 'yellow':
-            # Increase hostage timer
-            await self.increase_hostage_timer(2.0)
-        
-        # Send effect notification
+        """Queue a shield placement for the next tick"""
+        await self.ticker.place_shield(
+            data.get('shield_type'),
+            data.get('position_x'),
+            data.get('position_y'),
+            self.channel_name
+        )
+
+    async def send_error(self, message):
+        """Send an error to this client; it carries the current sequence without advancing it"""
         await self.send(text_data=json.dumps({
-            'type': 'shield_effect',
-            'shield_type': shield_data['type'],
-            'position': [shield_data['position_x'], shield_data['position_y']],
-            'effect': effect_result
+            'type': 'error',
+            'message': message,
+            'seq': self.ticker.seq if self.ticker else 0
         }))
-    
+
+    async def send_missed_frames(self, last_seq):
+        """Replay buffered frames after last_seq, or fall back to a snapshot"""
+        frames = None
+        if isinstance(last_seq, int) and self.ticker and self.ticker.exists:
+            frames = self.ticker.frames_since(last_seq)
+        if frames is None:
+            await self.send_game_state()
+            return
+        for text in frames:
+            await self.send(text_data=text)
+
     async def send_game_state(self):
-        """Send current game state to client"""
-        game = await self.get_game()
-        shields = await self.get_shields_data()
-        
-        if game:
-            await self.send(text_data=json.dumps({
-                'type': 'game_state',
-                'ultron_position': [game.ultron_position_x, game.ultron_position_y],
-                'target_position': [game.ultron_target_x, game.ultron_target_y],
-                'hostage_timer': game.hostage_timer,
-                'score': game.score,
-                'status': game.status,
-                'shields': shields
-            }))
-    
-    async def end_game(self, won=False):
-        """End the game"""
-        await self.update_game_status('won' if won else 'lost')
-        
-        # Calculate final score
-        game = await self.get_game()
-        if game:
-            final_score = await self.calculate_final_score(game, won)
-            
-            await self.send(text_data=json.dumps({
-                'type': 'game_ended',
-                'won': won,
-                'final_score': final_score,
-                'message': 'Victory! Hostages saved!' if won else 'Defeat! Ultron escaped!'
-            }))
-    
-    # Database operations (sync to async)
-    @database_sync_to_async
-    def get_game(self):
-        try:
-            return GameSession.objects.get(id=self.game_id)
-        except GameSession.DoesNotExist:
-            return None
-    
-    @database_sync_to_async
-    def get_shields_data(self):
-        try:
-            game = GameSession.objects.get(id=self.game_id)
-            shields = []
-            for shield in game.shields.filter(is_active=True):
-                shields.append({
-                    'id': shield.id,
-                    'type': shield.shield_type,
-                    'position': [shield.position_x, shield.position_y]
-                })
-            return shields
-        except GameSession.DoesNotExist:
-            return []
-    
-    @database_sync_to_async
-    def place_shield(self, shield_type, position_x, position_y):
-        try:
-            game = GameSession.objects.get(id=self.game_id)
-            
-            # Validation
-            if not (0 <= position_x <= 14 and 0 <= position_y <= 14):
-                return False
-            
-            if Shield.objects.filter(
-                game_session=game, 
-                position_x=position_x, 
-                position_y=position_y,
-                is_active=True
-            ).exists():
-                return False
-            
-            if position_x == game.ultron_position_x and position_y == game.ultron_position_y:
-                return False
-            
-            # Create shield
-            Shield.objects.create(
-                game_session=game,
-                shield_type=shield_type,
-                position_x=position_x,
-                position_y=position_y
-            )
-            
-            return True
-            
-        except GameSession.DoesNotExist:
-            return False
-    
-    @database_sync_to_async
-    def update_ultron_position(self, x, y):
-        try:
-            game = GameSession.objects.get(id=self.game_id)
-            game.ultron_position_x = x
-            game.ultron_position_y = y
-            game.save()
-        except GameSession.DoesNotExist:
-            pass
-    
-    @database_sync_to_async
-    def update_game_status(self, status):
-        try:
-            game = GameSession.objects.get(id=self.game_id)
-            game.status = status
-            game.save()
-        except GameSession.DoesNotExist:
-            pass
-    
-    @database_sync_to_async
-    def check_shield_at_position(self, x, y):
-        try:
-            game = GameSession.objects.get(id=self.game_id)
-            shield = Shield.objects.filter(
-                game_session=game,
-                position_x=x,
-                position_y=y,
-                is_active=True
-            ).first()
-            
-            if shield:
-                return {
-                    'type': shield.shield_type,
-                    'position_x': shield.position_x,
-                    'position_y': shield.position_y
-                }
-            return None
-            
-        except GameSession.DoesNotExist:
-            return None
-    
-    @database_sync_to_async
-    def increase_hostage_timer(self, amount):
-        try:
-            game = GameSession.objects.get(id=self.game_id)
-            game.hostage_timer += amount
-            game.save()
-        except GameSession.DoesNotExist:
-            pass
-    
-    @database_sync_to_async
-    def reset_game(self):
-        try:
-            game = GameSession.objects.get(id=self.game_id)
-            game.status = 'active'
-            game.hostage_timer = 40.0
-            game.ultron_position_x = 0
-            game.ultron_position_y = 7
-            game.score = 0
-            game.save()
-            
-            # Clear all shields
-            game.shields.all().delete()
-            
-            # Reset AI
-            self.ultron_ai.set_position(0, 7)
-            self.ultron_ai.current_path = []
-            self.ultron_ai.is_paused = False
-            self.ultron_ai.pause_time_left = 0
-            
-        except GameSession.DoesNotExist:
-            pass
-    
-    @database_sync_to_async
-    def calculate_final_score(self, game, won):
-        if won:
-            return int(game.hostage_timer * 10)
-        else:
-            return int((40.0 - game.hostage_timer) * 5)
+        """Send the cached snapshot to this client only"""
+        if self.ticker and self.ticker.exists:
+            await self.send(text_data=self.ticker.snapshot_text())
+
+    async def game_message(self, event):
+        """Forward a frame broadcast by the game's ticker"""
+        await self.send(text_data=event['text'])
@@ -0,0 +1,185 @@
+"""
+Buffered GameEvent log with a compressed cold archive.
+
+record_event() only appends to an in-memory buffer (from a queued mutation,
+once its group commits), which is handed to the
+group commit writer (see writer.py) as one bulk_create once it holds
+GAME_EVENT_BATCH_SIZE events or has been waiting GAME_EVENT_FLUSH_INTERVAL
+seconds, so the request and tick paths never wait on an event insert.
+
+Events older than the retention window are moved by the archive_events
+command into gzipped JSONL files partitioned by day:
+``<GAME_EVENT_ARCHIVE_DIR>/<YYYY>/<MM>/<YYYY-MM-DD>.jsonl.gz``.
+iter_archived_events() streams them back.
+"""
+import atexit
+import gzip
+import json
+import os
+import threading
+from datetime import date, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import GameEvent
+from .writer import on_writer_thread, write_later
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class EventSink:
+    """Collects GameEvent rows in memory and writes them in batches"""
+
+    def __init__(self, batch_size=None, flush_interval=None):
+        self.batch_size = batch_size or _setting('GAME_EVENT_BATCH_SIZE', 100)
+        self.flush_interval = flush_interval or _setting('GAME_EVENT_FLUSH_INTERVAL', 1.0)
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def record(self, game_session_id, event_type, data):
+        """Buffer an event; never touches the database on the caller's thread"""
+        event = GameEvent(
+            game_session_id=game_session_id,
+            event_type=event_type,
+            data=json.dumps(data),
+            timestamp=timezone.now()
+        )
+        if on_writer_thread():
+            # Inside a group commit, which may be rolled back and run again
+            transaction.on_commit(lambda: self._append(event))
+        else:
+            self._append(event)
+
+    def _append(self, event):
+        with self.lock:
+            self.buffer.append(event)
+            if len(self.buffer) >= self.batch_size:
+                self._schedule(0)
+            elif self.timer is None:
+                self._schedule(self.flush_interval)
+
+    def _schedule(self, delay):
+        if self.timer is not None:
+            if delay:
+                return
+            self.timer.cancel()
+        self.timer = threading.Timer(delay, self._flush_later)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _take(self):
+        with self.lock:
+            events, self.buffer = self.buffer, []
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        return events
+
+    def _insert(self, events):
+        # Runs again when the writer retries its group, after the rollback of
+        # the first insert and of the primary keys it assigned
+        for event in events:
+            event.pk = None
+        GameEvent.objects.bulk_create(events, batch_size=self.batch_size)
+        return len(events)
+
+    def _flush_later(self):
+        events = self._take()
+        if events:
+            write_later(self._insert, events)
+
+    def flush(self):
+        """Write everything buffered so far"""
+        events = self._take()
+        return self._insert(events) if events else 0
+
+
+event_sink = EventSink()
+atexit.register(event_sink.flush)
+
+
+def record_event(game, event_type, data):
+    """Log an event for a game (a GameSession or its id)"""
+    event_sink.record(getattr(game, 'pk', game), event_type, data)
+
+
+# Cold archive
+
+def archive_dir():
+    return str(_setting('GAME_EVENT_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'archive', 'events')))
+
+
+def archive_path(day):
+    return os.path.join(archive_dir(), f'{day:%Y}', f'{day:%m}', f'{day:%Y-%m-%d}.jsonl.gz')
+
+
+def serialize_event(event):
+    return {
+        'id': event.id,
+        'game_session_id': event.game_session_id,
+        'event_type': event.event_type,
+        'timestamp': event.timestamp.isoformat(),
+        'data': event.event_data,
+    }
+
+
+def archive_events(older_than, chunk_size=5000, events=None):
+    """
+    Move events with a timestamp before older_than into the daily archive files,
+    only those in the events queryset if given. Each chunk is appended to its
+    files (as extra gzip members) before its rows are deleted, so an
+    interrupted run loses nothing. Returns the number moved.
+    """
+    queryset = GameEvent.objects.all() if events is None else events
+    moved = 0
+    while True:
+        chunk = list(
+            queryset.filter(timestamp__lt=older_than).order_by('timestamp', 'id')[:chunk_size]
+        )
+        if not chunk:
+            return moved
+
+        by_day = {}
+        for event in chunk:
+            by_day.setdefault(timezone.localdate(event.timestamp), []).append(event)
+        for day, events in by_day.items():
+            path = archive_path(day)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with gzip.open(path, 'at', encoding='utf-8') as archive:
+                for event in events:
+                    archive.write(json.dumps(serialize_event(event)) + '\n')
+
+        GameEvent.objects.filter(id__in=[event.id for event in chunk]).delete()
+        moved += len(chunk)
+
+
+def iter_archived_events(start=None, end=None, game_session_id=None):
+    """
+    Stream archived events as dicts, oldest day first.
+    start and end are dates (inclusive); game_session_id filters to one game.
+    """
+    root = archive_dir()
+    if not os.path.isdir(root):
+        return
+    days = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith('.jsonl.gz'):
+                days.append(date.fromisoformat(filename[:-len('.jsonl.gz')]))
+    for day in sorted(days):
+        if (start and day < start) or (end and day > end):
+            continue
+        with gzip.open(archive_path(day), 'rt', encoding='utf-8') as archive:
+            for line in archive:
+                event = json.loads(line)
+                if game_session_id is None or event['game_session_id'] == game_session_id:
+                    yield event
+
+
+def retention_cutoff(days=None):
+    if days is None:
+        days = _setting('GAME_EVENT_RETENTION_DAYS', 30)
+    return timezone.now() - timedelta(days=days)
@@ -1,6 +1,61 @@
 import heapq
 import math
-from typing import List, Tuple, Optional
+from functools import lru_cache
+from typing import FrozenSet, List, Tuple, Optional
+
+# Paths only depend on the grid, both ends and the blocked cells, and the
+# polled game loop builds a fresh UltronAI for every move, so boards seen
+# before (the empty board above all) are answered from this table. See
+# warmup.py for filling it ahead of the first games.
+PATH_TABLE_SIZE = 8192
+
+
+def heuristic(pos1: Tuple[int, int], pos2: Tuple[int, int]) -> float:
+    """Calculate Manhattan distance heuristic"""
+    return abs(pos1[0] - pos2[0]) + abs(pos1[1] - pos2[1])
+
+
+def neighbors(position: Tuple[int, int], grid_size: int) -> List[Tuple[int, int]]:
+    """Valid neighboring positions, in 4 directions (up, down, left, right)"""
+    x, y = position
+    return [(x + dx, y + dy) for dx, dy in ((0, 1), (0, -1), (1, 0), (-1, 0))
+            if 0 <= x + dx < grid_size and 0 <= y + dy < grid_size]
+
+
+@lru_cache(maxsize=PATH_TABLE_SIZE)
+def shortest_path(grid_size: int, start: Tuple[int, int], goal: Tuple[int, int],
+                  obstacles: FrozenSet[Tuple[int, int]]) -> Tuple[Tuple[int, int], ...]:
+    """A* path from start (excluded) to goal avoiding obstacles, empty when there is none"""
+    start, goal = tuple(start), tuple(goal)
+    open_set = [(0, start)]
+    came_from = {}
+    g_score = {start: 0}
+    
+    while open_set:
+        current = heapq.heappop(open_set)[1]
+        
+        if current == goal:
+            # Reconstruct path
+            path = []
+            while current in came_from:
+                path.append(current)
+                current = came_from[current]
+            return tuple(reversed(path))
+        
+        for neighbor in neighbors(current, grid_size):
+            if neighbor in obstacles:
+                continue  # Skip blocked positions
+            
+            tentative_g_score = g_score[current] + 1
+            
+            if neighbor not in g_score or tentative_g_score < g_score[neighbor]:
+                came_from[neighbor] = current
+                g_score[neighbor] = tentative_g_score
+                heapq.heappush(open_set, (tentative_g_score + heuristic(neighbor, goal), neighbor))
+    
+    # No path found
+    return ()
+
 
 class UltronAI:
     """
@@ -26,66 +81,18 @@ class UltronAI:
     
     def heuristic(self, pos1: Tuple[int, int], pos2: Tuple[int, int]) -> float:
         """Calculate Manhattan distance heuristic"""
-        return abs(pos1[0] - pos2[0]) + abs(pos1[1] - pos2[1])
+        return heuristic(pos1, pos2)
     
     def get_neighbors(self, position: Tuple[int, int]) -> List[Tuple[int, int]]:
         """Get valid neighboring positions"""
-        x, y = position
-        neighbors = []
-        
-        # 4-directional movement (up, down, left, right)
-        directions = [(0, 1), (0, -1), (1, 0), (-1, 0)]
-        
-        for dx, dy in directions:
-            new_x, new_y = x + dx, y + dy
-            if 0 <= new_x < self.grid_size and 0 <= new_y < self.grid_size:
-                neighbors.append((new_x, new_y))
-        
-        return neighbors
+        return neighbors(position, self.grid_size)
     
     def find_path(self, obstacles: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
         """
         Find optimal path using A* algorithm
         obstacles: List of positions with blue shields (full blocks)
         """
-        start = self.current_position
-        goal = self.target_position
-        
-        # Convert obstacles to set for O(1) lookup
-        obstacle_set = set(obstacles)
-        
-        # A* algorithm
-        open_set = [(0, start)]
-        came_from = {}
-        g_score = {start: 0}
-        f_score = {start: self.heuristic(start, goal)}
-        
-        while open_set:
-            current = heapq.heappop(open_set)[1]
-            
-            if current == goal:
-                # Reconstruct path
-                path = []
-                while current in came_from:
-                    path.append(current)
-                    current = came_from[current]
-                path.reverse()
-                return path
-            
-            for neighbor in self.get_neighbors(current):
-                if neighbor in obstacle_set:
-                    continue  # Skip blocked positions
-                
-                tentative_g_score = g_score[current] + 1
-                
-                if neighbor not in g_score or tentative_g_score < g_score[neighbor]:
-                    came_from[neighbor] = current
-                    g_score[neighbor] = tentative_g_score
-                    f_score[neighbor] = tentative_g_score + self.heuristic(neighbor, goal)
-                    heapq.heappush(open_set, (f_score[neighbor], neighbor))
-        
-        # No path found
-        return []
+        return list(shortest_path(self.grid_size, self.current_position, self.target_position, frozenset(obstacles)))
     
     def get_next_move(self, shields: List[dict]) -> Optional[Tuple[int, int]]:
         """
@@ -0,0 +1,170 @@
+"""
+Finished games, whether they are still in the hot tables or archived.
+
+archive_finished_games() moves won and lost GameSessions that ended before a
+cutoff, together with their Shield and GameEvent rows, into ArchivedGame rows
+(one compressed payload per game), so the tables the game loop and the API
+scan only hold recent games. Events already moved to the JSONL archive by
+archive_events stay there; see events.iter_archived_events().
+
+Everything that shows a past game (profiles, admin, replays) should read
+through get_game(), get_game_details() and player_games(), which look in
+both places.
+"""
+import base64
+import json
+import zlib
+from django.db import transaction
+from django.db.models.functions import Coalesce
+from .board import Board
+from .events import event_sink
+from .models import ArchivedGame, GameEvent, GameSession, Shield
+
+FINISHED_STATUSES = ('won', 'lost')
+
+SUMMARY_FIELDS = [
+    'id', 'player_id', 'status', 'score', 'hostage_timer',
+    'time_survived', 'game_start_time', 'game_end_time',
+]
+
+
+def finished_games():
+    """Hot finished games, with ended_at falling back to the start for abandoned ones"""
+    return GameSession.objects.filter(status__in=FINISHED_STATUSES).annotate(
+        ended_at=Coalesce('game_end_time', 'game_start_time')
+    )
+
+
+def _shield_dict(shield):
+    return {
+        'type': shield['shield_type'],
+        'position': [shield['position_x'], shield['position_y']],
+        'durability': shield['durability'],
+        'is_active': shield['is_active'],
+        'placed_at': shield['placed_at'].isoformat(),
+    }
+
+
+def _event_dict(event):
+    return {
+        'event_type': event['event_type'],
+        'timestamp': event['timestamp'].isoformat(),
+        'data': json.loads(event['data'] or '{}'),
+    }
+
+
+def archive_finished_games(older_than, batch_size=500):
+    """
+    Move finished games that ended before older_than into ArchivedGame.
+    Works through them in id order, batch_size games per transaction, so
+    memory stays flat however much history there is. Games whose post-game
+    job is still queued stay until it has been applied, since deleting the
+    game would delete the job with it. Returns the number moved.
+    """
+    event_sink.flush()  # Buffered events of these games go into their payload
+    moved = 0
+    last_id = 0
+    while True:
+        games = list(
+            finished_games().filter(ended_at__lt=older_than, id__gt=last_id, post_game_job__isnull=True)
+            .order_by('id').values(*SUMMARY_FIELDS, 'board', 'ended_at')[:batch_size]
+        )
+        if not games:
+            return moved
+        last_id = games[-1]['id']
+        ids = [game['id'] for game in games]
+
+        shields = {game_id: [] for game_id in ids}
+        for shield in Shield.objects.filter(game_session_id__in=ids).order_by('placed_at').values(
+            'game_session_id', 'shield_type', 'position_x', 'position_y', 'durability', 'is_active', 'placed_at'
+        ).iterator():
+            shields[shield['game_session_id']].append(_shield_dict(shield))
+        events = {game_id: [] for game_id in ids}
+        for event in GameEvent.objects.filter(game_session_id__in=ids).order_by('timestamp', 'id').values(
+            'game_session_id', 'event_type', 'timestamp', 'data'
+        ).iterator():
+            events[event['game_session_id']].append(_event_dict(event))
+
+        archived = []
+        for game in games:
+            payload = {
+                'board': base64.b64encode(bytes(game['board'])).decode(),
+                'shields': shields[game['id']],
+                'events': events[game['id']],
+            }
+            archived.append(ArchivedGame(
+                id=game['id'],
+                player_id=game['player_id'],
+                status=game['status'],
+                score=game['score'],
+                hostage_timer=game['hostage_timer'],
+                time_survived=game['time_survived'],
+                game_start_time=game['game_start_time'],
+                game_end_time=game['ended_at'],
+                payload=zlib.compress(json.dumps(payload).encode(), 9),
+            ))
+
+        with transaction.atomic():
+            ArchivedGame.objects.bulk_create(archived)
+            Shield.objects.filter(game_session_id__in=ids).delete()
+            GameEvent.objects.filter(game_session_id__in=ids).delete()
+            GameSession.objects.filter(id__in=ids).delete()
+        moved += len(games)
+
+
+def _summary(values, archived):
+    values = dict(values, archived=archived)
+    values.setdefault('ended_at', values['game_end_time'])
+    return values
+
+
+def get_game(game_id):
+    """Summary of a game from either table, or None"""
+    game = GameSession.objects.filter(id=game_id).annotate(
+        ended_at=Coalesce('game_end_time', 'game_start_time')
+    ).values(*SUMMARY_FIELDS, 'ended_at').first()
+    if game is not None:
+        return _summary(game, archived=False)
+    game = ArchivedGame.objects.filter(id=game_id).values(*SUMMARY_FIELDS).first()
+    if game is not None:
+        return _summary(game, archived=True)
+    return None
+
+
+def get_game_details(game_id):
+    """Summary plus final board, shields and events of a game from either table"""
+    game = get_game(game_id)
+    if game is None:
+        return None
+    if game['archived']:
+        details = ArchivedGame.objects.get(id=game_id).details
+        game['shields'] = details['shields']
+        game['events'] = details['events']
+        game['board'] = Board.decode(base64.b64decode(details['board'])).shields()
+        return game
+
+    game['shields'] = [_shield_dict(shield) for shield in Shield.objects.filter(game_session_id=game_id).order_by('placed_at').values(
+        'shield_type', 'position_x', 'position_y', 'durability', 'is_active', 'placed_at'
+    )]
+    game['events'] = [_event_dict(event) for event in GameEvent.objects.filter(game_session_id=game_id).order_by('timestamp', 'id').values(
+        'event_type', 'timestamp', 'data'
+    )]
+    board = GameSession.objects.filter(id=game_id).values_list('board', flat=True).first()
+    game['board'] = Board.decode(board).shields()
+    return game
+
+
+def player_games(player, limit=10):
+    """A player's most recent finished games, newest first, from both tables"""
+    hot = [
+        _summary(game, archived=False)
+        for game in finished_games().filter(player=player)
+        .order_by('-ended_at', '-id').values(*SUMMARY_FIELDS, 'ended_at')[:limit]
+    ]
+    cold = [
+        _summary(game, archived=True)
+        for game in ArchivedGame.objects.filter(player=player)
+        .order_by('-game_end_time', '-id').values(*SUMMARY_FIELDS)[:limit]
+    ]
+    games = sorted(hot + cold, key=lambda game: (game['ended_at'], game['id']), reverse=True)
+    return games[:limit]
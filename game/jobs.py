@@ -0,0 +1,175 @@
+"""
+Deferred post-game bookkeeping.
+
+Ending a game used to update the leaderboard entry, the player's stats and
+the rollups on the request or tick path with read-modify-write saves, which
+lose increments when two processes end games for the same player at once.
+Now the hot path only saves the finished game and enqueues a PostGameJob in
+the same transaction (enqueue()), so a job is exactly as durable as the
+result it stands for.
+
+process_jobs() claims jobs in id order, applies each batch with one round of
+atomic F() increments per player (apply_results(), which the reaper uses
+too) and deletes the jobs in the same transaction, so every game is counted
+exactly once. A batch that fails is retried job by job; a job that keeps
+failing stays in the table with its error after MAX_ATTEMPTS.
+
+Jobs are drained by the post_game_worker command and by each pass of
+run_game_loop and process_games. With POST_GAME_JOBS_IN_PROCESS the web
+process also has its writer thread drain them right after a game ends, so
+the leaderboard stays current without a worker running.
+"""
+import logging
+import threading
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from .leaderboard_cache import entries_changed
+from .models import Leaderboard, PostGameJob
+from .ranking import keys_changed, rank_key
+from .rollups import record_results
+from .writer import write_later
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+DRAIN_BATCHES = 4  # Per in-process drain, so the writer thread is never held for long
+
+
+def enqueue(*games):
+    """Queue the bookkeeping of finished games; call in the transaction that saves them"""
+    PostGameJob.objects.bulk_create([PostGameJob(game_id=game.pk) for game in games], ignore_conflicts=True)
+
+
+def apply_results(results):
+    """
+    Add finished games to the leaderboard, player stats, rank index, cached
+    leaderboard parts and rollups with atomic increments. results are (player_id, score, won,
+    time_survived, ended_at) tuples.
+    """
+    now = timezone.now()
+    totals = {}
+    for player_id, score, won, time_survived, ended_at in results:
+        stats = totals.setdefault(player_id, {'games': 0, 'won': 0, 'time': 0.0, 'score': 0, 'best': 0})
+        stats['games'] += 1
+        stats['won'] += int(bool(won))
+        stats['time'] += time_survived
+        stats['score'] += score
+        stats['best'] = max(stats['best'], score)
+
+    # The F() updates bypass Leaderboard.save(), so move rank keys here
+    keys = {
+        player_id: (highest_score, games_won)
+        for player_id, highest_score, games_won in Leaderboard.objects.filter(player_id__in=totals)
+        .values_list('player_id', 'highest_score', 'games_won')
+    }
+    moves = [
+        (rank_key(*keys[player_id]), rank_key(max(keys[player_id][0], stats['best']), keys[player_id][1] + stats['won']))
+        if player_id in keys else (None, rank_key(stats['best'], stats['won']))
+        for player_id, stats in totals.items()
+    ]
+    keys_changed(moves)
+
+    Leaderboard.objects.bulk_create(
+        [Leaderboard(player_id=player_id) for player_id in totals], ignore_conflicts=True
+    )
+    User = get_user_model()
+    for player_id, stats in totals.items():
+        Leaderboard.objects.filter(player_id=player_id).update(
+            total_games=F('total_games') + stats['games'],
+            games_won=F('games_won') + stats['won'],
+            total_time_survived=F('total_time_survived') + stats['time'],
+            highest_score=Greatest('highest_score', stats['best']),
+            last_played=now,
+        )
+        User.objects.filter(id=player_id).update(
+            games_played=F('games_played') + stats['games'],
+            games_won=F('games_won') + stats['won'],
+            total_score=F('total_score') + stats['score'],
+            best_score=Greatest('best_score', stats['best']),
+        )
+    entries_changed(totals, [key for move in moves for key in move])
+
+    record_results(results)
+
+
+def _result(game):
+    return (
+        game.player_id, game.score, game.status == 'won',
+        game.time_survived, game.game_end_time or game.game_start_time,
+    )
+
+
+def _claim(batch_size):
+    jobs = PostGameJob.objects.filter(attempts__lt=MAX_ATTEMPTS).select_related('game').order_by('id')
+    if connection.features.has_select_for_update_skip_locked:
+        # Concurrent workers take different jobs; SQLite serializes them instead
+        jobs = jobs.select_for_update(skip_locked=True)
+    return list(jobs[:batch_size])
+
+
+def process_batch(batch_size=None):
+    """Apply up to batch_size queued jobs in one transaction; returns how many were applied"""
+    batch_size = batch_size or getattr(settings, 'POST_GAME_JOB_BATCH_SIZE', 200)
+    with transaction.atomic():
+        jobs = _claim(batch_size)
+        if not jobs:
+            return 0
+        try:
+            with transaction.atomic():
+                apply_results([_result(job.game) for job in jobs])
+                PostGameJob.objects.filter(id__in=[job.id for job in jobs]).delete()
+            return len(jobs)
+        except Exception:
+            logger.exception('Post-game batch of %d jobs failed, retrying them one by one', len(jobs))
+
+        applied = 0
+        for job in jobs:
+            try:
+                with transaction.atomic():
+                    apply_results([_result(job.game)])
+                    job.delete()
+                applied += 1
+            except Exception as e:
+                PostGameJob.objects.filter(id=job.id).update(attempts=F('attempts') + 1, last_error=repr(e))
+        return applied
+
+
+def process_jobs(batch_size=None, max_batches=None):
+    """Apply queued jobs batch by batch until the queue is empty; returns the number applied"""
+    batch_size = batch_size or getattr(settings, 'POST_GAME_JOB_BATCH_SIZE', 200)
+    applied = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        count = process_batch(batch_size)
+        applied += count
+        batches += 1
+        if count < batch_size:
+            break
+    return applied
+
+
+_drain_lock = threading.Lock()
+_drain_queued = False
+
+
+def _drain():
+    global _drain_queued
+    with _drain_lock:
+        _drain_queued = False
+    process_jobs(max_batches=DRAIN_BATCHES)
+
+
+def schedule_drain():
+    """Have the writer thread apply queued jobs after the games just ended are committed"""
+    global _drain_queued
+    if not getattr(settings, 'POST_GAME_JOBS_IN_PROCESS', True):
+        return
+    with _drain_lock:
+        if _drain_queued:
+            return
+        _drain_queued = True
+    write_later(_drain)
@@ -0,0 +1,107 @@
+"""
+Cached parts of the leaderboard page.
+
+The top of the all-time leaderboard is rendered once into an HTML fragment
+cached under the current leaderboard version. Writers call entries_changed()
+after changing entries; it bumps the version only when one of them was or is
+now in the top, so between games that reach the top every request serves the
+same fragment without a query. Rows carry their player's id and the page
+marks the viewer's row with CSS, so one fragment serves everybody.
+
+Day and week tops are cached per window for LEADERBOARD_WINDOW_CACHE_TTL
+seconds, like their pages. A player's own entry and the entries around it
+are cached per player for LEADERBOARD_PLAYER_CACHE_TTL seconds and dropped
+when their stats change; only the player's rank is looked up per request,
+from the rank index.
+
+With the default per-process cache a version bump is only seen by the
+process that made it, and other processes serve their fragment until it
+expires after LEADERBOARD_FRAGMENT_TTL seconds. A shared cache backend makes
+versions global.
+"""
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from .models import Leaderboard
+from . import ranking
+from .rollups import period_start, window_page
+
+TOP_SIZE = 10
+VERSION_KEY = 'leaderboard:version'
+
+
+def version():
+    # Seeded from the clock so a version lost to eviction never repeats an old one
+    return cache.get_or_set(VERSION_KEY, time.time_ns, None)
+
+
+def bump():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+def _player_key(player_id):
+    return f'leaderboard:player:{player_id}'
+
+
+def _cutoff():
+    """Key of the last entry of the top, None while the top is not full"""
+    last = list(Leaderboard.objects.order_by(*ranking.RANK_ORDER).values_list('highest_score', 'games_won')
+                [TOP_SIZE - 1:TOP_SIZE])
+    return ranking.rank_key(*last[0]) if last else None
+
+
+def entries_changed(player_ids, keys, using=None):
+    """
+    Call after changing the entries of player_ids, with their keys before
+    and after (None for no entry). Once the transaction commits their cached
+    stats are dropped, and the top is re-rendered if any of them was or is in it.
+    """
+    cutoff = _cutoff()
+    # An entry that left the top has an old key at or above the new last one
+    in_top = cutoff is None or any(key is not None and key >= cutoff for key in keys)
+
+    def forget():
+        cache.delete_many([_player_key(player_id) for player_id in player_ids])
+        if in_top:
+            bump()
+
+    transaction.on_commit(forget, using=using)
+
+
+def top(period=None):
+    """{'html': rendered rows, 'ids': Leaderboard ids (all time only)} of the top of the leaderboard"""
+    if period:
+        key = f'leaderboard:top:{period}:{period_start(period).isoformat()}'
+        timeout = getattr(settings, 'LEADERBOARD_WINDOW_CACHE_TTL', 30)
+    else:
+        key = f'leaderboard:top:{version()}'
+        timeout = getattr(settings, 'LEADERBOARD_FRAGMENT_TTL', 300)
+    fragment = cache.get(key)
+    if fragment is None:
+        entries = window_page(period, limit=TOP_SIZE)['entries'] if period else ranking.page(limit=TOP_SIZE)[0]
+        fragment = {
+            'html': str(render_to_string('game/leaderboard_top.html', {'top_players': entries})),
+            'ids': [] if period else [entry.id for entry in entries],
+        }
+        cache.set(key, fragment, timeout)
+    return {**fragment, 'html': mark_safe(fragment['html'])}
+
+
+def player_stats(player):
+    """The player's ranked Leaderboard entry or None, and the ranked entries around it"""
+    key = _player_key(player.id)
+    cached = cache.get(key)
+    if cached is None:
+        entry = Leaderboard.objects.select_related('player').filter(player=player).first()
+        cached = (entry, ranking.around(entry, count=2) if entry else [])
+        cache.set(key, cached, getattr(settings, 'LEADERBOARD_PLAYER_CACHE_TTL', 30))
+    entry, nearby = cached
+    if entry is not None:
+        ranking.with_ranks([entry])
+    return entry, nearby
@@ -0,0 +1,36 @@
+"""
+Move old GameEvent rows out of the database into the cold archive.
+Run daily, e.g. from a scheduled task:
+
+    python manage.py archive_events --days 30
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from game.events import archive_dir, archive_events, event_sink, iter_archived_events, retention_cutoff
+from datetime import date
+
+
+class Command(BaseCommand):
+    help = 'Archive game events older than the retention window to gzipped JSONL files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.GAME_EVENT_RETENTION_DAYS,
+                            help='Keep this many days of events in the database (default: GAME_EVENT_RETENTION_DAYS)')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Rows archived and deleted per batch (default: 5000)')
+        parser.add_argument('--count', metavar='YYYY-MM-DD', type=date.fromisoformat,
+                            help='Instead of archiving, count archived events for one day')
+
+    def handle(self, *args, **options):
+        if options['count']:
+            day = options['count']
+            total = sum(1 for _ in iter_archived_events(start=day, end=day))
+            self.stdout.write(f'{total} archived events on {day}')
+            return
+
+        event_sink.flush()
+        cutoff = retention_cutoff(options['days'])
+        moved = archive_events(cutoff, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {moved} events older than {cutoff:%Y-%m-%d %H:%M} to {archive_dir()}'
+        ))
@@ -0,0 +1,25 @@
+"""
+Move finished games out of the hot tables. Run daily, e.g. from a scheduled task:
+
+    python manage.py archive_games --days 30
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from game.history import archive_finished_games
+
+
+class Command(BaseCommand):
+    help = 'Archive won and lost games (with their shields and events) that ended more than N days ago'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.GAME_ARCHIVE_AFTER_DAYS,
+                            help='Keep games that ended within this many days in the hot tables (default: GAME_ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Games moved per transaction (default: 500)')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        moved = archive_finished_games(cutoff, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} games that ended before {cutoff:%Y-%m-%d %H:%M}'))
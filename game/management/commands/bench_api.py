@@ -0,0 +1,148 @@
+"""
+Load benchmark for the game API under an ASGI server.
+
+Starts uvicorn or daphne on shield_defense.asgi, logs in a set of benchmark
+players and polls the game state endpoint concurrently through both the sync
+views (/game/api/game/...) and the async views (/api/game/...).
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from importlib import import_module
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.core.management.base import BaseCommand
+from game.models import GameSession
+
+User = get_user_model()
+
+BENCH_USER_PREFIX = 'bench_api_'
+
+VARIANTS = {
+    'sync': '/game/api/game/state/{game_id}/',
+    'async': '/api/game/state/{game_id}/',
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+    return ordered[index]
+
+
+async def http_get(host, port, path, session_key):
+    """Issue a single GET request and return the status code"""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(
+        f'GET {path} HTTP/1.1\r\n'
+        f'Host: {host}\r\n'
+        f'Cookie: {settings.SESSION_COOKIE_NAME}={session_key}\r\n'
+        f'Connection: close\r\n\r\n'.encode()
+    )
+    await writer.drain()
+    status_line = await reader.readline()
+    await reader.read()
+    writer.close()
+    return int(status_line.split()[1])
+
+
+class Command(BaseCommand):
+    help = 'Benchmark sync vs async game API views under uvicorn or daphne'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=['uvicorn', 'daphne'], default='uvicorn')
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--clients', type=int, default=50,
+                            help='Concurrent polling clients (default: 50)')
+        parser.add_argument('--requests', type=int, default=20,
+                            help='Requests per client per variant (default: 20)')
+        parser.add_argument('--variant', choices=['sync', 'async', 'both'], default='both')
+
+    def handle(self, *args, **options):
+        sessions = self.create_players(options['clients'])
+        server = self.start_server(options)
+        try:
+            self.wait_for_server(options['host'], options['port'])
+            variants = ['sync', 'async'] if options['variant'] == 'both' else [options['variant']]
+            for variant in variants:
+                result = asyncio.run(self.run_variant(variant, sessions, options))
+                self.report(variant, result)
+        finally:
+            server.terminate()
+            server.wait()
+            User.objects.filter(username__startswith=BENCH_USER_PREFIX).delete()
+
+    def create_players(self, count):
+        """Create benchmark players with an active game and a logged in session"""
+        User.objects.filter(username__startswith=BENCH_USER_PREFIX).delete()
+        sessions = []
+        for i in range(count):
+            user = User.objects.create_user(username=f'{BENCH_USER_PREFIX}{i}')
+            game = GameSession.objects.create(player=user, status='active')
+
+            session = import_module(settings.SESSION_ENGINE).SessionStore()
+            session[SESSION_KEY] = str(user.pk)
+            session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.save()
+            sessions.append((session.session_key, game.id))
+        return sessions
+
+    def start_server(self, options):
+        host, port = options['host'], str(options['port'])
+        if options['server'] == 'uvicorn':
+            cmd = [sys.executable, '-m', 'uvicorn', 'shield_defense.asgi:application',
+                   '--host', host, '--port', port, '--log-level', 'warning']
+        else:
+            cmd = [sys.executable, '-m', 'daphne', '-b', host, '-p', port,
+                   'shield_defense.asgi:application']
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get(
+            'DJANGO_SETTINGS_MODULE', 'shield_defense.settings'))
+        self.stdout.write(f'Starting {options["server"]} on {host}:{port}')
+        return subprocess.Popen(cmd, cwd=settings.BASE_DIR, env=env)
+
+    def wait_for_server(self, host, port, timeout=15.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                asyncio.run(asyncio.wait_for(asyncio.open_connection(host, port), 1.0))
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError(f'Server did not start on {host}:{port}')
+
+    async def run_variant(self, variant, sessions, options):
+        latencies = []
+        errors = 0
+
+        async def client(session_key, game_id):
+            nonlocal errors
+            path = VARIANTS[variant].format(game_id=game_id)
+            for _ in range(options['requests']):
+                start = time.perf_counter()
+                try:
+                    status = await http_get(options['host'], options['port'], path, session_key)
+                except OSError:
+                    status = 0
+                latencies.append(time.perf_counter() - start)
+                if status != 200:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client(key, game_id) for key, game_id in sessions))
+        elapsed = time.perf_counter() - started
+        return {'latencies': latencies, 'errors': errors, 'elapsed': elapsed}
+
+    def report(self, variant, result):
+        latencies = result['latencies']
+        self.stdout.write(self.style.SUCCESS(
+            f'{variant:>5}: {len(latencies) / result["elapsed"]:.1f} req/s, '
+            f'p50 {percentile(latencies, 50) * 1000:.1f} ms, '
+            f'p99 {percentile(latencies, 99) * 1000:.1f} ms, '
+            f'errors {result["errors"]}'
+        ))
@@ -0,0 +1,109 @@
+"""
+Throughput and latency benchmark for channel layer backends.
+
+Compares the in-memory layer, the local Unix socket layer and, when REDIS_URL
+is set and channels_redis is installed, the Redis layer. Each backend gets a
+sender and a receiver instance; for the local and Redis layers these talk to
+each other through the real transport, as two worker processes would.
+"""
+import asyncio
+import os
+import tempfile
+import time
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+from game.channel_layers import LocalChannelLayer
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark in-memory, local and (optionally) Redis channel layers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=5000,
+                            help='Messages for the throughput test (default: 5000)')
+        parser.add_argument('--group-size', type=int, default=100,
+                            help='Channels in the fan-out group (default: 100)')
+        parser.add_argument('--rounds', type=int, default=200,
+                            help='group_send rounds for the latency test (default: 200)')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as path:
+            backends = [
+                ('in-memory', lambda: self.same_layer(InMemoryChannelLayer(capacity=options['messages']))),
+                ('local', lambda: (
+                    LocalChannelLayer(path=path, capacity=options['messages']),
+                    LocalChannelLayer(path=path, capacity=options['messages']),
+                )),
+            ]
+            if os.environ.get('REDIS_URL'):
+                try:
+                    from channels_redis.core import RedisChannelLayer
+                except ImportError:
+                    self.stdout.write(self.style.WARNING('REDIS_URL is set but channels_redis is not installed'))
+                else:
+                    hosts = [os.environ['REDIS_URL']]
+                    backends.append(('redis', lambda: (
+                        RedisChannelLayer(hosts=hosts, capacity=options['messages']),
+                        RedisChannelLayer(hosts=hosts, capacity=options['messages']),
+                    )))
+
+            for name, factory in backends:
+                result = asyncio.run(self.measure(factory, options))
+                self.stdout.write(self.style.SUCCESS(
+                    f'{name:>9}: {result["throughput"]:,.0f} msg/s point-to-point, '
+                    f'fan-out to {options["group_size"]} '
+                    f'p50 {result["p50"] * 1000:.2f} ms, p99 {result["p99"] * 1000:.2f} ms'
+                ))
+
+    def same_layer(self, layer):
+        return layer, layer
+
+    async def measure(self, factory, options):
+        sender, receiver = factory()
+
+        # Point-to-point throughput
+        channel = await receiver.new_channel()
+        await receiver.send(channel, {'type': 'warmup'})
+        await receiver.receive(channel)
+        started = time.perf_counter()
+
+        async def consume():
+            for _ in range(options['messages']):
+                await receiver.receive(channel)
+
+        consumer = asyncio.create_task(consume())
+        for seq in range(options['messages']):
+            await sender.send(channel, {'type': 'bench.message', 'seq': seq})
+            if seq % 100 == 0:
+                await asyncio.sleep(0)
+        await consumer
+        throughput = options['messages'] / (time.perf_counter() - started)
+
+        # Group fan-out latency
+        members = [await receiver.new_channel() for _ in range(options['group_size'])]
+        for member in members:
+            await receiver.group_add('bench', member)
+        latencies = []
+        for _ in range(options['rounds']):
+            started = time.perf_counter()
+            await sender.group_send('bench', {'type': 'bench.message', 'text': 'x' * 200})
+            for member in members:
+                await receiver.receive(member)
+            latencies.append(time.perf_counter() - started)
+
+        await receiver.flush()
+        await sender.close()
+        if receiver is not sender:
+            await receiver.close()
+        return {
+            'throughput': throughput,
+            'p50': percentile(latencies, 50),
+            'p99': percentile(latencies, 99),
+        }
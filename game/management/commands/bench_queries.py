@@ -0,0 +1,78 @@
+"""
+Time the hot queries on a large seeded SQLite database, before and after the
+hot query index migration (0011).
+
+A fresh database is migrated to 0010, seeded (1,000,000 events by default,
+plus one live game per 500 events, see game/seed.py), timed, migrated
+forward and timed again. Queries and plans come from explain_queries.
+"""
+import os
+import statistics
+import tempfile
+import time
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections
+from game.management.commands.explain_queries import full_scans, hot_queries, plan_steps
+from game.seed import seed_database
+
+BEFORE = '0010_gamesession_last_activity'
+
+
+class Command(BaseCommand):
+    help = 'Benchmark hot queries on a seeded million-row database with and without the hot query indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='GameEvent rows to seed (default: 1,000,000)')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per query (default: 20)')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        base = connections.settings['default']
+        if base['ENGINE'] != 'django.db.backends.sqlite3':
+            self.stderr.write('This benchmark only applies to SQLite')
+            return
+
+        with tempfile.TemporaryDirectory() as path:
+            alias = 'bench_queries'
+            connections.settings[alias] = {**base, 'NAME': os.path.join(path, 'bench.sqlite3')}
+            try:
+                call_command('migrate', 'game', BEFORE, database=alias, verbosity=0)
+                started = time.perf_counter()
+                counts = seed_database(using=alias, rows=options['rows'], seed=options['seed'], active=options['rows'] // 500)
+                self.stdout.write(
+                    'Seeded ' + ', '.join(f'{count:,} {name}' for name, count in counts.items())
+                    + f' in {time.perf_counter() - started:.0f}s'
+                )
+                before = self.measure(alias, options['repeat'])
+
+                started = time.perf_counter()
+                call_command('migrate', 'game', database=alias, verbosity=0)
+                self.stdout.write(f'Index migration took {time.perf_counter() - started:.1f}s')
+                after = self.measure(alias, options['repeat'])
+            finally:
+                connections[alias].close()
+                del connections.settings[alias]
+
+        self.stdout.write(f'{"query":<58} {"before":>10} {"after":>10}')
+        for label in before:
+            (before_ms, before_scan), (after_ms, after_scan) = before[label], after[label]
+            self.stdout.write(
+                f'{label:<58} {before_ms:8.3f}{"*" if before_scan else " "} ms '
+                f'{after_ms:8.3f}{"*" if after_scan else " "} ms'
+            )
+        self.stdout.write('* full table scan in the plan')
+
+    def measure(self, alias, repeat):
+        """Median milliseconds and whether the plan scans a table, per hot query"""
+        results = {}
+        for location, description, queryset in hot_queries():
+            queryset = queryset.using(alias)
+            scans = full_scans(plan_steps(queryset.explain()))
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - started) * 1000)
+            results[f'{location}: {description}'] = (statistics.median(timings), bool(scans))
+        return results
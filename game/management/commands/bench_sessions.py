@@ -0,0 +1,124 @@
+"""
+Session writes caused by players polling the game state, before and after
+SessionRefreshMiddleware (authentication/middleware.py).
+
+Every simulated second each player polls the state of their game and, with
+--actions, a share of them also hit a route that is not read-only. Requests
+go through the full middleware stack in process, and every statement that
+writes is counted:
+
+    python manage.py bench_sessions --players 1000 --seconds 5
+"""
+import re
+import time
+from importlib import import_module
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from game.models import GameSession
+
+User = get_user_model()
+
+BENCH_USER_PREFIX = 'bench_sessions_'
+WRITE = re.compile(r'^\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+REFRESH_MIDDLEWARE = 'authentication.middleware.SessionRefreshMiddleware'
+DB_ENGINE = 'django.contrib.sessions.backends.db'
+
+PROFILES = [
+    ('db, save every request', {
+        'SESSION_ENGINE': DB_ENGINE,
+        'SESSION_SAVE_EVERY_REQUEST': True,
+        'MIDDLEWARE': [m for m in settings.MIDDLEWARE if m != REFRESH_MIDDLEWARE],
+    }),
+    ('db, refresh middleware', {'SESSION_ENGINE': DB_ENGINE, 'SESSION_SAVE_EVERY_REQUEST': False}),
+    ('signed cookies, refresh middleware', {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.signed_cookies', 'SESSION_SAVE_EVERY_REQUEST': False,
+    }),
+]
+
+
+class Command(BaseCommand):
+    help = 'Count database writes per second from session handling with simulated polling players'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=1000, help='Simulated players (default: 1000)')
+        parser.add_argument('--seconds', type=int, default=5, help='Simulated seconds of polling (default: 5)')
+        parser.add_argument('--actions', type=float, default=0.0,
+                            help='Share of players also loading a page each second (default: 0)')
+
+    def handle(self, *args, **options):
+        games = self.create_players(options['players'])
+        try:
+            for name, overrides in PROFILES:
+                with override_settings(**overrides):
+                    result = self.run(games, options)
+                self.report(name, result, options['seconds'])
+        finally:
+            User.objects.filter(username__startswith=BENCH_USER_PREFIX).delete()
+        self.stdout.write(
+            f'With the middleware a session is saved at most every {settings.SESSION_REFRESH_INTERVAL}s: '
+            f'{options["players"] / settings.SESSION_REFRESH_INTERVAL:.1f} saves/s at most for '
+            f'{options["players"]} players outside the read-only routes'
+        )
+
+    def create_players(self, count):
+        User.objects.filter(username__startswith=BENCH_USER_PREFIX).delete()
+        users = User.objects.bulk_create([
+            User(username=f'{BENCH_USER_PREFIX}{i}', password='!') for i in range(count)
+        ])
+        users = list(User.objects.filter(username__startswith=BENCH_USER_PREFIX).order_by('id'))
+        GameSession.objects.bulk_create([GameSession(player=user, status='lost') for user in users])
+        return list(GameSession.objects.filter(player__in=users).select_related('player').order_by('id'))
+
+    def login(self, user):
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        return session.session_key
+
+    def run(self, games, options):
+        client = Client(HTTP_HOST='localhost')
+        keys = {game.id: self.login(game.player) for game in games}
+        counts = {'writes': 0, 'session_writes': 0, 'requests': 0, 'cookies': 0, 'errors': 0}
+
+        def count_writes(execute, sql, params, many, context):
+            if WRITE.match(sql):
+                counts['writes'] += 1
+                if 'django_session' in sql:
+                    counts['session_writes'] += 1
+            return execute(sql, params, many, context)
+
+        def request(game, path):
+            client.cookies[settings.SESSION_COOKIE_NAME] = keys[game.id]
+            response = client.get(path)
+            counts['requests'] += 1
+            counts['errors'] += response.status_code != 200
+            cookie = response.cookies.get(settings.SESSION_COOKIE_NAME)
+            if cookie is not None:
+                counts['cookies'] += 1
+                keys[game.id] = cookie.value
+
+        actions = int(len(games) * options['actions'])
+        started = time.perf_counter()
+        with connection.execute_wrapper(count_writes):
+            for second in range(options['seconds']):
+                for game in games:
+                    request(game, f'/game/api/game/state/{game.id}/')
+                for game in games[:actions]:
+                    request(game, '/game/leaderboard/')
+        counts['elapsed'] = time.perf_counter() - started
+        Session.objects.filter(session_key__in=keys.values()).delete()
+        return counts
+
+    def report(self, name, result, seconds):
+        self.stdout.write(self.style.SUCCESS(
+            f'{name:>35}: {result["session_writes"] / seconds:.0f} session writes/s, '
+            f'{result["writes"] / seconds:.0f} DB writes/s, '
+            f'{result["cookies"] / seconds:.0f} Set-Cookie/s '
+            f'({result["requests"]} requests in {result["elapsed"]:.1f}s, {result["errors"]} errors)'
+        ))
@@ -0,0 +1,97 @@
+"""
+Spectator fan-out benchmark.
+
+Subscribes an increasing number of spectator channels to one game's group and
+measures the server CPU spent per tick. The tick itself (simulation, encoding
+and database work) happens once per game and should stay flat as the audience
+grows. Fan-out (the channel layer putting the already encoded frame on each
+subscriber's queue) is reported separately, per spectator.
+"""
+import asyncio
+import time
+from channels.layers import InMemoryChannelLayer
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from game.models import GameSession
+from game import tick
+
+User = get_user_model()
+
+BENCH_USERNAME = 'bench_spectators'
+
+
+class Command(BaseCommand):
+    help = 'Measure per-tick server CPU with many spectators on one game'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--spectators', type=int, nargs='+', default=[1, 10, 100, 1000],
+                            help='Spectator counts to measure (default: 1 10 100 1000)')
+        parser.add_argument('--ticks', type=int, default=20,
+                            help='Ticks per measurement (default: 20)')
+
+    def handle(self, *args, **options):
+        User.objects.filter(username=BENCH_USERNAME).delete()
+        user = User.objects.create_user(username=BENCH_USERNAME)
+        try:
+            for count in options['spectators']:
+                game = GameSession.objects.create(player=user, status='active')
+                result = asyncio.run(self.measure(game.id, count, options['ticks']))
+                self.stdout.write(self.style.SUCCESS(
+                    f'{count:>6} spectators: '
+                    f'tick {result["tick_cpu"] * 1000:.3f} ms CPU, '
+                    f'fan-out {result["fanout_cpu"] * 1e6 / count:.1f} us CPU/spectator, '
+                    f'{result["encodes"]:.1f} encodes/tick, '
+                    f'{result["writes"]:.1f} DB writes/tick'
+                ))
+        finally:
+            user.delete()
+
+    async def measure(self, game_id, spectators, ticks):
+        layer = InMemoryChannelLayer(capacity=ticks + 10)
+        ticker = await tick.acquire(game_id, layer)
+
+        channels = []
+        for _ in range(spectators):
+            channel = await layer.new_channel()
+            await layer.group_add(ticker.group_name, channel)
+            channels.append(channel)
+
+        # Late joiners are served the cached snapshot
+        for _ in channels:
+            ticker.snapshot_text()
+
+        writes = 0
+        encodes = 0
+        fanout_cpu = 0.0
+        original_write = ticker._write
+        original_group_send = layer.group_send
+
+        def counting_write(*args):
+            nonlocal writes
+            writes += 1
+            return original_write(*args)
+
+        async def timed_group_send(group, message):
+            nonlocal encodes, fanout_cpu
+            encodes += 1
+            started = time.process_time()
+            await original_group_send(group, message)
+            fanout_cpu += time.process_time() - started
+
+        ticker._write = counting_write
+        layer.group_send = timed_group_send
+
+        cpu = 0.0
+        for _ in range(ticks):
+            started = time.process_time()
+            await ticker.tick()
+            cpu += time.process_time() - started
+
+        await tick.release(ticker)
+        await layer.flush()
+        return {
+            'tick_cpu': (cpu - fanout_cpu) / ticks,
+            'fanout_cpu': fanout_cpu / ticks,
+            'encodes': encodes / ticks,
+            'writes': writes / ticks,
+        }
@@ -0,0 +1,156 @@
+"""
+Concurrent write benchmark for SQLite: default settings, the production
+profile, and the production profile with writes going through the group
+commit writer (game/writer.py).
+
+Each profile gets a fresh, migrated database file. Tick threads do what the
+tick engine's flush does (one transaction updating a game's state and board);
+API threads do what a state poll and a shield placement do (read the game,
+update it, log an event) in autocommit mode. Without the profile every
+operation opens a new connection, as CONN_MAX_AGE=0 does per request.
+"""
+import os
+import random
+import tempfile
+import threading
+import time
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+from game.board import Board
+from game.models import GameEvent, GameSession
+from game.writer import WriteCoordinator
+
+User = get_user_model()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark concurrent tick and API writes on SQLite with and without the production profile'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5.0, help='Duration per profile (default: 5)')
+        parser.add_argument('--tick-threads', type=int, default=4, help='Tick engine writers (default: 4)')
+        parser.add_argument('--api-threads', type=int, default=8, help='API request threads (default: 8)')
+        parser.add_argument('--games', type=int, default=50, help='Active games to spread writes over (default: 50)')
+
+    def handle(self, *args, **options):
+        base = connections.settings['default']
+        if base['ENGINE'] != 'django.db.backends.sqlite3':
+            self.stderr.write('This benchmark only applies to SQLite')
+            return
+
+        production = {
+            'PRAGMAS': settings.SQLITE_PRODUCTION_PRAGMAS,
+            'CONN_MAX_AGE': None,
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+        }
+        profiles = [
+            ('default', {}, False),
+            ('default+group-commit', {}, True),
+            ('production', production, False),
+            ('production+group-commit', production, True),
+        ]
+        with tempfile.TemporaryDirectory() as path:
+            for name, overrides, group_commit in profiles:
+                alias = f'bench_{name.replace("+", "_")}'
+                connections.settings[alias] = {
+                    **base, 'OPTIONS': {}, 'CONN_MAX_AGE': 0, 'PRAGMAS': {},
+                    **overrides, 'NAME': os.path.join(path, f'{name}.sqlite3'),
+                }
+                try:
+                    call_command('migrate', database=alias, verbosity=0)
+                    game_ids = self.setup_games(alias, options['games'])
+                    results = self.run(alias, game_ids, options, group_commit)
+                finally:
+                    connections[alias].close()
+                    del connections.settings[alias]
+                self.report(name, results, options['seconds'])
+
+    def setup_games(self, alias, count):
+        player = User.objects.db_manager(alias).create_user(username='bench_sqlite', password='bench')
+        GameSession.objects.using(alias).bulk_create([
+            GameSession(player=player, status='active') for _ in range(count)
+        ])
+        return list(GameSession.objects.using(alias).values_list('id', flat=True))
+
+    def run(self, alias, game_ids, options, group_commit=False):
+        persistent = connections.settings[alias]['CONN_MAX_AGE'] != 0
+        coordinator = WriteCoordinator(using=alias) if group_commit else None
+        deadline = time.perf_counter() + options['seconds']
+        results = {'tick': [], 'api': [], 'errors': 0}
+        lock = threading.Lock()
+
+        def tick_write(rng):
+            game_id = rng.choice(game_ids)
+            board = Board()
+            board.add('blue', rng.randrange(15), rng.randrange(15))
+            with transaction.atomic(using=alias):
+                GameSession.objects.using(alias).filter(id=game_id).update(
+                    ultron_position_x=rng.randrange(15), ultron_position_y=rng.randrange(15),
+                    hostage_timer=rng.uniform(0, 40), board=board.encode()
+                )
+
+        def api_write(rng):
+            game = GameSession.objects.using(alias).get(id=rng.choice(game_ids))
+            GameSession.objects.using(alias).filter(id=game.id).update(hostage_timer=game.hostage_timer - 1)
+            GameEvent.objects.using(alias).create(game_session=game, event_type='timer_reduced', data='{}')
+
+        def worker(kind, operation, seed):
+            rng = random.Random(seed)
+            latencies = []
+            errors = 0
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    if coordinator:
+                        coordinator.submit(operation, rng).result()
+                    else:
+                        operation(rng)
+                    latencies.append(time.perf_counter() - started)
+                except OperationalError:
+                    errors += 1
+                if not persistent:
+                    connections[alias].close()
+            connections[alias].close()
+            with lock:
+                results[kind].extend(latencies)
+                results['errors'] += errors
+
+        threads = [
+            threading.Thread(target=worker, args=('tick', tick_write, i))
+            for i in range(options['tick_threads'])
+        ] + [
+            threading.Thread(target=worker, args=('api', api_write, 1000 + i))
+            for i in range(options['api_threads'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if coordinator:
+            coordinator.close()
+            results['commits'] = coordinator.commits
+        return results
+
+    def report(self, name, results, seconds):
+        self.stdout.write(self.style.SUCCESS(f'{name} profile:'))
+        for kind in ('tick', 'api'):
+            latencies = results[kind]
+            self.stdout.write(
+                f'  {kind:>4}: {len(latencies) / seconds:8,.0f} writes/s, '
+                f'p50 {percentile(latencies, 50) * 1000:7.2f} ms, '
+                f'p99 {percentile(latencies, 99) * 1000:7.2f} ms'
+            )
+        self.stdout.write(f'  "database is locked" errors: {results["errors"]}')
+        if 'commits' in results:
+            writes = len(results['tick']) + len(results['api'])
+            self.stdout.write(f'  {writes / max(results["commits"], 1):.1f} writes per commit')
@@ -0,0 +1,131 @@
+"""
+Print the query plan of every hot query and flag full table scans.
+
+Each entry builds the same queryset the view, tick loop or consumer runs,
+with placeholder ids, and asks the database for its plan. On SQLite a
+``SCAN <table>`` step without an index is a full scan (flagged as SCAN) and
+a ``USE TEMP B-TREE`` step is a sort no index provides (flagged as sort,
+which is fine when an index has already narrowed the rows down).
+
+    python manage.py explain_queries
+    python manage.py explain_queries --fail-on-scan   # non-zero exit for CI
+"""
+import re
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+from game.events import retention_cutoff
+from game import ranking
+from game.history import finished_games
+from game.models import ArchivedGame, GameEvent, GameSession, Leaderboard, LeaderboardRollup, Shield
+from game.reaper import idle_cutoff, live_games
+
+GAME_ID = 1
+PLAYER_ID = 1
+CURSOR = (500, 3, 1)  # highest_score, games_won, id
+
+# "<id> <parent> <notused> <detail>" as Django formats SQLite plans
+PLAN_ROW = re.compile(r'^(?:\d+ \d+ \d+ )?(.*)$')
+
+
+def hot_queries():
+    """(location, description, queryset) for every query on a hot path"""
+    User = get_user_model()
+    now = timezone.now()
+    today = now.date()
+    return [
+        ('views.game_view', 'active game of a player',
+         GameSession.objects.filter(player_id=PLAYER_ID, status='active')[:1]),
+        ('views.place_shield', 'game by id and owner',
+         GameSession.objects.filter(id=GAME_ID, player_id=PLAYER_ID, status='active')),
+        ('views.start_game', 'active games to end before starting',
+         GameSession.objects.filter(player_id=PLAYER_ID, status='active').order_by('id')),
+        ('views.leaderboard_view', 'top 10',
+         Leaderboard.objects.all()[:10]),
+        ('views.leaderboard_view', 'stats of a player',
+         Leaderboard.objects.filter(player_id=PLAYER_ID)),
+        ('ranking.page', 'page after a cursor',
+         Leaderboard.objects.filter(ranking.after(CURSOR)).order_by(*ranking.RANK_ORDER)[:ranking.PAGE_SIZE]),
+        ('ranking.around', 'players just above',
+         Leaderboard.objects.filter(ranking.before(CURSOR)).order_by('highest_score', 'games_won', '-id')[:5]),
+        ('rollups.window_page', 'page of this week',
+         LeaderboardRollup.objects.filter(period='week', period_start=today)
+         .filter(ranking.after(CURSOR)).order_by(*ranking.RANK_ORDER)[:ranking.PAGE_SIZE]),
+        ('rollups.record_results', 'rollup row of a player',
+         LeaderboardRollup.objects.filter(period='day', period_start=today, player_id=PLAYER_ID)),
+        ('ranking.build', 'players per score and wins',
+         Leaderboard.objects.order_by().values_list('highest_score', 'games_won').annotate(players=Count('id'))),
+        ('run_game_loop', 'live games',
+         live_games(now)),
+        ('run_game_loop', 'shield under Ultron',
+         Shield.objects.filter(game_session_id=GAME_ID, is_active=True, position_x=3, position_y=4)[:1]),
+        ('reaper', 'idle games',
+         GameSession.objects.filter(status='active', last_activity__lt=idle_cutoff(now)).order_by('id')),
+        ('tick.load', 'game state and board',
+         GameSession.objects.filter(id=GAME_ID).values('status', 'board')),
+        ('tick.reset', 'shields of a game',
+         Shield.objects.filter(game_session_id=GAME_ID)),
+        ('consumer', 'session user',
+         User.objects.filter(id=PLAYER_ID)),
+        ('history.player_games', 'finished games of a player',
+         finished_games().filter(player_id=PLAYER_ID).order_by('-ended_at', '-id')[:10]),
+        ('history.player_games', 'archived games of a player',
+         ArchivedGame.objects.filter(player_id=PLAYER_ID).order_by('-game_end_time', '-id')[:10]),
+        ('history.get_game_details', 'events of a game',
+         GameEvent.objects.filter(game_session_id=GAME_ID).order_by('timestamp', 'id')),
+        ('archive_events', 'events past retention',
+         GameEvent.objects.filter(timestamp__lt=retention_cutoff()).order_by('timestamp', 'id')[:5000]),
+        ('archive_games', 'finished games past retention',
+         finished_games().filter(ended_at__lt=now - timedelta(days=30), id__gt=0).order_by('id')[:500]),
+    ]
+
+
+def plan_steps(plan):
+    """Detail column of each row of an SQLite EXPLAIN QUERY PLAN"""
+    return [PLAN_ROW.match(line.strip()).group(1) for line in plan.splitlines() if line.strip()]
+
+
+def full_scans(steps):
+    return [step for step in steps if step.startswith('SCAN ') and ' USING ' not in step]
+
+
+def temp_sorts(steps):
+    return [step for step in steps if step.startswith('USE TEMP B-TREE')]
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN every hot query and flag full table scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fail-on-scan', action='store_true',
+                            help='Exit with an error if any hot query scans a table')
+        parser.add_argument('--verbose-plans', action='store_true',
+                            help='Print the full plan of every query, not just flagged ones')
+
+    def handle(self, *args, **options):
+        queries = hot_queries()
+        flagged = 0
+        for location, description, queryset in queries:
+            plan = queryset.explain()
+            steps = plan_steps(plan) if connection.vendor == 'sqlite' else []
+            scans = full_scans(steps)
+            sorts = temp_sorts(steps)
+            label = f'{location}: {description}'
+            if scans:
+                flagged += 1
+                self.stdout.write(self.style.ERROR(f'SCAN  {label}'))
+            elif sorts:
+                self.stdout.write(self.style.WARNING(f'sort  {label}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'ok    {label}'))
+            for step in (steps if options['verbose_plans'] else scans + sorts):
+                self.stdout.write(f'        {step}')
+            if options['verbose_plans'] and not steps:
+                self.stdout.write(plan)
+
+        self.stdout.write(f'{flagged} of {len(queries)} hot queries scan a table')
+        if flagged and options['fail_on_scan']:
+            raise CommandError('Hot queries scan tables')
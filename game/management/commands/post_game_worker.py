@@ -0,0 +1,44 @@
+"""
+Apply queued post-game jobs (leaderboard, player stats, rollups), see
+game/jobs.py. Run it next to the web processes when they are started with
+POST_GAME_JOBS_IN_PROCESS=False:
+
+    python manage.py post_game_worker                # poll every second
+    python manage.py post_game_worker --once         # drain the queue and exit
+"""
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from game.jobs import process_jobs
+from game.models import PostGameJob
+
+
+class Command(BaseCommand):
+    help = 'Apply queued post-game jobs in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty (default: 1.0)')
+        parser.add_argument('--batch-size', type=int, default=settings.POST_GAME_JOB_BATCH_SIZE,
+                            help='Jobs applied per transaction (default: POST_GAME_JOB_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            applied = process_jobs(options['batch_size'])
+            failed = PostGameJob.objects.count()
+            self.stdout.write(self.style.SUCCESS(f'Applied {applied} post-game jobs, {failed} left in the queue'))
+            return
+
+        self.stdout.write(self.style.SUCCESS(f'Applying post-game jobs, polling every {options["interval"]}s...'))
+        try:
+            while True:
+                close_old_connections()
+                applied = process_jobs(options['batch_size'])
+                if applied:
+                    self.stdout.write(f'Applied {applied} post-game jobs')
+                else:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Post-game worker stopped by user'))
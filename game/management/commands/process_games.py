@@ -3,10 +3,13 @@ Process active games once - designed for scheduled tasks
 Run this every minute via PythonAnywhere's scheduled tasks
 """
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.utils import timezone
-from game.models import GameSession, Shield, GameEvent, Leaderboard
-from game.ai import UltronAI
-import json
+from game.events import event_sink, record_event
+from game.reaper import live_games, reap_idle_games
+from game.jobs import enqueue, process_jobs
+from game.replay import record_tick
+from game.game_logic import UltronAI
 from datetime import timedelta
 
 
@@ -14,7 +17,10 @@ class Command(BaseCommand):
     help = 'Process all active games once (for scheduled tasks)'
 
     def handle(self, *args, **options):
-        active_games = GameSession.objects.filter(status='active')
+        reaped = reap_idle_games()
+        if reaped:
+            self.stdout.write(f'Ended {reaped} idle games')
+        active_games = live_games()
         
         self.stdout.write(f'Processing {active_games.count()} active games')
         
@@ -24,8 +30,16 @@ class Command(BaseCommand):
             except Exception as e:
                 self.stdout.write(self.style.ERROR(f'Error processing game {game.id}: {str(e)}'))
 
+        event_sink.flush()
+        process_jobs()
+
     def process_game(self, game):
-        """Process a single game"""
+        """Process a single game and append the result to its replay"""
+        self.advance_game(game)
+        record_tick(game)
+
+    def advance_game(self, game):
+        """Move a single game on by one loop step"""
         now = timezone.now()
         
         # Check if Ultron is paused
@@ -62,13 +76,8 @@ class Command(BaseCommand):
             game.last_move_time = now
         
         # Move Ultron using AI
-        shields = game.shields.filter(is_active=True)
-        shield_data = []
-        for shield in shields:
-            shield_data.append({
-                'type': shield.shield_type,
-                'position': [shield.position_x, shield.position_y]
-            })
+        board = game.board_state
+        shield_data = board.shields()
         
         ultron_ai = UltronAI()
         ultron_ai.set_position(game.ultron_position_x, game.ultron_position_y)
@@ -86,10 +95,13 @@ class Command(BaseCommand):
                 self.end_game(game, won=False, reason='Ultron escaped')
                 return
             
-            shield_at_position = shields.filter(
-                position_x=game.ultron_position_x,
-                position_y=game.ultron_position_y
-            ).first()
+            shield_at_position = None
+            if (game.ultron_position_x, game.ultron_position_y) in board:
+                shield_at_position = game.shields.filter(
+                    is_active=True,
+                    position_x=game.ultron_position_x,
+                    position_y=game.ultron_position_y
+                ).first()
             
             if shield_at_position:
                 self.handle_shield_interaction(game, shield_at_position)
@@ -115,22 +127,16 @@ class Command(BaseCommand):
         shield.durability -= damage
         if shield.durability <= 0:
             shield.is_active = False
-            shield.save()
-        
-        GameEvent.objects.create(
-            game_session=game,
-            event_type='shield_hit',
-            data=json.dumps({
-                'shield_type': shield.shield_type,
-                'position': [shield.position_x, shield.position_y],
-                'ultron_position': [game.ultron_position_x, game.ultron_position_y]
-            })
-        )
+            game.save_shield(shield)
+        
+        record_event(game, 'shield_hit', {
+            'shield_type': shield.shield_type,
+            'position': [shield.position_x, shield.position_y],
+            'ultron_position': [game.ultron_position_x, game.ultron_position_y]
+        })
 
     def end_game(self, game, won, reason=''):
         """End a game session"""
-        from game.models import Leaderboard
-        
         game.status = 'won' if won else 'lost'
         game.game_end_time = timezone.now()
         
@@ -141,40 +147,17 @@ class Command(BaseCommand):
         else:
             game.score = int(time_survived * 20)
         
-        game.save()
-        
-        user = game.player
-        user.games_played += 1
-        user.total_score += game.score
+        game.time_survived = time_survived
         
-        if won:
-            user.games_won += 1
-        
-        if game.score > user.best_score:
-            user.best_score = game.score
-        
-        user.save()
-        
-        leaderboard, created = Leaderboard.objects.get_or_create(player=user)
-        leaderboard.total_games += 1
-        leaderboard.total_time_survived += time_survived
+        # Leaderboard and player stats are applied by the post-game queue
+        with transaction.atomic():
+            game.save()
+            enqueue(game)
         
-        if won:
-            leaderboard.games_won += 1
-        
-        if game.score > leaderboard.highest_score:
-            leaderboard.highest_score = game.score
-        
-        leaderboard.save()
-        
-        GameEvent.objects.create(
-            game_session=game,
-            event_type='game_won' if won else 'game_lost',
-            data=json.dumps({
-                'reason': reason,
-                'final_score': game.score,
-                'time_survived': time_survived
-            })
-        )
+        record_event(game, 'game_won' if won else 'game_lost', {
+            'reason': reason,
+            'final_score': game.score,
+            'time_survived': time_survived
+        })
         
         self.stdout.write(self.style.SUCCESS(f'Game {game.id} ended: {"Won" if won else "Lost"} - {reason}'))
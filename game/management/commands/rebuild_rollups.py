@@ -0,0 +1,35 @@
+"""
+Recompute daily and weekly leaderboard rollups from game history, e.g. to
+backfill after deploying them or to repair a window:
+
+    python manage.py rebuild_rollups                          # today and this week
+    python manage.py rebuild_rollups --period day --back 30   # the last 31 days
+    python manage.py rebuild_rollups --period week --date 2026-03-02
+"""
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from game.rollups import PERIODS, period_start, rebuild_window
+
+
+class Command(BaseCommand):
+    help = 'Rebuild day and week leaderboard rollups from finished and archived games'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period', choices=PERIODS, help='Only rebuild this period (default: both)')
+        parser.add_argument('--date', help='Rebuild the window holding this day, YYYY-MM-DD (default: today)')
+        parser.add_argument('--back', type=int, default=0, help='Also rebuild this many earlier windows (default: 0)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Players written per batch (default: 1000)')
+
+    def handle(self, *args, **options):
+        try:
+            day = date.fromisoformat(options['date']) if options['date'] else None
+        except ValueError:
+            raise CommandError('--date must be YYYY-MM-DD')
+
+        for period in [options['period']] if options['period'] else PERIODS:
+            start = period_start(period, day)
+            step = timedelta(days=7 if period == 'week' else 1)
+            for _ in range(options['back'] + 1):
+                players = rebuild_window(period, start, chunk_size=options['chunk_size'])
+                self.stdout.write(self.style.SUCCESS(f'{period} of {start}: {players} players'))
+                start -= step
@@ -1,10 +1,12 @@
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.utils import timezone
-from game.models import GameSession, Shield, GameEvent
+from game.events import event_sink, record_event
+from game.reaper import live_games, reap_idle_games
+from game.jobs import enqueue, process_jobs
+from game.replay import record_tick
 from game.game_logic import UltronAI
 import time
-import json
-import threading
 from datetime import timedelta
 
 class Command(BaseCommand):
@@ -31,6 +33,8 @@ class Command(BaseCommand):
         try:
             while self.running:
                 self.process_active_games()
+                event_sink.flush()  # One bulk insert per loop iteration
+                process_jobs()
                 time.sleep(interval)
         except KeyboardInterrupt:
             self.stdout.write(
@@ -43,7 +47,10 @@ class Command(BaseCommand):
     
     def process_active_games(self):
         """Process all active games"""
-        active_games = GameSession.objects.filter(status='active')
+        reaped = reap_idle_games()
+        if reaped:
+            print(f"Ended {reaped} idle games")
+        active_games = live_games()
         
         print(f"Processing {active_games.count()} active games")
         
@@ -57,7 +64,12 @@ class Command(BaseCommand):
                 )
     
     def process_game(self, game):
-        """Process a single game"""
+        """Process a single game and append the result to its replay"""
+        self.advance_game(game)
+        record_tick(game)
+
+    def advance_game(self, game):
+        """Move a single game on by one loop step"""
         now = timezone.now()
         
         # Update hostage timer (only once per second)
@@ -103,13 +115,8 @@ class Command(BaseCommand):
             game.last_move_time = now
         
         # Move Ultron using AI
-        shields = game.shields.filter(is_active=True)
-        shield_data = []
-        for shield in shields:
-            shield_data.append({
-                'type': shield.shield_type,
-                'position': [shield.position_x, shield.position_y]
-            })
+        board = game.board_state
+        shield_data = board.shields()
         
         ultron_ai = UltronAI()
         ultron_ai.set_position(game.ultron_position_x, game.ultron_position_y)
@@ -131,10 +138,13 @@ class Command(BaseCommand):
                 return
             
             # Check for shield interactions
-            shield_at_position = shields.filter(
-                position_x=game.ultron_position_x,
-                position_y=game.ultron_position_y
-            ).first()
+            shield_at_position = None
+            if (game.ultron_position_x, game.ultron_position_y) in board:
+                shield_at_position = game.shields.filter(
+                    is_active=True,
+                    position_x=game.ultron_position_x,
+                    position_y=game.ultron_position_y
+                ).first()
             
             if shield_at_position:
                 self.handle_shield_interaction(game, shield_at_position)
@@ -159,30 +169,22 @@ class Command(BaseCommand):
             damage = 1  # Shield is destroyed after use
             
             # Log timer reduction
-            GameEvent.objects.create(
-                game_session=game,
-                event_type='timer_reduced',
-                data=json.dumps({
-                    'timer_reduction': 2.0,
-                    'new_timer': game.hostage_timer,
-                    'position': [shield.position_x, shield.position_y]
-                })
-            )
+            record_event(game, 'timer_reduced', {
+                'timer_reduction': 2.0,
+                'new_timer': game.hostage_timer,
+                'position': [shield.position_x, shield.position_y]
+            })
         elif shield.shield_type == 'red':
             # Red shields pause Ultron for 4 seconds
             game.ultron_paused_until = now + timedelta(seconds=4)
             damage = 1  # Shield is destroyed after use
             
             # Log pause effect
-            GameEvent.objects.create(
-                game_session=game,
-                event_type='ultron_paused',
-                data=json.dumps({
-                    'pause_duration': 4.0,
-                    'paused_until': game.ultron_paused_until.isoformat(),
-                    'position': [shield.position_x, shield.position_y]
-                })
-            )
+            record_event(game, 'ultron_paused', {
+                'pause_duration': 4.0,
+                'paused_until': game.ultron_paused_until.isoformat(),
+                'position': [shield.position_x, shield.position_y]
+            })
         else:
             damage = 1
         
@@ -190,24 +192,18 @@ class Command(BaseCommand):
         
         if shield.durability <= 0:
             shield.is_active = False
-            shield.save()
+            game.save_shield(shield)
             
             # Log shield destruction
-            GameEvent.objects.create(
-                game_session=game,
-                event_type='shield_destroyed',
-                data=json.dumps({
-                    'shield_type': shield.shield_type,
-                    'position': [shield.position_x, shield.position_y]
-                })
-            )
+            record_event(game, 'shield_destroyed', {
+                'shield_type': shield.shield_type,
+                'position': [shield.position_x, shield.position_y]
+            })
         else:
-            shield.save()
+            game.save_shield(shield)
     
     def end_game(self, game, won, reason=''):
         """End a game session"""
-        from game.models import Leaderboard
-        
         game.status = 'won' if won else 'lost'
         game.game_end_time = timezone.now()
         
@@ -222,44 +218,19 @@ class Command(BaseCommand):
             # Score = time_survived * 20 (max ~800 points if survived close to 40 seconds)
             game.score = int(time_survived * 20)
         
-        game.save()
-        
-        # Update user stats
-        user = game.player
-        user.games_played += 1
-        user.total_score += game.score
-        
-        if won:
-            user.games_won += 1
-        
-        if game.score > user.best_score:
-            user.best_score = game.score
-        
-        user.save()
-        
-        # Update leaderboard
-        leaderboard, created = Leaderboard.objects.get_or_create(player=user)
-        leaderboard.total_games += 1
-        leaderboard.total_time_survived += time_survived
+        game.time_survived = time_survived
         
-        if won:
-            leaderboard.games_won += 1
-        
-        if game.score > leaderboard.highest_score:
-            leaderboard.highest_score = game.score
-        
-        leaderboard.save()
+        # Leaderboard and player stats are applied by the post-game queue
+        with transaction.atomic():
+            game.save()
+            enqueue(game)
         
         # Log game end
-        GameEvent.objects.create(
-            game_session=game,
-            event_type='game_won' if won else 'game_lost',
-            data=json.dumps({
-                'reason': reason,
-                'final_score': game.score,
-                'time_survived': time_survived
-            })
-        )
+        record_event(game, 'game_won' if won else 'game_lost', {
+            'reason': reason,
+            'final_score': game.score,
+            'time_survived': time_survived
+        })
         
         self.stdout.write(
             self.style.SUCCESS(f'Game {game.id} ended: {"Won" if won else "Lost"} - {reason}')
@@ -0,0 +1,44 @@
+"""
+Fill a database with synthetic players, games, shields, events and
+leaderboard entries for performance testing, see game/seed.py.
+
+    python manage.py seed_data --rows 5000000 --seed 1
+    python manage.py seed_data --rows 10000 --active 500   # 500 live games for run_game_loop
+
+Rows are added next to whatever is already there; running it twice with the
+same seed adds a second, identical set of games under new ids.
+"""
+import time
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from game.seed import seed_database
+
+
+class Command(BaseCommand):
+    help = 'Generate a large seeded synthetic dataset (players, games, shields, events, leaderboard)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000,
+                            help='GameEvent rows to generate, other tables scale with it (default: 1,000,000)')
+        parser.add_argument('--active', type=int, default=0,
+                            help='Games in progress to add, each for a different player (default: 0)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Games generated and inserted per batch (default: 5000)')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        log = self.stdout.write if options['verbosity'] > 1 else None
+        started = time.perf_counter()
+        counts = seed_database(
+            using=options['database'],
+            rows=options['rows'],
+            seed=options['seed'],
+            chunk_size=options['chunk_size'],
+            active=options['active'],
+            log=log,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            'Added ' + ', '.join(f'{count:,} {name}' for name, count in counts.items())
+            + f' in {time.perf_counter() - started:.0f}s'
+        ))
@@ -0,0 +1,130 @@
+"""
+Cold start of a web worker: imports, application load and the first request,
+for the WSGI and the ASGI entry points.
+
+Each entry point is started in a fresh interpreter with -X importtime, loads
+shield_defense.wsgi or .asgi and serves one request in process. Reports the
+time from spawning the interpreter to the first response, the import time
+per top-level package, and fails when cold start goes over the budget
+(STARTUP_BUDGET_MS) or a module in STARTUP_DEFERRED_MODULES got imported
+before the first response:
+
+    python manage.py startup_profile
+    python manage.py startup_profile --entry asgi --top 25 --budget 1500
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+PROBE = r'''
+import json, os, sys, time
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shield_defense.settings')
+entry, path, deferred = sys.argv[1], sys.argv[2], sys.argv[3:]
+started = time.perf_counter()
+if entry == 'wsgi':
+    from wsgiref.util import setup_testing_defaults
+    from shield_defense.wsgi import application
+    loaded = time.perf_counter()
+    environ = {'PATH_INFO': path, 'REQUEST_METHOD': 'GET'}
+    setup_testing_defaults(environ)
+    statuses = []
+    b''.join(application(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+    status = int(statuses[0].split()[0])
+else:
+    import asyncio
+    from shield_defense.asgi import application
+    loaded = time.perf_counter()
+
+    async def request():
+        messages = []
+        received = asyncio.Event()
+
+        async def receive():
+            if not received.is_set():
+                received.set()
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await asyncio.Event().wait()
+
+        async def send(message):
+            messages.append(message)
+
+        await application({
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+            'headers': [(b'host', b'localhost')], 'client': ('127.0.0.1', 0), 'server': ('127.0.0.1', 80),
+        }, receive, send)
+        return messages[0]['status']
+
+    status = asyncio.run(request())
+answered = time.perf_counter()
+print(json.dumps({
+    'wall': time.time(), 'load': loaded - started, 'request': answered - loaded, 'status': status,
+    'imported': [name for name in deferred if name in sys.modules],
+}))
+'''
+
+
+def import_times(stderr):
+    """Self import time in seconds per top-level package, from -X importtime output"""
+    packages = defaultdict(float)
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        packages[name.strip().split('.')[0]] += int(self_us) / 1e6
+    return packages
+
+
+class Command(BaseCommand):
+    help = 'Profile web worker cold start (imports and time to first request) for WSGI and ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entry', choices=['wsgi', 'asgi', 'both'], default='both')
+        parser.add_argument('--path', default='/auth/login/', help='First request (default: /auth/login/)')
+        parser.add_argument('--top', type=int, default=10, help='Packages to list by import time (default: 10)')
+        parser.add_argument('--budget', type=float, default=settings.STARTUP_BUDGET_MS,
+                            help='Fail above this many ms to first response, 0 for none (default: STARTUP_BUDGET_MS)')
+
+    def handle(self, *args, **options):
+        failures = []
+        for entry in ['wsgi', 'asgi'] if options['entry'] == 'both' else [options['entry']]:
+            result = self.profile(entry, options['path'])
+            cold_start = (result['wall'] - result['spawned']) * 1000
+            self.stdout.write(self.style.SUCCESS(
+                f'{entry}: first response {result["status"]} after {cold_start:.0f} ms '
+                f'(application load {result["load"] * 1000:.0f} ms, first request {result["request"] * 1000:.0f} ms, '
+                f'imports {sum(result["packages"].values()) * 1000:.0f} ms)'
+            ))
+            for package, seconds in sorted(result['packages'].items(), key=lambda item: -item[1])[:options['top']]:
+                self.stdout.write(f'    {seconds * 1000:8.1f} ms  {package}')
+
+            if result['status'] >= 500:
+                failures.append(f'{entry} answered {result["status"]}')
+            if options['budget'] and cold_start > options['budget']:
+                failures.append(f'{entry} cold start {cold_start:.0f} ms is over the {options["budget"]:.0f} ms budget')
+            if result['imported']:
+                failures.append(f'{entry} imported {", ".join(result["imported"])} before its first response')
+        if failures:
+            raise CommandError('; '.join(failures))
+
+    def profile(self, entry, path):
+        # Without the background warm-up (game/warmup.py), which deliberately
+        # loads what the first request should not need
+        env = dict(os.environ, WARMUP_ON_START='False',
+                   DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'shield_defense.settings'))
+        spawned = time.time()
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', PROBE, entry, path, *settings.STARTUP_DEFERRED_MODULES],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if process.returncode != 0:
+            raise CommandError(f'{entry} worker failed to start:\n{process.stderr[-2000:]}')
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        result['spawned'] = spawned
+        result['packages'] = import_times(process.stderr)
+        return result
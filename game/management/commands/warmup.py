@@ -0,0 +1,36 @@
+"""
+Warm templates, caches and the path table up front, see game/warmup.py.
+
+Web workers do this themselves in the background when they start
+(WARMUP_ON_START). Run from a deploy script it warms what is shared between
+processes: a shared cache backend, the database and the OS page cache:
+
+    python manage.py warmup
+    python manage.py warmup --window 600 --players 2000
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from game.warmup import warm_up
+
+
+class Command(BaseCommand):
+    help = 'Preload templates, prime leaderboard and user caches and precompute Ultron paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', type=int, default=settings.WARMUP_ACTIVE_WINDOW,
+                            help='Prime players active in this many last seconds (default: WARMUP_ACTIVE_WINDOW)')
+        parser.add_argument('--players', type=int, default=settings.WARMUP_PLAYERS,
+                            help='Prime at most this many players (default: WARMUP_PLAYERS)')
+
+    def handle(self, *args, **options):
+        with override_settings(WARMUP_ACTIVE_WINDOW=options['window'], WARMUP_PLAYERS=options['players']):
+            results = warm_up()
+        for name, (count, seconds) in results.items():
+            if count is None:
+                self.stdout.write(self.style.ERROR(f'{name:>10}: failed after {seconds * 1000:.0f} ms'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{name:>10}: {count} in {seconds * 1000:.0f} ms'))
+        failed = [name for name, (count, _) in results.items() if count is None]
+        if failed:
+            raise CommandError(f'Warm-up failed: {", ".join(failed)} (see the log)')
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:59
+
+from django.db import migrations, models
+
+
+def build_boards(apps, schema_editor):
+    """Encode each game's active Shield rows into its board"""
+    from game.board import Board
+
+    GameSession = apps.get_model('game', 'GameSession')
+    Shield = apps.get_model('game', 'Shield')
+    db_alias = schema_editor.connection.alias
+
+    boards = {}
+    shields = Shield.objects.using(db_alias).filter(is_active=True).values_list(
+        'game_session_id', 'shield_type', 'position_x', 'position_y', 'durability'
+    ).order_by('game_session_id', 'placed_at')
+    for game_id, shield_type, x, y, durability in shields.iterator():
+        boards.setdefault(game_id, Board()).add(shield_type, x, y, durability)
+
+    for game_id, board in boards.items():
+        GameSession.objects.using(db_alias).filter(id=game_id).update(board=board.encode())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0006_gamesession_last_timer_update'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gamesession',
+            name='board',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.RunPython(build_boards, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='gamesession',
+            name='shields_placed',
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0008_gameevent_timestamp'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedGame',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('active', 'Active'), ('won', 'Won'), ('lost', 'Lost'), ('paused', 'Paused')], max_length=10)),
+                ('score', models.IntegerField(default=0)),
+                ('hostage_timer', models.FloatField(default=0.0)),
+                ('time_survived', models.FloatField(default=0.0)),
+                ('game_start_time', models.DateTimeField()),
+                ('game_end_time', models.DateTimeField()),
+                ('payload', models.BinaryField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_games', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['player', '-game_end_time'], name='game_archiv_player__5e78b8_idx')],
+            },
+        ),
+    ]
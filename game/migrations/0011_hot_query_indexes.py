@@ -0,0 +1,55 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0010_gamesession_last_activity'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='shield',
+            unique_together=set(),
+        ),
+        migrations.AlterField(
+            model_name='gameevent',
+            name='game_session',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='events', to='game.gamesession'),
+        ),
+        migrations.AlterField(
+            model_name='gamesession',
+            name='player',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='shield',
+            name='game_session',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='shields', to='game.gamesession'),
+        ),
+        migrations.AddIndex(
+            model_name='gameevent',
+            index=models.Index(fields=['game_session', 'timestamp'], name='game_gameev_game_se_26289b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gamesession',
+            index=models.Index(fields=['player', 'status'], name='game_gamese_player__bd8652_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leaderboard',
+            index=models.Index(fields=['-highest_score', '-games_won'], name='leaderboard_ranking_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shield',
+            index=models.Index(fields=['game_session', 'is_active', 'position_x', 'position_y'], name='game_shield_game_se_6db2dd_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='shield',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('game_session', 'position_x', 'position_y'), name='unique_active_shield_per_cell'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0011_hot_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='leaderboard',
+            options={'ordering': ['-highest_score', '-games_won', 'id']},
+        ),
+        migrations.RemoveIndex(
+            model_name='leaderboard',
+            name='leaderboard_ranking_idx',
+        ),
+        migrations.AddIndex(
+            model_name='leaderboard',
+            index=models.Index(fields=['-highest_score', '-games_won', 'id'], name='leaderboard_ranking_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0012_leaderboard_rank_order'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('week', 'Week')], max_length=4)),
+                ('period_start', models.DateField()),
+                ('highest_score', models.IntegerField(default=0)),
+                ('total_games', models.IntegerField(default=0)),
+                ('games_won', models.IntegerField(default=0)),
+                ('total_time_survived', models.FloatField(default=0.0)),
+                ('last_played', models.DateTimeField(blank=True, null=True)),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'period_start', '-highest_score', '-games_won', 'id'], name='rollup_ranking_idx')],
+                'constraints': [models.UniqueConstraint(fields=('period', 'period_start', 'player'), name='unique_rollup_per_player')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0013_leaderboard_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostGameJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('game', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='post_game_job', to='game.gamesession')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0014_post_game_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='gamesession',
+            index=models.Index(fields=['game_start_time'], name='game_gamese_game_st_c6880c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shield',
+            index=models.Index(fields=['placed_at'], name='game_shield_placed__1e1fea_idx'),
+        ),
+    ]
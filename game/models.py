@@ -1,6 +1,9 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
+from django.utils import timezone
+from .board import Board
 import json
+import zlib
 
 class GameSession(models.Model):
     GAME_STATUS_CHOICES = [
@@ -10,7 +13,7 @@ class GameSession(models.Model):
         ('paused', 'Paused'),
     ]
     
-    player = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    player = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)  # Covered by (player, status)
     status = models.CharField(max_length=10, choices=GAME_STATUS_CHOICES, default='active')
     score = models.IntegerField(default=0)
     hostage_timer = models.FloatField(default=40.0)  # Timer in seconds
@@ -21,24 +24,71 @@ class GameSession(models.Model):
     ultron_paused_until = models.DateTimeField(null=True, blank=True)  # When pause ends
     last_move_time = models.DateTimeField(null=True, blank=True)  # Track movement timing
     last_timer_update = models.DateTimeField(null=True, blank=True)  # Track timer updates
-    shields_placed = models.TextField(default='[]')  # JSON array of shield positions
+    board = models.BinaryField(default=b'')  # Active shields, see game/board.py
+    last_activity = models.DateTimeField(default=timezone.now)  # Last poll or player socket activity
     game_start_time = models.DateTimeField(auto_now_add=True)
     game_end_time = models.DateTimeField(null=True, blank=True)
     time_survived = models.FloatField(default=0.0)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'last_activity']),
+            models.Index(fields=['player', 'status']),
+            models.Index(fields=['game_start_time']),  # Admin ordering and date hierarchy
+        ]
+    
     def __str__(self):
         return f"Game {self.id} - {self.player.username} - {self.status}"
     
+    def save(self, *args, **kwargs):
+        # The board is only written by place_shield/save_shield, so a stale
+        # copy loaded before a concurrent placement never overwrites it
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'board'
+            ]
+        super().save(*args, **kwargs)
+    
     @property
-    def shields_data(self):
-        try:
-            return json.loads(self.shields_placed)
-        except:
-            return []
+    def board_state(self):
+        return Board.decode(self.board)
     
-    @shields_data.setter
-    def shields_data(self, value):
-        self.shields_placed = json.dumps(value)
+    @board_state.setter
+    def board_state(self, value):
+        self.board = value.encode()
+    
+    def place_shield(self, shield_type, position_x, position_y, durability=1):
+        """Create a shield and add it to the board in one transaction"""
+        with transaction.atomic():
+            shield = Shield.objects.create(
+                game_session=self,
+                shield_type=shield_type,
+                position_x=position_x,
+                position_y=position_y,
+                durability=durability
+            )
+            board = Board.decode(
+                GameSession.objects.filter(pk=self.pk).values_list('board', flat=True).get()
+            )
+            board.add(shield_type, position_x, position_y, durability)
+            self.board_state = board
+            GameSession.objects.filter(pk=self.pk).update(board=self.board)
+        return shield
+    
+    def save_shield(self, shield):
+        """Save a shield's durability and active flag and mirror them on the board"""
+        with transaction.atomic():
+            shield.save(update_fields=['is_active', 'durability'])
+            board = Board.decode(
+                GameSession.objects.filter(pk=self.pk).values_list('board', flat=True).get()
+            )
+            if shield.is_active:
+                board.add(shield.shield_type, shield.position_x, shield.position_y, shield.durability)
+            else:
+                board.remove(shield.position_x, shield.position_y)
+            self.board_state = board
+            GameSession.objects.filter(pk=self.pk).update(board=self.board)
 
 class Shield(models.Model):
     SHIELD_TYPES = [
@@ -47,7 +97,7 @@ class Shield(models.Model):
         ('red', 'Pause Shield'),
     ]
     
-    game_session = models.ForeignKey(GameSession, on_delete=models.CASCADE, related_name='shields')
+    game_session = models.ForeignKey(GameSession, on_delete=models.CASCADE, related_name='shields', db_index=False)
     shield_type = models.CharField(max_length=10, choices=SHIELD_TYPES)
     position_x = models.IntegerField()
     position_y = models.IntegerField()
@@ -56,7 +106,18 @@ class Shield(models.Model):
     durability = models.IntegerField(default=1)  # Number of hits shield can take
     
     class Meta:
-        unique_together = ['game_session', 'position_x', 'position_y']
+        indexes = [
+            models.Index(fields=['game_session', 'is_active', 'position_x', 'position_y']),
+            models.Index(fields=['placed_at']),  # Admin date hierarchy
+        ]
+        constraints = [
+            # A cell holds one active shield; destroyed shields may share it
+            models.UniqueConstraint(
+                fields=['game_session', 'position_x', 'position_y'],
+                condition=models.Q(is_active=True),
+                name='unique_active_shield_per_cell'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.shield_type} shield at ({self.position_x}, {self.position_y})"
@@ -73,10 +134,13 @@ class GameEvent(models.Model):
         ('game_lost', 'Game Lost'),
     ]
     
-    game_session = models.ForeignKey(GameSession, on_delete=models.CASCADE, related_name='events')
+    game_session = models.ForeignKey(GameSession, on_delete=models.CASCADE, related_name='events', db_index=False)
     event_type = models.CharField(max_length=20, choices=EVENT_TYPES)
     data = models.TextField()  # JSON data for the event
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now, db_index=True)  # Set when buffered, not when flushed
+    
+    class Meta:
+        indexes = [models.Index(fields=['game_session', 'timestamp'])]
     
     def __str__(self):
         return f"{self.event_type} at {self.timestamp}"
@@ -97,13 +161,101 @@ class Leaderboard(models.Model):
     last_played = models.DateTimeField(auto_now=True)
     
     class Meta:
-        ordering = ['-highest_score', '-games_won']
+        ordering = ['-highest_score', '-games_won', 'id']
+        indexes = [models.Index(fields=['-highest_score', '-games_won', 'id'], name='leaderboard_ranking_idx')]
     
     def __str__(self):
         return f"{self.player.username} - {self.highest_score}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        entry = super().from_db(db, field_names, values)
+        if 'highest_score' in entry.__dict__ and 'games_won' in entry.__dict__:
+            entry._rank_key = (entry.highest_score, entry.games_won)
+        return entry
+    
+    def save(self, *args, **kwargs):
+        # Keep the rank index (game/ranking.py) and the cached leaderboard
+        # parts (game/leaderboard_cache.py) in step once the save commits
+        from .leaderboard_cache import entries_changed
+        from .ranking import keys_changed, rank_key
+        old = getattr(self, '_rank_key', None)
+        super().save(*args, **kwargs)
+        self._rank_key = (self.highest_score, self.games_won)
+        using = kwargs.get('using') or self._state.db
+        move = (rank_key(*old) if old else None, rank_key(*self._rank_key))
+        if old != self._rank_key:
+            keys_changed([move], using=using)
+        entries_changed([self.player_id], move, using=using)
+    
+    @property
+    def win_rate(self):
+        if self.total_games == 0:
+            return 0
+        return (self.games_won / self.total_games) * 100
+
+class PostGameJob(models.Model):
+    """A finished game whose leaderboard and player stats are still to be applied, see game/jobs.py"""
+    game = models.OneToOneField(GameSession, on_delete=models.CASCADE, related_name='post_game_job')
+    created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.IntegerField(default=0)  # Failed applications
+    last_error = models.TextField(blank=True)
+    
+    def __str__(self):
+        return f"Post-game job for game {self.game_id}"
+
+class LeaderboardRollup(models.Model):
+    """A player's results within one day or week, see game/rollups.py"""
+    PERIODS = [
+        ('day', 'Day'),
+        ('week', 'Week'),
+    ]
+    
+    period = models.CharField(max_length=4, choices=PERIODS)
+    period_start = models.DateField()  # The day, or the Monday of the week
+    player = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='leaderboard_rollups')
+    highest_score = models.IntegerField(default=0)
+    total_games = models.IntegerField(default=0)
+    games_won = models.IntegerField(default=0)
+    total_time_survived = models.FloatField(default=0.0)
+    last_played = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['period', 'period_start', '-highest_score', '-games_won', 'id'], name='rollup_ranking_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'period_start', 'player'], name='unique_rollup_per_player'),
+        ]
+    
+    def __str__(self):
+        return f"{self.player.username} - {self.period} of {self.period_start} - {self.highest_score}"
+    
     @property
     def win_rate(self):
         if self.total_games == 0:
             return 0
         return (self.games_won / self.total_games) * 100
+
+class ArchivedGame(models.Model):
+    """A finished GameSession moved out of the hot tables by archive_games, see game/history.py"""
+    id = models.BigIntegerField(primary_key=True)  # Same id the GameSession had
+    player = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='archived_games')
+    status = models.CharField(max_length=10, choices=GameSession.GAME_STATUS_CHOICES)
+    score = models.IntegerField(default=0)
+    hostage_timer = models.FloatField(default=0.0)
+    time_survived = models.FloatField(default=0.0)
+    game_start_time = models.DateTimeField()
+    game_end_time = models.DateTimeField()  # game_start_time if the game was abandoned
+    payload = models.BinaryField()  # zlib compressed JSON: final board, shields and events
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [models.Index(fields=['player', '-game_end_time'])]
+    
+    def __str__(self):
+        return f"Archived game {self.id} - {self.status}"
+    
+    @property
+    def details(self):
+        return json.loads(zlib.decompress(self.payload))
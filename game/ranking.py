@@ -0,0 +1,274 @@
+"""
+Leaderboard ranks and pages.
+
+A player's rank is one more than the number of players with a better
+(highest_score, games_won); ties share a rank, like RANK() over the
+leaderboard ordering. Pages are read with keyset pagination on
+(highest_score, games_won, id), which leaderboard_ranking_idx serves
+directly, so a page deep into millions of players costs the same as the first.
+
+Ranks come from a RankIndex kept in each process: counts of players per
+(highest_score, games_won) in two levels of Fenwick trees over the distinct
+values in use, so a rank lookup or an update is O(log n) and memory grows
+with the number of distinct (highest_score, games_won) pairs, not with the
+number of players or the size of the scores. Leaderboard.save() moves the player's key once its
+transaction commits. Writes that bypass save() (bulk updates, seed_data,
+other processes) are picked up by a rebuild every LEADERBOARD_RANK_TTL
+seconds, which runs in the background while the old counts keep serving.
+
+With LEADERBOARD_RANK_INDEX = False ranks come from a RANK() window function
+over the whole table instead.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Count, Q
+from .models import Leaderboard
+
+logger = logging.getLogger(__name__)
+
+RANK_ORDER = ('-highest_score', '-games_won', 'id')
+PAGE_SIZE = 25
+
+
+def rank_key(highest_score, games_won):
+    return max(0, highest_score), max(0, games_won)
+
+
+class Fenwick:
+    """
+    Counts per key with O(log n) sums of the keys above one. Slots are the
+    distinct keys added so far in sorted order, so memory grows with how many
+    keys there are, not with how large they get.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.counts = []
+        self.tree = [0]
+        self.total = 0
+
+    def add(self, key, delta):
+        slot = bisect_left(self.keys, key)
+        if slot == len(self.keys) or self.keys[slot] != key:
+            # Shifts the slots after it; the tree is rebuilt on the next query
+            self.keys.insert(slot, key)
+            self.counts.insert(slot, 0)
+            self.tree = None
+        self.counts[slot] += delta
+        self.total += delta
+        if self.tree is None:
+            return
+        i = slot + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def _build(self):
+        size = len(self.counts)
+        tree = [0] * (size + 1)
+        for i in range(1, size + 1):
+            tree[i] += self.counts[i - 1]
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def above(self, key):
+        """Sum of the counts of keys over key"""
+        if self.tree is None:
+            self._build()
+        i = bisect_right(self.keys, key)
+        below = 0
+        while i > 0:
+            below += self.tree[i]
+            i -= i & -i
+        return self.total - below
+
+
+class RankIndex:
+    """Players per (highest_score, games_won): a Fenwick tree over scores, and one over wins per score"""
+
+    def __init__(self):
+        self.scores = Fenwick()
+        self.wins = {}
+
+    def __len__(self):
+        return self.scores.total
+
+    def add(self, key, count=1):
+        score, won = key
+        self.scores.add(score, count)
+        wins = self.wins.get(score)
+        if wins is None:
+            wins = self.wins[score] = Fenwick()
+        wins.add(won, count)
+
+    def move(self, old, new):
+        """A player's key changed; None is no entry"""
+        if old == new:
+            return
+        if old is not None:
+            self.add(old, -1)
+        if new is not None:
+            self.add(new, 1)
+
+    def rank(self, key):
+        score, won = key
+        wins = self.wins.get(score)
+        return self.scores.above(score) + (wins.above(won) if wins else 0) + 1
+
+
+class Ranking:
+    """The process' RankIndex, built on first use and rebuilt in the background once stale"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index = None
+        self.loaded_at = 0.0
+        self.pending = None  # Moves made while a rebuild runs, replayed onto it
+
+    @staticmethod
+    def build():
+        index = RankIndex()
+        rows = Leaderboard.objects.order_by().values_list('highest_score', 'games_won').annotate(players=Count('id'))
+        for highest_score, games_won, players in rows.iterator():
+            index.add(rank_key(highest_score, games_won), players)
+        return index
+
+    def _current(self):
+        """Call with the lock held"""
+        if self.index is None:
+            self.index, self.loaded_at = self.build(), time.monotonic()
+        elif (self.pending is None
+              and time.monotonic() - self.loaded_at > getattr(settings, 'LEADERBOARD_RANK_TTL', 300)):
+            self.pending = []
+            threading.Thread(target=self._rebuild, name='leaderboard-ranks', daemon=True).start()
+        return self.index
+
+    def _rebuild(self):
+        try:
+            index = self.build()
+        except Exception:
+            logger.exception('Leaderboard rank rebuild failed')
+            index = None
+        finally:
+            connections.close_all()
+        with self.lock:
+            if index is not None:
+                for old, new in self.pending:
+                    index.move(old, new)
+                self.index = index
+            self.loaded_at = time.monotonic()
+            self.pending = None
+
+    def ranks(self, keys):
+        with self.lock:
+            index = self._current()
+            return [index.rank(key) for key in keys]
+
+    def move(self, moves):
+        """Apply committed (old, new) key changes"""
+        with self.lock:
+            if self.index is None:
+                return  # The first build reads them from the database
+            for old, new in moves:
+                self.index.move(old, new)
+            if self.pending is not None:
+                self.pending.extend(moves)
+
+    def clear(self):
+        with self.lock:
+            self.index = None
+
+
+ranking = Ranking()
+
+
+def keys_changed(moves, using=None):
+    """Move (old, new) leaderboard keys in the rank index once the current transaction commits"""
+    if moves:
+        transaction.on_commit(lambda: ranking.move(moves), using=using)
+
+
+def _window_ranks(player_ids):
+    table = connection.ops.quote_name(Leaderboard._meta.db_table)
+    placeholders = ', '.join(['%s'] * len(player_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT player_id, position FROM ('
+            f'SELECT player_id, RANK() OVER (ORDER BY highest_score DESC, games_won DESC) AS position FROM {table}'
+            f') ranked WHERE player_id IN ({placeholders})',
+            list(player_ids)
+        )
+        return dict(cursor.fetchall())
+
+
+def with_ranks(entries):
+    """Set .rank on each Leaderboard entry and return them"""
+    if not entries:
+        return entries
+    if getattr(settings, 'LEADERBOARD_RANK_INDEX', True):
+        ranks = ranking.ranks([rank_key(entry.highest_score, entry.games_won) for entry in entries])
+    else:
+        by_player = _window_ranks([entry.player_id for entry in entries])
+        ranks = [by_player[entry.player_id] for entry in entries]
+    for entry, rank in zip(entries, ranks):
+        entry.rank = rank
+    return entries
+
+
+def cursor_for(entry):
+    return f'{entry.highest_score}.{entry.games_won}.{entry.id}'
+
+
+def parse_cursor(cursor):
+    """(highest_score, games_won, id) from cursor_for(), ValueError if malformed"""
+    highest_score, games_won, entry_id = (int(part) for part in cursor.split('.'))
+    return highest_score, games_won, entry_id
+
+
+def after(cursor):
+    """Entries ranked below the cursor; the score bound lets the index seek to it"""
+    highest_score, games_won, entry_id = cursor
+    return Q(highest_score__lte=highest_score) & (
+        Q(highest_score__lt=highest_score) | Q(games_won__lt=games_won) | Q(games_won=games_won, id__gt=entry_id)
+    )
+
+
+def before(cursor):
+    """Entries ranked above the cursor"""
+    highest_score, games_won, entry_id = cursor
+    return Q(highest_score__gte=highest_score) & (
+        Q(highest_score__gt=highest_score) | Q(games_won__gt=games_won) | Q(games_won=games_won, id__lt=entry_id)
+    )
+
+
+def page(cursor=None, limit=PAGE_SIZE):
+    """
+    Ranked entries after a parse_cursor() cursor (from the top when None),
+    and the cursor of the next page or None on the last one
+    """
+    entries = Leaderboard.objects.select_related('player').order_by(*RANK_ORDER)
+    if cursor is not None:
+        entries = entries.filter(after(cursor))
+    entries = with_ranks(list(entries[:limit]))
+    return entries, cursor_for(entries[-1]) if len(entries) == limit else None
+
+
+def around(entry, count=5):
+    """Up to count ranked entries above and below entry, with entry in the middle"""
+    cursor = (entry.highest_score, entry.games_won, entry.id)
+    entries = Leaderboard.objects.select_related('player')
+    above = list(entries.filter(before(cursor)).order_by('highest_score', 'games_won', '-id')[:count])
+    below = list(entries.filter(after(cursor)).order_by(*RANK_ORDER)[:count])
+    return with_ranks(above[::-1] + [entry] + below)
+
+
+def player_rank(player):
+    """A player's Leaderboard entry with .rank set, or None if they have not finished a game"""
+    entry = Leaderboard.objects.filter(player=player).first()
+    return with_ranks([entry])[0] if entry is not None else None
@@ -0,0 +1,24 @@
+"""
+Token bucket rate limiting for inbound WebSocket messages.
+"""
+import time
+
+
+class TokenBucket:
+    """Allows bursts of up to `capacity` messages, refilled at `rate` per second"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def consume(self, tokens=1):
+        """Take tokens from the bucket, returning False if there are not enough"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
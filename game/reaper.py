@@ -0,0 +1,77 @@
+"""
+Ending games whose player has gone away.
+
+GameSession.last_activity is bumped by state polls and by the WebSocket
+ticker while its player is connected. Games that stay active without
+activity for GAME_IDLE_TIMEOUT seconds are ended as lost by reap_idle_games(),
+with the same scoring and leaderboard bookkeeping as a normal loss, so the
+loops that scan active games only see live players.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .events import record_event
+from .jobs import apply_results
+from .models import GameSession
+
+BATCH_SIZE = 500
+
+
+def idle_cutoff(now=None):
+    return (now or timezone.now()) - timedelta(seconds=getattr(settings, 'GAME_IDLE_TIMEOUT', 120))
+
+
+def live_games(now=None):
+    """Active games whose player has been seen within the idle timeout"""
+    return GameSession.objects.filter(status='active', last_activity__gte=idle_cutoff(now))
+
+
+def end_abandoned_games(games, reason='abandoned'):
+    """
+    End every active game in the queryset as lost. A game's time survived runs
+    up to its last activity and is scored like views.end_game scores a loss.
+    Returns the number of games ended.
+    """
+    ended = 0
+    while True:
+        batch = list(
+            games.filter(status='active').order_by('id')
+            .only('id', 'player_id', 'hostage_timer', 'game_start_time', 'last_activity')[:BATCH_SIZE]
+        )
+        if not batch:
+            return ended
+        with transaction.atomic():
+            _end_batch(batch, reason)
+        ended += len(batch)
+
+
+def _end_batch(games, reason):
+    now = timezone.now()
+    for game in games:
+        ended_at = min(max(game.last_activity, game.game_start_time), now)
+        game.status = 'lost'
+        game.game_end_time = ended_at
+        game.time_survived = (ended_at - game.game_start_time).total_seconds()
+        game.score = int(game.time_survived * 5)  # Score based on survival time
+
+    GameSession.objects.bulk_update(games, ['status', 'game_end_time', 'time_survived', 'score'])
+
+    # Already batched, so the stats are applied here rather than queued
+    apply_results([
+        (game.player_id, game.score, False, game.time_survived, game.game_end_time) for game in games
+    ])
+
+    for game in games:
+        record_event(game, 'game_lost', {
+            'reason': reason,
+            'final_score': game.score,
+            'time_survived': game.time_survived
+        })
+
+
+def reap_idle_games(now=None):
+    """End every active game idle for longer than GAME_IDLE_TIMEOUT"""
+    return end_abandoned_games(
+        GameSession.objects.filter(status='active', last_activity__lt=idle_cutoff(now))
+    )
@@ -0,0 +1,246 @@
+"""
+Binary replay recording of games, whether the tick engine (tick.py) or the
+run_game_loop and process_games commands advance them.
+
+Each game is recorded to two files under GAME_REPLAY_DIR:
+
+``<id>.rec``
+    Fixed-width RECORD structs. Every tick writes at least one record with
+    Ultron's position, the hostage timer and the status; a tick that changes
+    the board writes one record per shield added or removed.
+
+``<id>.idx``
+    One fixed-width INDEX_ENTRY per tick: the number of its first record, how
+    many records it has and the board masks at the start of the tick. Any
+    tick is therefore reached with one index read and one short record read,
+    without replaying the ticks before it.
+
+Both files start with an 8 byte header (MAGIC and VERSION). The recorder
+writes a tick's records before its index entry, so a reader only ever sees
+complete ticks.
+"""
+import mmap
+import os
+import struct
+from django.conf import settings
+from .board import Board, MASK_BYTES, SHIELD_TYPES, cell_index, cell_position
+from .models import GameSession
+
+MAGIC = b'SDRP'
+VERSION = 1
+HEADER = struct.Struct('<4sBxxx')
+
+# tick, x, y, status, op, shield type, cell, hostage timer
+RECORD = struct.Struct('<IBBBBBBf')
+# first record, record count, board masks in SHIELD_TYPES order
+INDEX_ENTRY = struct.Struct(f'<IH{MASK_BYTES * len(SHIELD_TYPES)}s')
+
+OP_NONE = 0
+OP_ADD = 1
+OP_REMOVE = 2
+
+STATUSES = [status for status, label in GameSession.GAME_STATUS_CHOICES]
+FINISHED_STATUSES = ('won', 'lost')
+
+
+def replay_dir():
+    return str(getattr(settings, 'GAME_REPLAY_DIR', os.path.join(settings.BASE_DIR, 'replays')))
+
+
+def replay_paths(game_id):
+    base = os.path.join(replay_dir(), str(game_id))
+    return base + '.rec', base + '.idx'
+
+
+def _masks(board):
+    return b''.join(board.masks[shield_type].to_bytes(MASK_BYTES, 'little') for shield_type in SHIELD_TYPES)
+
+
+def _board_from_masks(data):
+    board = Board()
+    for i, shield_type in enumerate(SHIELD_TYPES):
+        board.masks[shield_type] = int.from_bytes(data[i * MASK_BYTES:(i + 1) * MASK_BYTES], 'little')
+    return board
+
+
+def _replay_tick(board, records, offset, count):
+    """
+    Apply the shield changes of a tick's count records, starting at byte
+    offset, to the board at its start. Returns the tick's x, y, status, timer.
+    """
+    for i in range(count):
+        _, x, y, status, op, shield_type, cell, timer = RECORD.unpack_from(records, offset + i * RECORD.size)
+        if op == OP_ADD:
+            board.add(SHIELD_TYPES[shield_type], *cell_position(cell))
+        elif op == OP_REMOVE:
+            board.remove(*cell_position(cell))
+    return x, y, status, timer
+
+
+class ReplayRecorder:
+    """Appends the ticks of one game to its replay files"""
+
+    def __init__(self, game_id, shields=None):
+        self.game_id = game_id
+        self.records = None
+        self.index = None
+        self.open(shields)
+
+    def open(self, shields=None, truncate=False):
+        """
+        Open the files, continuing an existing recording unless truncate is
+        set. The board starts from shields, or where the recording left it.
+        """
+        self.close()
+        rec_path, idx_path = replay_paths(self.game_id)
+        os.makedirs(os.path.dirname(rec_path), exist_ok=True)
+        mode = 'wb' if truncate or not os.path.exists(idx_path) else 'ab'
+        self.records = open(rec_path, mode)
+        self.index = open(idx_path, mode)
+        if self.index.tell() == 0:
+            self.records.truncate(0)
+            for f in (self.records, self.index):
+                f.write(HEADER.pack(MAGIC, VERSION))
+        # Drop a partial trailing write left by a crash
+        self.tick = (self.index.tell() - HEADER.size) // INDEX_ENTRY.size
+        self.record_count = (self.records.tell() - HEADER.size) // RECORD.size
+        self.index.truncate(HEADER.size + self.tick * INDEX_ENTRY.size)
+        self.records.truncate(HEADER.size + self.record_count * RECORD.size)
+        if shields is not None:
+            self.board = Board.from_shields(shields)
+        else:
+            self.board = self._recorded_board() if self.tick else Board()
+
+    def _recorded_board(self):
+        """The board at the end of the last recorded tick"""
+        rec_path, idx_path = replay_paths(self.game_id)
+        with open(idx_path, 'rb') as index, open(rec_path, 'rb') as records:
+            index.seek(HEADER.size + (self.tick - 1) * INDEX_ENTRY.size)
+            first, count, masks = INDEX_ENTRY.unpack(index.read(INDEX_ENTRY.size))
+            records.seek(HEADER.size + first * RECORD.size)
+            data = records.read(count * RECORD.size)
+        board = _board_from_masks(masks)
+        _replay_tick(board, data, 0, count)
+        return board
+
+    def restart(self, shields=()):
+        """Start a new recording, e.g. when the game is reset"""
+        self.open(shields, truncate=True)
+
+    def record(self, state, added=(), removed=()):
+        """Write one tick; added and removed are shield dicts with 'type' and 'position'"""
+        x = state['ultron_position_x']
+        y = state['ultron_position_y']
+        status = STATUSES.index(state['status'])
+        timer = state['hostage_timer']
+        masks = _masks(self.board)
+
+        records = []
+        for op, shields in ((OP_ADD, added), (OP_REMOVE, removed)):
+            for shield in shields:
+                cell = cell_index(*shield['position'])
+                records.append(RECORD.pack(
+                    self.tick, x, y, status, op, SHIELD_TYPES.index(shield['type']), cell, timer
+                ))
+                if op == OP_ADD:
+                    self.board.add(shield['type'], *shield['position'])
+                else:
+                    self.board.remove(*shield['position'])
+        if not records:
+            records.append(RECORD.pack(self.tick, x, y, status, OP_NONE, 0, 0, timer))
+
+        self.records.write(b''.join(records))
+        self.records.flush()
+        self.index.write(INDEX_ENTRY.pack(self.record_count, len(records), masks))
+        self.index.flush()
+        self.record_count += len(records)
+        self.tick += 1
+
+    def close(self):
+        for f in (self.records, self.index):
+            if f is not None:
+                f.close()
+        self.records = self.index = None
+
+
+def record_tick(game):
+    """
+    Append a GameSession's current state as one tick. Shields added or removed
+    since the last recorded tick, e.g. placed through the HTTP API, are
+    recorded with it.
+    """
+    recorder = ReplayRecorder(game.id)
+    try:
+        shields = {tuple(shield['position']): shield for shield in game.board_state.shields()}
+        recorded = {tuple(shield['position']): shield for shield in recorder.board.shields()}
+        recorder.record(
+            {
+                'ultron_position_x': game.ultron_position_x,
+                'ultron_position_y': game.ultron_position_y,
+                'hostage_timer': game.hostage_timer,
+                'status': game.status,
+            },
+            added=[shield for position, shield in shields.items() if recorded.get(position) != shield],
+            removed=[shield for position, shield in recorded.items() if position not in shields],
+        )
+    finally:
+        recorder.close()
+
+
+class ReplayReader:
+    """Memory-mapped, random access view of a recorded game"""
+
+    def __init__(self, game_id):
+        rec_path, idx_path = replay_paths(game_id)
+        self._files = [open(rec_path, 'rb'), open(idx_path, 'rb')]
+        try:
+            self.records, self.index = (mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) for f in self._files)
+        except ValueError:  # Empty file
+            self.close()
+            raise FileNotFoundError(f'Replay for game {game_id} is empty')
+        for data in (self.records, self.index):
+            magic, version = HEADER.unpack_from(data, 0)
+            if magic != MAGIC or version != VERSION:
+                self.close()
+                raise ValueError(f'Not a version {VERSION} replay file')
+        self.ticks = (len(self.index) - HEADER.size) // INDEX_ENTRY.size
+
+    def __len__(self):
+        return self.ticks
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def frame(self, tick):
+        """The state at the end of a tick"""
+        if not 0 <= tick < self.ticks:
+            raise IndexError(tick)
+        first, count, masks = INDEX_ENTRY.unpack_from(self.index, HEADER.size + tick * INDEX_ENTRY.size)
+        board = _board_from_masks(masks)
+        x, y, status, timer = _replay_tick(board, self.records, HEADER.size + first * RECORD.size, count)
+        return {
+            'type': 'replay_frame',
+            'tick': tick,
+            'ultron_position': [x, y],
+            'hostage_timer': round(timer, 3),
+            'status': STATUSES[status],
+            'shields': board.shields()
+        }
+
+    def frames(self, start=0):
+        for tick in range(max(start, 0), self.ticks):
+            yield self.frame(tick)
+
+    def finished(self):
+        """Whether the last recorded tick ended the game"""
+        return bool(self.ticks) and self.frame(self.ticks - 1)['status'] in FINISHED_STATUSES
+
+    def close(self):
+        for data in (getattr(self, 'records', None), getattr(self, 'index', None)):
+            if isinstance(data, mmap.mmap):
+                data.close()
+        for f in self._files:
+            f.close()
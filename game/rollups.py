@@ -0,0 +1,160 @@
+"""
+Daily and weekly leaderboards.
+
+LeaderboardRollup holds one row per (period, period_start, player) with the
+totals Leaderboard keeps for all time (game/ranking.py). Every path that ends
+a game adds the result to the day and the week it ended in with
+record_results(): an insert that ignores existing rows followed by F()
+increments, so concurrent writers never lose an update and no request ever
+aggregates GameSession history.
+
+rebuild_window() recomputes one window from GameSession and ArchivedGame
+history, streaming the per-player totals in chunks, for backfills and
+repairs (python manage.py rebuild_rollups).
+
+Pages of a window are read from the rollup rows in rank order, keyset
+paginated like the all-time leaderboard, and cached for
+LEADERBOARD_WINDOW_CACHE_TTL seconds.
+"""
+from datetime import date, datetime, time, timedelta
+from itertools import islice
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from .history import FINISHED_STATUSES
+from .models import ArchivedGame, GameSession, LeaderboardRollup
+from .ranking import PAGE_SIZE, RANK_ORDER, after, before, cursor_for, parse_cursor
+
+PERIODS = ('day', 'week')
+
+
+def period_start(period, moment=None):
+    """The day of moment (a datetime or a date, default now), or the Monday of its week"""
+    if isinstance(moment, date) and not isinstance(moment, datetime):
+        day = moment
+    else:
+        day = timezone.localdate(moment or timezone.now())
+    return day - timedelta(days=day.weekday()) if period == 'week' else day
+
+
+def period_bounds(period, start):
+    """[begin, end) datetimes of the window starting on start"""
+    begin = timezone.make_aware(datetime.combine(start, time.min))
+    return begin, begin + timedelta(days=7 if period == 'week' else 1)
+
+
+def _add_totals(totals):
+    """Add {(period, period_start, player_id): totals} to the rollup rows, creating missing ones"""
+    LeaderboardRollup.objects.bulk_create([
+        LeaderboardRollup(period=period, period_start=start, player_id=player_id)
+        for period, start, player_id in totals
+    ], ignore_conflicts=True)
+    for (period, start, player_id), stats in totals.items():
+        LeaderboardRollup.objects.filter(period=period, period_start=start, player_id=player_id).update(
+            total_games=F('total_games') + stats['games'],
+            games_won=F('games_won') + stats['won'],
+            total_time_survived=F('total_time_survived') + stats['time'],
+            highest_score=Greatest('highest_score', stats['best']),
+            last_played=Greatest(Coalesce('last_played', Value(stats['last'])), Value(stats['last'])),
+        )
+
+
+def record_results(results):
+    """
+    Add finished games to their day and week rollups. results are
+    (player_id, score, won, time_survived, ended_at) tuples.
+    """
+    totals = {}
+    for player_id, score, won, time_survived, ended_at in results:
+        for period in PERIODS:
+            stats = totals.setdefault(
+                (period, period_start(period, ended_at), player_id),
+                {'games': 0, 'won': 0, 'time': 0.0, 'best': 0, 'last': ended_at}
+            )
+            stats['games'] += 1
+            stats['won'] += int(bool(won))
+            stats['time'] += time_survived
+            stats['best'] = max(stats['best'], score)
+            stats['last'] = max(stats['last'], ended_at)
+    if totals:
+        _add_totals(totals)
+
+
+def rebuild_window(period, start, chunk_size=1000):
+    """
+    Replace one window's rollup rows with totals computed from the games
+    that ended in it, hot and archived. Returns the number of players.
+    """
+    begin, end = period_bounds(period, start)
+    hot = GameSession.objects.filter(status__in=FINISHED_STATUSES).alias(
+        ended_at=Coalesce('game_end_time', 'game_start_time')
+    ).filter(ended_at__gte=begin, ended_at__lt=end)
+    archived = ArchivedGame.objects.filter(game_end_time__gte=begin, game_end_time__lt=end)
+
+    with transaction.atomic():
+        LeaderboardRollup.objects.filter(period=period, period_start=start).delete()
+        for games, ended_field in ((hot, Coalesce('game_end_time', 'game_start_time')), (archived, F('game_end_time'))):
+            rows = games.order_by().values('player_id').annotate(
+                games=Count('id'),
+                won=Count('id', filter=Q(status='won')),
+                best=Max('score'),
+                time=Sum('time_survived'),
+                last=Max(ended_field),
+            ).iterator(chunk_size=chunk_size)
+            while chunk := list(islice(rows, chunk_size)):
+                _add_totals({(period, start, row['player_id']): row for row in chunk})
+    return LeaderboardRollup.objects.filter(period=period, period_start=start).count()
+
+
+def _entry(row, rank):
+    return {
+        'rank': rank,
+        'player_id': row.player_id,
+        'player': {'username': row.player.username, 'avatar_url': row.player.avatar_url},
+        'highest_score': row.highest_score,
+        'total_games': row.total_games,
+        'games_won': row.games_won,
+        'win_rate': row.win_rate,
+        'last_played': row.last_played,
+    }
+
+
+def _window_page(period, start, cursor, limit):
+    window = LeaderboardRollup.objects.filter(period=period, period_start=start)
+    rows = window.select_related('player').order_by(*RANK_ORDER)
+    if cursor is not None:
+        rows = rows.filter(after(cursor))
+    rows = list(rows[:limit])
+    entries = []
+    if rows:
+        first = rows[0]
+        # Rows before the first one, and rows with a strictly better key (no id is below 0)
+        position = window.filter(before((first.highest_score, first.games_won, first.id))).count()
+        rank = window.filter(before((first.highest_score, first.games_won, 0))).count() + 1
+        previous = None
+        for offset, row in enumerate(rows):
+            key = (row.highest_score, row.games_won)
+            if previous is not None and key != previous:
+                rank = position + offset + 1
+            previous = key
+            entries.append(_entry(row, rank))
+    return {'entries': entries, 'next': cursor_for(rows[-1]) if len(rows) == limit else None}
+
+
+def window_page(period, cursor=None, limit=PAGE_SIZE, moment=None):
+    """
+    {'entries': ranked entry dicts, 'next': cursor or None} for the current
+    day or week (the one holding moment), after a cursor_for() cursor string.
+    Raises ValueError for a malformed cursor.
+    """
+    start = period_start(period, moment)
+    parsed = parse_cursor(cursor) if cursor else None
+    key = f'leaderboard:{period}:{start.isoformat()}:{cursor or ""}:{limit}'
+    page = cache.get(key)
+    if page is None:
+        page = _window_page(period, start, parsed, limit)
+        cache.set(key, page, getattr(settings, 'LEADERBOARD_WINDOW_CACHE_TTL', 30))
+    return page
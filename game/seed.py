@@ -0,0 +1,264 @@
+"""
+Deterministic synthetic data for benchmarks and load tests.
+
+seed_database() fills a database with players, their finished games (with
+shields, events, leaderboard entries and user stats that add up) and
+optionally a number of games in progress for tick loop load tests. The shape
+follows a busy deployment:
+
+- a few players play most games (activity is skewed towards low player ids)
+- recent days hold more games than old ones
+- game length is log-normal around MEDIAN_GAME_SECONDS, WIN_RATE of games are won
+- a game places 0-6 shields, most of which Ultron destroys before the end
+- events are the shield placements and destructions, some Ultron moves and
+  the final result, timestamped inside the game
+
+Games are generated and inserted chunk_size at a time together with their
+shields and events, so memory stays flat however many rows are asked for.
+The same seed produces the same games, relative to the time of the run.
+"""
+import json
+import math
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+from .board import CELLS, GRID_SIZE, SHIELD_TYPES, Board, cell_position
+from .models import GameEvent, GameSession, Leaderboard, Shield
+
+HISTORY_DAYS = 90
+EVENTS_PER_PLAYER = 100
+EVENTS_PER_GAME = 5
+PLAYER_SKEW = 1.5  # Share of games played by the most active players grows with this
+RECENCY_SKEW = 1.5  # Share of games in the most recent days grows with this
+MEDIAN_GAME_SECONDS = 45
+MAX_GAME_SECONDS = 600
+WIN_RATE = 0.3
+SHIELD_COUNT_WEIGHTS = [15, 20, 25, 20, 10, 7, 3]  # Games with 0, 1, ... 6 shields
+SHIELD_TYPE_WEIGHTS = [50, 30, 20]  # In SHIELD_TYPES order
+DESTROY_RATE = 0.7
+LIVE_DESTROY_RATE = 0.1
+# Expected events of a finished game before Ultron moves: placements, destructions and the result
+BASE_EVENTS = (
+    sum(count * weight for count, weight in enumerate(SHIELD_COUNT_WEIGHTS))
+    / sum(SHIELD_COUNT_WEIGHTS) * (1 + DESTROY_RATE) + 1
+)
+
+
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def next_id(model, using):
+    return (model.objects.using(using).aggregate(top=Max('id'))['top'] or 0) + 1
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """Keep the auto_now and auto_now_add values set on objects saved inside the block"""
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _event(game, event_type, timestamp, data):
+    return GameEvent(game_session_id=game.id, event_type=event_type, timestamp=timestamp, data=json.dumps(data))
+
+
+def _place_shields(rng, game, ended, destroy_rate):
+    """Shields of a game between its start and ended, with their events; sets game.board"""
+    board = Board()
+    shields = []
+    events = []
+    span = (ended - game.game_start_time).total_seconds()
+    count = rng.choices(range(len(SHIELD_COUNT_WEIGHTS)), SHIELD_COUNT_WEIGHTS)[0]
+    for cell in rng.sample(range(CELLS), count):
+        x, y = cell_position(cell)
+        shield_type = rng.choices(SHIELD_TYPES, SHIELD_TYPE_WEIGHTS)[0]
+        placed_at = game.game_start_time + timedelta(seconds=rng.uniform(0, span))
+        is_active = rng.random() >= destroy_rate
+        shields.append(Shield(
+            game_session_id=game.id,
+            shield_type=shield_type,
+            position_x=x,
+            position_y=y,
+            placed_at=placed_at,
+            is_active=is_active,
+        ))
+        events.append(_event(game, 'shield_placed', placed_at, {'shield_type': shield_type, 'position': [x, y]}))
+        if is_active:
+            board.add(shield_type, x, y)
+        else:
+            destroyed_at = placed_at + (ended - placed_at) * rng.random()
+            events.append(_event(game, 'shield_destroyed', destroyed_at, {'shield_type': shield_type, 'position': [x, y]}))
+    game.board = board.encode()
+    return shields, events
+
+
+def finished_game(rng, game_id, player_id, now, moves_mean=0.0):
+    """A won or lost game scored like views.end_game, with its shields and events"""
+    duration = min(MAX_GAME_SECONDS, rng.lognormvariate(math.log(MEDIAN_GAME_SECONDS), 0.6))
+    age = HISTORY_DAYS * 86400 * rng.random() ** RECENCY_SKEW
+    ended = now - timedelta(seconds=age)
+    won = rng.random() < WIN_RATE
+    hostage_timer = rng.uniform(1, 40) if won else max(0.0, 40.0 - duration)
+    game = GameSession(
+        id=game_id,
+        player_id=player_id,
+        status='won' if won else 'lost',
+        score=int(hostage_timer * 10) if won else int(duration * 5),
+        hostage_timer=hostage_timer,
+        ultron_position_x=rng.randrange(GRID_SIZE - 1),
+        ultron_position_y=rng.randrange(GRID_SIZE - 1),
+        game_start_time=ended - timedelta(seconds=duration),
+        game_end_time=ended,
+        last_activity=ended,
+        time_survived=duration,
+    )
+    shields, events = _place_shields(rng, game, ended, DESTROY_RATE)
+    for _ in range(int(rng.expovariate(1 / moves_mean)) if moves_mean > 0 else 0):
+        events.append(_event(game, 'ultron_moved', game.game_start_time + timedelta(seconds=rng.uniform(0, duration)), {
+            'position': [rng.randrange(GRID_SIZE - 1), rng.randrange(GRID_SIZE - 1)]
+        }))
+    events.append(_event(game, 'game_won' if won else 'game_lost', ended, {
+        'final_score': game.score,
+        'time_survived': duration,
+        'hostage_timer': hostage_timer
+    }))
+    return game, shields, events
+
+
+def live_game(rng, game_id, player_id, now):
+    """A game in progress whose player is connected, with its shields and events"""
+    elapsed = rng.uniform(0, 35)
+    game = GameSession(
+        id=game_id,
+        player_id=player_id,
+        status='active',
+        hostage_timer=40.0 - elapsed,
+        ultron_position_x=rng.randrange(GRID_SIZE // 2),
+        ultron_position_y=rng.randrange(GRID_SIZE // 2),
+        last_move_time=now,
+        last_timer_update=now,
+        game_start_time=now - timedelta(seconds=elapsed),
+        last_activity=now,
+    )
+    shields, events = _place_shields(rng, game, now, LIVE_DESTROY_RATE)
+    return game, shields, events
+
+
+def seed_database(using='default', rows=1_000_000, seed=0, chunk_size=5000, active=0, log=None):
+    """
+    Add about `rows` GameEvents with players, games, shields and leaderboard
+    entries in proportion, plus `active` games in progress, each for a
+    different player. Returns the number of rows inserted per model.
+    """
+    rng = random.Random(seed)
+    User = get_user_model()
+    now = timezone.now()
+    counts = {'User': 0, 'GameSession': 0, 'Shield': 0, 'GameEvent': 0, 'Leaderboard': 0}
+
+    def progress(model_name):
+        if log:
+            log(f'{model_name}: {counts[model_name]}')
+
+    player_count = max(1, rows // EVENTS_PER_PLAYER, active)
+    first_player = next_id(User, using)
+    password = make_password(None)
+    joined = now - timedelta(days=HISTORY_DAYS)
+    with explicit_timestamps(User):
+        for chunk in chunked((
+            User(
+                id=first_player + i, username=f'seed_{seed}_{first_player + i}', password=password,
+                date_joined=joined, created_at=joined, updated_at=now,
+            )
+            for i in range(player_count)
+        ), chunk_size):
+            User.objects.using(using).bulk_create(chunk)
+            counts['User'] += len(chunk)
+            progress('User')
+
+    game_count = max(1, rows // EVENTS_PER_GAME)
+    moves_mean = max(0.0, rows / game_count - BASE_EVENTS)
+    first_game = next_id(GameSession, using)
+    with explicit_timestamps(GameSession, Shield):
+        for start in range(0, game_count + active, chunk_size):
+            games, shields, events = [], [], []
+            for i in range(start, min(start + chunk_size, game_count + active)):
+                if i < game_count:
+                    player_id = first_player + int(player_count * rng.random() ** PLAYER_SKEW)
+                    game = finished_game(rng, first_game + i, player_id, now, moves_mean)
+                else:
+                    game = live_game(rng, first_game + i, first_player + i - game_count, now)
+                games.append(game[0])
+                shields.extend(game[1])
+                events.extend(game[2])
+            GameSession.objects.using(using).bulk_create(games)
+            Shield.objects.using(using).bulk_create(shields, batch_size=chunk_size)
+            GameEvent.objects.using(using).bulk_create(events, batch_size=chunk_size)
+            counts['GameSession'] += len(games)
+            counts['Shield'] += len(shields)
+            counts['GameEvent'] += len(events)
+            progress('GameSession')
+
+    # Leaderboard entries and user stats are totals of the games just added
+    stats = (
+        GameSession.objects.using(using)
+        .filter(id__gte=first_game, status__in=('won', 'lost'))
+        .values('player_id')
+        .annotate(
+            games=Count('id'),
+            won=Count('id', filter=Q(status='won')),
+            total_score=Sum('score'),
+            best_score=Max('score'),
+            time_survived=Sum('time_survived'),
+            last_played=Max('game_end_time'),
+        )
+        .order_by('player_id')
+    )
+    with transaction.atomic(using=using), explicit_timestamps(Leaderboard):
+        for chunk in chunked(stats.iterator(chunk_size=chunk_size), chunk_size):
+            Leaderboard.objects.using(using).bulk_create([
+                Leaderboard(
+                    player_id=row['player_id'],
+                    highest_score=row['best_score'],
+                    total_games=row['games'],
+                    games_won=row['won'],
+                    total_time_survived=row['time_survived'],
+                    last_played=row['last_played'],
+                )
+                for row in chunk
+            ])
+            User.objects.using(using).bulk_update([
+                User(
+                    id=row['player_id'],
+                    games_played=row['games'],
+                    games_won=row['won'],
+                    total_score=row['total_score'],
+                    best_score=row['best_score'],
+                )
+                for row in chunk
+            ], ['games_played', 'games_won', 'total_score', 'best_score'])
+            counts['Leaderboard'] += len(chunk)
+            progress('Leaderboard')
+    return counts
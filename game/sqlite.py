@@ -0,0 +1,19 @@
+"""
+Per-connection SQLite tuning.
+
+Pragmas are read from the PRAGMAS key of a DATABASES entry and applied as
+soon as Django opens the connection, so every thread, worker process and
+management command gets the same settings.
+"""
+from django.db.backends.signals import connection_created
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    for name, value in connection.settings_dict.get('PRAGMAS', {}).items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+
+
+def connect_signals():
+    connection_created.connect(apply_pragmas, dispatch_uid='game.sqlite.apply_pragmas')
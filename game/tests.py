@@ -1,3 +1,1394 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+import unittest
+from unittest.mock import patch
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import InMemoryChannelLayer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, OperationalError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.loader import MigrationLoader
+from django.test.utils import CaptureQueriesContext
+from django.http import Http404
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from .changelist import EstimatedCountPaginator, IndexedDateQuerySet
+from .channel_layers import LocalChannelLayer
+from .events import EventSink, archive_events, event_sink, iter_archived_events, record_event
+from .jobs import enqueue, process_jobs, schedule_drain
+from .history import archive_finished_games, get_game, get_game_details, player_games
+from .models import GameEvent, GameSession, Leaderboard, LeaderboardRollup, PostGameJob, Shield
+from . import api, async_views, consumers, jobs, leaderboard_cache, ranking, tick, warmup
+from .board import Board, cell_index
+from .game_logic import UltronAI, shortest_path
+from .rollups import period_start, rebuild_window, record_results, window_page
+from .reaper import live_games, reap_idle_games
+from .replay import ReplayReader, ReplayRecorder
+from .routing import websocket_urlpatterns
+from .seed import seed_database
+from .writer import WriteCoordinator
 
-# Create your tests here.
+try:
+    import channels_redis.core
+except ImportError:
+    channels_redis = None
+
+
+def isolate_event_sink(test):
+    """
+    Keep the global event sink to one test: its timer thread writes nothing,
+    and whatever the test recorded is flushed into the test's own database
+    before that is rolled back or truncated
+    """
+    patcher = patch.object(event_sink, '_schedule')
+    patcher.start()
+    test.addCleanup(patcher.stop)
+    test.addCleanup(event_sink.flush)
+
+
+def isolate_replays(test):
+    """Record the replays of games a test plays into a temporary GAME_REPLAY_DIR"""
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    settings_override = override_settings(GAME_REPLAY_DIR=directory.name)
+    settings_override.enable()
+    test.addCleanup(settings_override.disable)
+
+
+class ChannelLayerContract:
+    """
+    Behaviour every channel layer we deploy on must provide.
+    Subclasses return two layers standing in for two worker processes.
+    """
+
+    def make_layers(self):
+        raise NotImplementedError
+
+    def run_async(self, coro):
+        return asyncio.run(asyncio.wait_for(coro, 5))
+
+    def test_send_to_specific_channel(self):
+        async def scenario():
+            sender, receiver = self.make_layers()
+            channel = await receiver.new_channel()
+            await sender.send(channel, {'type': 'test.message', 'text': 'hello'})
+            message = await receiver.receive(channel)
+            await self.close_layers(sender, receiver)
+            return message
+
+        self.assertEqual(self.run_async(scenario())['text'], 'hello')
+
+    def test_group_send_reaches_every_member(self):
+        async def scenario():
+            sender, receiver = self.make_layers()
+            channels = [await receiver.new_channel() for _ in range(3)]
+            for channel in channels:
+                await receiver.group_add('game_1', channel)
+            await sender.group_send('game_1', {'type': 'game.message', 'text': 'tick'})
+            messages = [await receiver.receive(channel) for channel in channels]
+            await self.close_layers(sender, receiver)
+            return messages
+
+        self.assertEqual([m['text'] for m in self.run_async(scenario())], ['tick'] * 3)
+
+    def test_group_discard_stops_delivery(self):
+        async def scenario():
+            sender, receiver = self.make_layers()
+            kept = await receiver.new_channel()
+            dropped = await receiver.new_channel()
+            await receiver.group_add('game_2', kept)
+            await receiver.group_add('game_2', dropped)
+            await receiver.group_discard('game_2', dropped)
+            await sender.group_send('game_2', {'type': 'game.message', 'text': 'tick'})
+            await receiver.receive(kept)
+            try:
+                await asyncio.wait_for(receiver.receive(dropped), 0.2)
+                delivered = True
+            except asyncio.TimeoutError:
+                delivered = False
+            await self.close_layers(sender, receiver)
+            return delivered
+
+        self.assertFalse(self.run_async(scenario()))
+
+    def test_messages_keep_their_order(self):
+        async def scenario():
+            sender, receiver = self.make_layers()
+            channel = await receiver.new_channel()
+            await receiver.group_add('game_3', channel)
+            for seq in range(20):
+                await sender.group_send('game_3', {'type': 'game.message', 'seq': seq})
+            messages = [await receiver.receive(channel) for _ in range(20)]
+            await self.close_layers(sender, receiver)
+            return [m['seq'] for m in messages]
+
+        self.assertEqual(self.run_async(scenario()), list(range(20)))
+
+    async def close_layers(self, *layers):
+        await layers[0].flush()
+        for layer in layers:
+            await layer.close()
+
+
+class InMemoryChannelLayerTests(ChannelLayerContract, SimpleTestCase):
+    def make_layers(self):
+        layer = InMemoryChannelLayer()
+        return layer, layer
+
+
+class LocalChannelLayerTests(ChannelLayerContract, SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def make_layers(self):
+        return LocalChannelLayer(path=self.directory.name), LocalChannelLayer(path=self.directory.name)
+
+    def test_group_send_batches_per_process(self):
+        async def scenario():
+            sender, receiver = self.make_layers()
+            for _ in range(50):
+                await receiver.group_add('game_4', await receiver.new_channel())
+            sent = []
+            original = sender._send_datagram
+            sender._send_datagram = lambda process, data: (sent.append(process), original(process, data))
+            await sender.group_send('game_4', {'type': 'game.message', 'text': 'tick'})
+            await sender.group_send('game_4', {'type': 'game.message', 'text': 'tock'})
+            await asyncio.sleep(0)
+            await self.close_layers(sender, receiver)
+            return sent
+
+        self.assertEqual(len(self.run_async(scenario())), 1)
+
+    def test_dead_process_is_forgotten(self):
+        async def scenario():
+            sender, receiver = self.make_layers()
+            channel = await receiver.new_channel()
+            await receiver.group_add('game_5', channel)
+            await receiver.send(channel, {'type': 'bind'})
+            await receiver.close()
+            sender._group_channels('game_5')
+            await sender.group_send('game_5', {'type': 'game.message'})
+            await asyncio.sleep(0)
+            members = os.listdir(sender._group_dir('game_5'))
+            await sender.close()
+            return members
+
+        self.assertEqual(self.run_async(scenario()), [])
+
+    def test_group_send_across_processes(self):
+        script = textwrap.dedent('''
+            import asyncio, sys
+            from game.channel_layers import LocalChannelLayer
+
+            async def main():
+                layer = LocalChannelLayer(path=sys.argv[1])
+                channel = await layer.new_channel()
+                await layer.group_add('game_6', channel)
+                await layer.send(channel, {'type': 'bind'})
+                await layer.receive(channel)
+                print('ready', flush=True)
+                message = await layer.receive(channel)
+                print(message['text'], flush=True)
+                await layer.close()
+
+            asyncio.run(main())
+        ''')
+        child = subprocess.Popen(
+            [sys.executable, '-c', script, self.directory.name],
+            stdout=subprocess.PIPE, text=True, cwd=os.path.dirname(os.path.dirname(__file__))
+        )
+        self.addCleanup(child.kill)
+        self.assertEqual(child.stdout.readline().strip(), 'ready')
+
+        async def scenario():
+            sender = LocalChannelLayer(path=self.directory.name)
+            await sender.group_send('game_6', {'type': 'game.message', 'text': 'from parent'})
+            await asyncio.sleep(0)
+            await sender.close()
+
+        self.run_async(scenario())
+        self.assertEqual(child.stdout.readline().strip(), 'from parent')
+        child.wait(5)
+
+
+@unittest.skipUnless(
+    channels_redis and os.environ.get('REDIS_URL'),
+    'channels_redis is optional; set REDIS_URL to run against Redis'
+)
+class RedisChannelLayerTests(ChannelLayerContract, SimpleTestCase):
+    def make_layers(self):
+        hosts = [os.environ['REDIS_URL']]
+        return (
+            channels_redis.core.RedisChannelLayer(hosts=hosts),
+            channels_redis.core.RedisChannelLayer(hosts=hosts),
+        )
+
+
+class BoardTests(TestCase):
+    def setUp(self):
+        player = get_user_model().objects.create_user(username='board', password='x')
+        self.game = GameSession.objects.create(player=player)
+
+    def active_board(self):
+        """The board rebuilt from the game's active Shield rows"""
+        return Board.from_shields([
+            {'type': shield_type, 'position': [x, y], 'durability': durability}
+            for shield_type, x, y, durability in self.game.shields.filter(is_active=True).values_list(
+                'shield_type', 'position_x', 'position_y', 'durability')
+        ])
+
+    def stored_board(self):
+        return GameSession.objects.get(id=self.game.id).board_state
+
+    def test_encode_decode_round_trip(self):
+        board = Board()
+        board.add('blue', 0, 0)
+        board.add('yellow', 14, 14, durability=3)
+        board.add('red', 7, 3, durability=0)
+        board.add('blue', 7, 3)  # Replaces the red shield and its durability
+        decoded = Board.decode(board.encode())
+        self.assertEqual(decoded.masks, board.masks)
+        self.assertEqual(decoded.durability, {cell_index(14, 14): 3})
+        self.assertEqual(decoded.shield_at(7, 3), 'blue')
+        self.assertEqual(decoded.durability_at(14, 14), 3)
+        self.assertEqual(len(decoded), 3)
+        self.assertEqual(decoded.encode(), board.encode())
+
+        self.assertEqual(len(Board.decode(b'')), 0)
+        with self.assertRaises(ValueError):
+            Board.decode(b'\x09' + board.encode()[1:])
+
+    def test_board_follows_shield_rows(self):
+        self.game.place_shield('blue', 1, 1)
+        red = self.game.place_shield('red', 2, 2, durability=3)
+        self.assertEqual(self.stored_board().encode(), self.active_board().encode())
+
+        red.durability = 2
+        self.game.save_shield(red)
+        self.assertEqual(self.stored_board().durability_at(2, 2), 2)
+        red.is_active = False
+        self.game.save_shield(red)
+        self.assertNotIn((2, 2), self.stored_board())
+        self.assertEqual(self.stored_board().encode(), self.active_board().encode())
+
+    def test_save_leaves_the_board_alone(self):
+        stale = GameSession.objects.get(id=self.game.id)
+        self.game.place_shield('yellow', 4, 5)
+        stale.score = 10
+        with CaptureQueriesContext(connection) as queries:
+            stale.save()
+        self.assertNotIn('"board"', queries[0]['sql'])
+        game = GameSession.objects.get(id=self.game.id)
+        self.assertEqual((game.score, game.board_state.shield_at(4, 5)), (10, 'yellow'))
+
+
+class BoardMigrationTests(TransactionTestCase):
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([('game', target)])
+        return executor.loader.project_state([('game', target)]).apps
+
+    def test_backfill_encodes_active_shields(self):
+        self.addCleanup(self.migrate, MigrationLoader(connection).graph.leaf_nodes('game')[0][1])
+        apps = self.migrate('0006_gamesession_last_timer_update')
+        player = apps.get_model(*settings.AUTH_USER_MODEL.split('.')).objects.create(username='migrated')
+        game = apps.get_model('game', 'GameSession').objects.create(player_id=player.id)
+        empty = apps.get_model('game', 'GameSession').objects.create(player_id=player.id)
+        Shield = apps.get_model('game', 'Shield')
+        Shield.objects.create(game_session_id=game.id, shield_type='blue', position_x=1, position_y=2)
+        Shield.objects.create(game_session_id=game.id, shield_type='red', position_x=3, position_y=4, durability=2)
+        Shield.objects.create(game_session_id=game.id, shield_type='yellow', position_x=5, position_y=6, is_active=False)
+
+        apps = self.migrate('0007_gamesession_board')
+        GameSession = apps.get_model('game', 'GameSession')
+        board = Board.decode(GameSession.objects.get(id=game.id).board)
+        self.assertEqual(board.shields(), [{'type': 'blue', 'position': [1, 2]}, {'type': 'red', 'position': [3, 4]}])
+        self.assertEqual(board.durability_at(3, 4), 2)
+        self.assertEqual(bytes(GameSession.objects.get(id=empty.id).board), b'')
+
+
+class EventLogTests(TestCase):
+    def setUp(self):
+        player = get_user_model().objects.create_user(username='events', password='x')
+        self.game = GameSession.objects.create(player=player)
+
+    def test_sink_buffers_until_flush(self):
+        sink = EventSink(batch_size=1000, flush_interval=60)
+        for i in range(3):
+            sink.record(self.game.id, 'shield_placed', {'position': [i, 0]})
+        self.assertEqual(GameEvent.objects.count(), 0)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(sink.flush(), 3)
+        self.assertEqual(
+            [event.event_data['position'] for event in GameEvent.objects.order_by('id')],
+            [[0, 0], [1, 0], [2, 0]]
+        )
+
+    def test_archive_round_trip(self):
+        old = timezone.now() - timedelta(days=40)
+        for days in range(3):
+            GameEvent.objects.create(
+                game_session=self.game, event_type='timer_reduced',
+                data='{"new_timer": %d}' % days, timestamp=old - timedelta(days=days)
+            )
+        GameEvent.objects.create(game_session=self.game, event_type='game_lost', data='{}')
+
+        with tempfile.TemporaryDirectory() as path, override_settings(GAME_EVENT_ARCHIVE_DIR=path):
+            self.assertEqual(archive_events(timezone.now() - timedelta(days=30), chunk_size=2), 3)
+            archived = list(iter_archived_events(game_session_id=self.game.id))
+            newest_only = list(iter_archived_events(start=timezone.localdate(old)))
+
+        self.assertEqual([event['data']['new_timer'] for event in archived], [2, 1, 0])
+        self.assertEqual(len(newest_only), 1)
+        self.assertEqual(list(GameEvent.objects.values_list('event_type', flat=True)), ['game_lost'])
+
+
+class ReplayTests(SimpleTestCase):
+    def setUp(self):
+        isolate_replays(self)
+
+    def record_game(self, game_id):
+        recorder = ReplayRecorder(game_id)
+        state = {'ultron_position_x': 0, 'ultron_position_y': 7, 'hostage_timer': 40.0, 'status': 'active'}
+        recorder.record(state, [{'type': 'blue', 'position': [3, 4]}, {'type': 'red', 'position': [5, 6]}])
+        for x in range(1, 5):
+            recorder.record(dict(state, ultron_position_x=x, hostage_timer=40.0 - x))
+        recorder.record(dict(state, ultron_position_x=5, status='lost'), removed=[{'type': 'red', 'position': [5, 6]}])
+        recorder.close()
+
+    def test_seek_to_any_tick(self):
+        self.record_game(1)
+        with ReplayReader(1) as reader:
+            self.assertEqual(len(reader), 6)
+            self.assertTrue(reader.finished())
+            frame = reader.frame(3)
+            self.assertEqual(frame['ultron_position'], [3, 7])
+            self.assertEqual(frame['hostage_timer'], 37.0)
+            self.assertEqual(len(frame['shields']), 2)
+            self.assertEqual(reader.frame(5)['shields'], [{'type': 'blue', 'position': [3, 4]}])
+
+    def test_reopening_continues_the_recording(self):
+        recorder = ReplayRecorder(2)
+        recorder.record({'ultron_position_x': 0, 'ultron_position_y': 7, 'hostage_timer': 40.0, 'status': 'active'},
+                        [{'type': 'yellow', 'position': [1, 1]}])
+        recorder.close()
+        recorder = ReplayRecorder(2, [{'type': 'yellow', 'position': [1, 1]}])
+        recorder.record({'ultron_position_x': 1, 'ultron_position_y': 7, 'hostage_timer': 39.0, 'status': 'won'})
+        recorder.close()
+        with ReplayReader(2) as reader:
+            self.assertEqual([frame['tick'] for frame in reader.frames()], [0, 1])
+            self.assertEqual(reader.frame(1)['shields'], [{'type': 'yellow', 'position': [1, 1]}])
+
+    def test_endpoint_streams_finished_games_only(self):
+        self.record_game(3)
+        response = self.client.get('/api/game/replay/3/?from=4')
+        self.assertEqual(response.status_code, 200)
+        frames = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([frame['tick'] for frame in frames], [4, 5])
+        self.assertEqual(frames[-1]['status'], 'lost')
+
+        self.assertEqual(self.client.get('/api/game/replay/4/').status_code, 404)
+
+    async def test_async_endpoint_streams_the_same_frames(self):
+        self.record_game(5)
+        response = await async_views.replay(AsyncRequestFactory().get('/api/game/replay/5/?from=4'), 5)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual([json.loads(line)['tick'] for line in body.splitlines()], [4, 5])
+        with self.assertRaises(Http404):
+            await async_views.replay(AsyncRequestFactory().get('/api/game/replay/4/'), 4)
+
+
+class GameLoopReplayTests(TestCase):
+    def setUp(self):
+        isolate_event_sink(self)
+        isolate_replays(self)
+        player = get_user_model().objects.create_user(username='polling', password='x')
+        self.game = GameSession.objects.create(player=player, ultron_position_y=7)
+
+    def test_game_loops_record_polled_games(self):
+        from .management.commands.run_game_loop import Command as RunGameLoop
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            RunGameLoop().process_active_games()
+        self.game.place_shield('yellow', 9, 9)
+        red = self.game.place_shield('red', 10, 10)
+        call_command('process_games', stdout=io.StringIO())
+        red.is_active = False
+        self.game.save_shield(red)
+        GameSession.objects.filter(id=self.game.id).update(hostage_timer=0.5, last_timer_update=None)
+        with contextlib.redirect_stdout(io.StringIO()):
+            RunGameLoop().process_active_games()  # The hostages escape
+
+        with ReplayReader(self.game.id) as reader:
+            frames = list(reader.frames())
+            self.assertTrue(reader.finished())
+        self.assertEqual(len(frames), 3)
+        self.assertNotEqual(frames[0]['ultron_position'], [0, 7])
+        self.assertEqual(frames[1]['shields'], [{'type': 'yellow', 'position': [9, 9]}, {'type': 'red', 'position': [10, 10]}])
+        self.assertEqual(frames[2]['shields'], [{'type': 'yellow', 'position': [9, 9]}])
+
+    def test_polled_state_is_recorded(self):
+        self.client.force_login(self.game.player)
+        with patch('game.views.write', lambda fn, *args, **kwargs: fn(*args, **kwargs)), \
+                contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(2):
+                self.assertTrue(self.client.get(f'/game/api/game/state/{self.game.id}/').json()['success'])
+        with ReplayReader(self.game.id) as reader:
+            self.assertEqual(len(reader), 2)
+            self.assertNotEqual(reader.frame(0)['ultron_position'], [0, 7])
+
+    def test_rolled_back_poll_is_not_recorded(self):
+        def rolled_back(fn, *args, **kwargs):
+            fn(*args, **kwargs)
+            raise DatabaseError('rolled back')
+
+        self.client.force_login(self.game.player)
+        with patch('game.views.write', rolled_back), contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(self.client.get(f'/game/api/game/state/{self.game.id}/').json()['success'])
+        with self.assertRaises(FileNotFoundError):
+            ReplayReader(self.game.id)
+
+
+class WriteCoordinatorTests(TransactionTestCase):
+    def setUp(self):
+        player = get_user_model().objects.create_user(username='writer', password='x')
+        self.game = GameSession.objects.create(player=player)
+        self.coordinator = WriteCoordinator(max_delay=0.05)
+        self.addCleanup(self.coordinator.close)
+
+    def log(self, n):
+        return GameEvent.objects.create(game_session=self.game, event_type='shield_placed', data=str(n)).id
+
+    def test_queued_writes_share_commits(self):
+        futures = [self.coordinator.submit(self.log, n) for n in range(50)]
+        self.assertEqual(len({future.result(5) for future in futures}), 50)
+        self.assertEqual(GameEvent.objects.count(), 50)
+        self.assertLess(self.coordinator.commits, 50)
+
+    def test_failing_write_only_rolls_back_itself(self):
+        def fail():
+            self.log(-1)
+            raise ValueError('rejected')
+
+        with self.assertLogs('game.writer', 'WARNING'):
+            futures = [self.coordinator.submit(self.log, 1), self.coordinator.submit(fail), self.coordinator.submit(self.log, 2)]
+            self.assertIsInstance(futures[0].result(5), int)
+            with self.assertRaises(ValueError):
+                futures[1].result(5)
+            self.assertIsInstance(futures[2].result(5), int)
+        self.assertEqual(sorted(GameEvent.objects.values_list('data', flat=True)), ['1', '2'])
+
+    def test_awaitable(self):
+        async def scenario():
+            return await asyncio.wrap_future(self.coordinator.submit(self.log, 7))
+
+        event_id = asyncio.run(scenario())
+        self.assertEqual(GameEvent.objects.get(id=event_id).data, '7')
+
+    def test_foreign_key_failure_only_fails_its_own_write(self):
+        def orphan():
+            return GameEvent.objects.create(game_session_id=self.game.id + 1000, event_type='game_lost', data='{}').id
+
+        with self.assertLogs('game.writer', 'WARNING'):
+            futures = [self.coordinator.submit(self.log, 1), self.coordinator.submit(orphan), self.coordinator.submit(self.log, 2)]
+            self.assertIsInstance(futures[0].result(5), int)
+            with self.assertRaises(IntegrityError):
+                futures[1].result(5)
+            self.assertIsInstance(futures[2].result(5), int)
+        self.assertEqual(sorted(GameEvent.objects.values_list('data', flat=True)), ['1', '2'])
+
+    def test_retried_groups_apply_each_write_once(self):
+        isolate_event_sink(self)
+        polled = GameSession.objects.create(player=self.game.player, ultron_position_x=12, ultron_position_y=13)
+        sink = EventSink()
+        with patch.object(sink, '_schedule'):
+            for n in range(3):
+                sink.record(self.game.id, 'shield_placed', n)
+
+        def orphan():
+            return GameEvent.objects.create(game_session_id=self.game.id + 1000, event_type='game_lost', data='{}').id
+
+        with self.assertLogs('game.writer', 'WARNING'), contextlib.redirect_stdout(io.StringIO()):
+            futures = [
+                self.coordinator.submit(api.advance_game, polled),  # Ultron reaches the target
+                self.coordinator.submit(sink._insert, sink._take()),
+                self.coordinator.submit(orphan),
+            ]
+            futures[0].result(5)
+            self.assertEqual(futures[1].result(5), 3)
+            with self.assertRaises(IntegrityError):
+                futures[2].result(5)
+
+        polled.refresh_from_db()
+        self.assertEqual((polled.status, polled.ultron_position_x, polled.ultron_position_y), ('lost', 13, 13))
+        self.assertTrue(PostGameJob.objects.filter(game=polled).exists())
+        event_sink.flush()
+        self.assertEqual(GameEvent.objects.filter(game_session=polled, event_type='game_lost').count(), 1)
+        self.assertEqual(sorted(GameEvent.objects.filter(game_session=self.game).values_list('data', flat=True)), ['0', '1', '2'])
+
+    def test_cancelled_callers_do_not_stop_the_writer(self):
+        started, release = threading.Event(), threading.Event()
+
+        def blocking():
+            started.set()
+            release.wait(5)
+
+        first = self.coordinator.submit(blocking)
+        started.wait(5)
+        self.assertFalse(first.cancel())  # Already running
+        queued = self.coordinator.submit(self.log, 1)
+        self.assertTrue(queued.cancel())
+
+        async def cancelled_awrite():
+            task = asyncio.ensure_future(asyncio.wrap_future(self.coordinator.submit(self.log, 2)))
+            await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancelled_awrite())
+        release.set()
+        self.assertEqual(GameEvent.objects.get(id=self.coordinator.submit(self.log, 3).result(5)).data, '3')
+        self.assertIsNone(first.result(5))
+        self.assertEqual(list(GameEvent.objects.values_list('data', flat=True)), ['3'])
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class GameConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.player = get_user_model().objects.create_user(username='sockets', password='x')
+        self.watcher = get_user_model().objects.create_user(username='watcher', password='x')
+        self.game = GameSession.objects.create(player=self.player, ultron_position_y=7)
+        isolate_replays(self)
+        for name, value in (('TICK_INTERVAL', 0.05), ('RELEASE_GRACE', 5), ('SPECTATOR_POLL_INTERVAL', 60)):
+            patcher = patch.object(tick, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def communicator(self, user=None, query=''):
+        router = URLRouter(websocket_urlpatterns)
+
+        async def application(scope, receive, send):
+            return await router(dict(scope, user=user), receive, send)
+
+        return WebsocketCommunicator(application, f'/ws/game/{self.game.id}/{query}')
+
+    async def connect(self, user=None, query=''):
+        communicator = self.communicator(user, query)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def drop_tickers(self):
+        """Forget the tickers kept for their grace period before this test's loop closes"""
+        for ticker in list(tick._tickers.values()):
+            if ticker.expiry is not None:
+                ticker.expiry.cancel()
+            tick.drop(ticker)
+
+    async def test_resume_across_a_disconnect(self):
+        player = await self.connect(self.player)
+        self.assertEqual((await player.receive_json_from())['type'], 'game_state')
+        first = await player.receive_json_from()
+        second = await player.receive_from()
+        await player.disconnect()
+
+        player = await self.connect(self.player, f'?last_seq={first["seq"]}')
+        self.assertEqual(await player.receive_from(), second)
+        self.assertEqual((await player.receive_json_from())['type'], 'game_delta')
+        await player.disconnect()
+        await self.drop_tickers()
+
+    async def test_resume_message_replays_missed_frames(self):
+        player = await self.connect(self.player)
+        await player.receive_json_from()
+        first = await player.receive_json_from()
+        await player.send_json_to({'type': 'pause_game'})
+        seen = []
+        while not seen or json.loads(seen[-1]).get('status') != 'paused':
+            seen.append(await player.receive_from())
+
+        await player.send_json_to({'type': 'resume', 'last_seq': first['seq']})
+        self.assertEqual([await player.receive_from() for _ in seen], seen)
+        self.assertTrue(await player.receive_nothing())
+        await player.disconnect()
+        await self.drop_tickers()
+
+    async def test_two_sockets_drive_one_loop(self):
+        first, second = await self.connect(self.player), await self.connect(self.player)
+        for communicator in (first, second):
+            self.assertEqual((await communicator.receive_json_from())['type'], 'game_state')
+        ticker = tick._tickers[self.game.id]
+        self.assertEqual((ticker.refs, ticker.players), (2, 2))
+        task = ticker.task
+
+        frames = {}
+        for communicator in (first, second):
+            async for frame in self.frames(communicator, 'game_delta', 2):
+                frames.setdefault(frame['seq'], []).append(frame)
+        self.assertTrue(any(len(copies) == 2 and copies[0] == copies[1] for copies in frames.values()))
+        self.assertIs(ticker.task, task)
+
+        await first.disconnect()
+        self.assertEqual((ticker.refs, ticker.players), (1, 1))
+        self.assertIs(ticker.task, task)
+        await second.disconnect()
+        self.assertIsNone(ticker.task)
+        await self.drop_tickers()
+
+    async def frames(self, communicator, frame_type, count):
+        """Yield the next count frames of a type, skipping others"""
+        while count:
+            frame = await communicator.receive_json_from()
+            if frame['type'] == frame_type:
+                count -= 1
+                yield frame
+
+    async def test_spectator_is_rejected_without_a_query(self):
+        spectator = await self.connect(self.watcher)
+        self.assertEqual((await spectator.receive_json_from())['type'], 'game_state')
+        self.assertEqual(tick._tickers[self.game.id].players, 0)
+
+        with patch('django.db.backends.utils.CursorWrapper.execute') as execute:
+            await spectator.send_json_to({'type': 'place_shield', 'shield_type': 'blue', 'position_x': 3, 'position_y': 3})
+            error = await spectator.receive_json_from()
+            await spectator.send_json_to({'type': 'start_game'})
+            await spectator.receive_json_from()
+        self.assertEqual(error['message'], 'Spectators cannot control the game')
+        execute.assert_not_called()
+        self.assertFalse(await database_sync_to_async(Shield.objects.exists)())
+        await spectator.disconnect()
+        await self.drop_tickers()
+
+    async def test_placements_in_one_tick_share_a_write_and_a_delta(self):
+        with patch.object(tick, 'TICK_INTERVAL', 0.5), patch.object(tick, 'awrite', wraps=tick.awrite) as awrite:
+            player = await self.connect(self.player)
+            await player.receive_json_from()
+            self.assertEqual((await player.receive_json_from())['type'], 'game_delta')
+            awrite.reset_mock()
+            for x in (10, 11, 12):
+                await player.send_json_to({'type': 'place_shield', 'shield_type': 'blue', 'position_x': x, 'position_y': 0})
+            delta = await player.receive_json_from()
+            self.assertEqual(awrite.call_count, 1)
+        self.assertEqual(delta['type'], 'game_delta')
+        self.assertEqual([shield['position'] for shield in delta['shields_added']], [[10, 0], [11, 0], [12, 0]])
+        self.assertEqual(await database_sync_to_async(Shield.objects.filter(game_session=self.game).count)(), 3)
+        await player.disconnect()
+        await self.drop_tickers()
+
+    async def test_spectators_follow_a_game_played_over_http(self):
+        with patch.object(tick, 'SPECTATOR_POLL_INTERVAL', 0.05):
+            spectator = await self.connect(self.watcher)
+            await spectator.receive_json_from()
+            await database_sync_to_async(GameSession.objects.filter(id=self.game.id).update)(ultron_position_x=1)
+            await database_sync_to_async(self.game.place_shield)('yellow', 4, 4)
+            delta = await spectator.receive_json_from()
+            if 'shields_added' not in delta:
+                delta.update(await spectator.receive_json_from())
+            await database_sync_to_async(Shield.objects.filter(game_session=self.game).delete)()
+            await database_sync_to_async(GameSession.objects.filter(id=self.game.id).update)(board=b'')
+            snapshot = await spectator.receive_json_from()
+        self.assertEqual(delta['type'], 'game_delta')
+        self.assertEqual(delta['ultron_position'], [1, 7])
+        self.assertEqual(delta['shields_added'], [{'type': 'yellow', 'position': [4, 4]}])
+        self.assertEqual((snapshot['type'], snapshot['shields']), ('game_state', []))
+        await spectator.disconnect()
+        await self.drop_tickers()
+
+    async def test_message_flood_is_rate_limited(self):
+        spectator = await self.connect(query='?role=spectator')
+        snapshot = await spectator.receive_json_from()
+        for _ in range(consumers.MESSAGE_BURST + 5):
+            await spectator.send_json_to({'type': 'resume', 'last_seq': snapshot['seq']})
+        error = await spectator.receive_json_from()
+        self.assertEqual(error['message'], 'Rate limit exceeded')
+        self.assertTrue(await spectator.receive_nothing())
+        await spectator.disconnect()
+        await self.drop_tickers()
+
+
+class GameTickerWriteTests(TransactionTestCase):
+    def setUp(self):
+        player = get_user_model().objects.create_user(username='ticker', password='x')
+        self.game = GameSession.objects.create(player=player, ultron_position_y=7)
+        isolate_replays(self)
+
+    async def ticker(self):
+        ticker = tick.GameTicker(self.game.id, InMemoryChannelLayer())
+        await ticker.load()
+        self.addCleanup(ticker.recorder.close)
+        return ticker
+
+    async def test_locked_database_keeps_changes_for_the_next_flush(self):
+        ticker = await self.ticker()
+        ticker.inputs.append(('blue', 3, 3, 'nobody'))
+        ticker.apply_inputs()
+        ticker.set(ultron_position_x=1)
+        with patch.object(tick, 'awrite', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('game.tick', 'WARNING'):
+            await ticker.tick(advance=False)
+        self.assertEqual(ticker.dirty, {'ultron_position_x'})
+        self.assertEqual(len(ticker.new_shields), 1)
+
+        await ticker.flush()
+        game = await database_sync_to_async(GameSession.objects.get)(id=self.game.id)
+        self.assertEqual(game.ultron_position_x, 1)
+        self.assertIn((3, 3), game.board_state)
+        self.assertEqual(await database_sync_to_async(Shield.objects.count)(), 1)
+
+    async def test_conflicting_shield_reloads_the_game(self):
+        ticker = await self.ticker()
+        await database_sync_to_async(self.game.place_shield)('red', 3, 3)
+        ticker.inputs.append(('blue', 3, 3, 'nobody'))
+        ticker.apply_inputs()
+        with self.assertLogs('game', 'WARNING'):
+            await ticker.flush()
+        self.assertEqual(ticker.shields[(3, 3)]['type'], 'red')
+        self.assertFalse(ticker.new_shields)
+        self.assertEqual(json.loads(ticker.replay[-1][1])['type'], 'game_state')
+
+    async def test_failing_ticks_keep_the_loop_running(self):
+        ticker = await self.ticker()
+        with patch.object(tick, 'TICK_INTERVAL', 0.01), \
+                patch.object(ticker, 'advance', side_effect=RuntimeError('boom')) as advance, \
+                self.assertLogs('game.tick', 'ERROR'):
+            ticker.start()
+            while advance.call_count < 3:
+                await asyncio.sleep(0.01)
+            await ticker.stop()
+        self.assertIsNone(ticker.task)
+
+
+class GameArchiveTests(TestCase):
+    def setUp(self):
+        self.player = get_user_model().objects.create_user(username='history', password='x')
+
+    def finished_game(self, days_ago, status='won', score=100):
+        ended = timezone.now() - timedelta(days=days_ago)
+        game = GameSession.objects.create(player=self.player, status=status, score=score, game_end_time=ended)
+        game.place_shield('yellow', 2, 3)
+        GameEvent.objects.create(game_session=game, event_type='game_won', data='{"final_score": %d}' % score)
+        return game
+
+    def test_archive_moves_old_finished_games_only(self):
+        old = self.finished_game(40)
+        recent = self.finished_game(1, status='lost', score=50)
+        active = GameSession.objects.create(player=self.player)
+
+        self.assertEqual(archive_finished_games(timezone.now() - timedelta(days=30), batch_size=1), 1)
+
+        self.assertEqual(set(GameSession.objects.values_list('id', flat=True)), {recent.id, active.id})
+        self.assertFalse(Shield.objects.filter(game_session_id=old.id).exists())
+        self.assertFalse(GameEvent.objects.filter(game_session_id=old.id).exists())
+
+        details = get_game_details(old.id)
+        self.assertTrue(details['archived'])
+        self.assertEqual(details['score'], 100)
+        self.assertEqual(details['board'], [{'type': 'yellow', 'position': [2, 3]}])
+        self.assertEqual(details['events'][0]['data'], {'final_score': 100})
+        self.assertFalse(get_game(recent.id)['archived'])
+
+        self.assertEqual([game['id'] for game in player_games(self.player)], [recent.id, old.id])
+
+    @override_settings(POST_GAME_JOBS_IN_PROCESS=False)
+    def test_games_with_a_pending_job_stay_until_it_is_applied(self):
+        isolate_event_sink(self)
+        game = self.finished_game(40)
+        enqueue(game)
+        record_event(game, 'shield_destroyed', {'position': [2, 3]})
+        cutoff = timezone.now() - timedelta(days=30)
+
+        self.assertEqual(archive_finished_games(cutoff), 0)
+        self.assertEqual(process_jobs(), 1)
+        self.assertEqual(Leaderboard.objects.get(player=self.player).total_games, 1)
+        self.assertEqual(archive_finished_games(cutoff), 1)
+        self.assertEqual([event['event_type'] for event in get_game_details(game.id)['events']],
+                         ['game_won', 'shield_destroyed'])
+
+
+class ReaperTests(TestCase):
+    def setUp(self):
+        isolate_event_sink(self)
+        isolate_replays(self)
+        self.player = get_user_model().objects.create_user(username='idle', password='x')
+
+    def game(self, idle_seconds, started_seconds_ago=600):
+        now = timezone.now()
+        game = GameSession.objects.create(player=self.player, last_activity=now - timedelta(seconds=idle_seconds))
+        GameSession.objects.filter(id=game.id).update(game_start_time=now - timedelta(seconds=started_seconds_ago))
+        return game
+
+    def test_reaps_idle_games_with_scoring(self):
+        idle = self.game(idle_seconds=500)
+        live = self.game(idle_seconds=5)
+
+        with override_settings(GAME_IDLE_TIMEOUT=120):
+            self.assertEqual(reap_idle_games(), 1)
+            self.assertEqual(list(live_games().values_list('id', flat=True)), [live.id])
+
+        idle.refresh_from_db()
+        self.assertEqual(idle.status, 'lost')
+        self.assertAlmostEqual(idle.time_survived, 100, delta=1)
+        self.assertEqual(idle.score, int(idle.time_survived * 5))
+
+        leaderboard = Leaderboard.objects.get(player=self.player)
+        self.assertEqual((leaderboard.total_games, leaderboard.highest_score), (1, idle.score))
+        self.player.refresh_from_db()
+        self.assertEqual((self.player.games_played, self.player.total_score, self.player.best_score),
+                         (1, idle.score, idle.score))
+
+    def test_starting_a_game_scores_the_abandoned_one(self):
+        abandoned = self.game(idle_seconds=0, started_seconds_ago=20)
+        self.client.force_login(self.player)
+        with patch('game.views.write', lambda fn, *args, **kwargs: fn(*args, **kwargs)):
+            response = self.client.post('/game/api/game/start/')
+        self.assertTrue(response.json()['success'])
+
+        abandoned.refresh_from_db()
+        self.assertEqual(abandoned.status, 'lost')
+        self.assertGreater(abandoned.score, 0)
+        self.assertEqual(Leaderboard.objects.get(player=self.player).total_games, 1)
+
+    def test_process_games_command(self):
+        idle = self.game(idle_seconds=500)
+        live = self.game(idle_seconds=5)
+        out = io.StringIO()
+        with override_settings(GAME_IDLE_TIMEOUT=120):
+            call_command('process_games', stdout=out)
+        self.assertIn('Ended 1 idle games', out.getvalue())
+        self.assertNotIn('Error processing', out.getvalue())
+
+        idle.refresh_from_db()
+        live.refresh_from_db()
+        self.assertEqual(idle.status, 'lost')
+        self.assertEqual((live.status, live.hostage_timer), ('active', 39.0))
+        self.assertNotEqual((live.ultron_position_x, live.ultron_position_y), (0, 0))
+
+
+@override_settings(POST_GAME_JOBS_IN_PROCESS=False)
+class PostGameJobTests(TransactionTestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.players = [User.objects.create_user(username=f'ender{i}') for i in range(2)]
+        self.coordinator = WriteCoordinator(max_delay=0.005)
+        self.addCleanup(self.coordinator.close)
+
+    def test_concurrent_endings_lose_no_updates(self):
+        # Each thread ends games the way end_game does: save the result and
+        # enqueue its job in one write, then have the writer drain the queue
+        games = [GameSession.objects.create(player=self.players[i % 2]) for i in range(200)]
+        for game in games:
+            game.status, game.score, game.time_survived = ('won' if game.id % 3 == 0 else 'lost'), game.id % 97, 12.5
+
+        def save_result(game):
+            game.save()
+            enqueue(game)
+
+        def end_games(mine):
+            for game in mine:
+                self.coordinator.submit(save_result, game).result(5)
+                schedule_drain()
+
+        threads = [threading.Thread(target=end_games, args=(games[n::8],)) for n in range(8)]
+        started = time.perf_counter()
+        with override_settings(POST_GAME_JOBS_IN_PROCESS=True), patch('game.jobs.write_later', self.coordinator.submit):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.coordinator.submit(process_jobs).result(5)  # Whatever the last drain left
+        throughput = len(games) / (time.perf_counter() - started)
+
+        self.assertFalse(PostGameJob.objects.exists())
+        self.assertLess(self.coordinator.commits, len(games))
+        self.assertGreater(throughput, 50)
+        for player in self.players:
+            finished = GameSession.objects.filter(player=player)
+            scores = list(finished.values_list('score', flat=True))
+            won = finished.filter(status='won').count()
+            entry = Leaderboard.objects.get(player=player)
+            self.assertEqual((entry.total_games, entry.games_won, entry.highest_score), (100, won, max(scores)))
+            self.assertAlmostEqual(entry.total_time_survived, 1250.0)
+            player.refresh_from_db()
+            self.assertEqual((player.games_played, player.games_won, player.total_score), (100, won, sum(scores)))
+            self.assertEqual(LeaderboardRollup.objects.get(period='day', player=player).total_games, 100)
+
+    def test_failing_job_is_retried_alone(self):
+        good = GameSession.objects.create(player=self.players[0], status='lost', score=50, time_survived=10.0)
+        bad = GameSession.objects.create(player=self.players[1], status='lost', score=70, time_survived=10.0)
+        enqueue(good, bad)
+        enqueue(good)  # Enqueuing twice still counts the game once
+
+        def apply_results(results, apply=jobs.apply_results):
+            if any(player_id == self.players[1].id for player_id, *_ in results):
+                raise ValueError('broken')
+            apply(results)
+
+        with patch.object(jobs, 'apply_results', apply_results), self.assertLogs('game.jobs', 'ERROR'):
+            self.assertEqual(process_jobs(), 1)
+        job = PostGameJob.objects.get()
+        self.assertEqual((job.game_id, job.attempts), (bad.id, 1))
+        self.assertIn('broken', job.last_error)
+        self.assertEqual(Leaderboard.objects.get(player=self.players[0]).total_games, 1)
+
+        self.assertEqual(process_jobs(), 1)
+        self.assertEqual(Leaderboard.objects.get(player=self.players[1]).highest_score, 70)
+
+
+class HotQueryIndexTests(TestCase):
+    def test_one_active_shield_per_cell(self):
+        player = get_user_model().objects.create_user(username='cells', password='x')
+        game = GameSession.objects.create(player=player)
+        Shield.objects.create(game_session=game, shield_type='blue', position_x=1, position_y=1, is_active=False)
+        Shield.objects.create(game_session=game, shield_type='red', position_x=1, position_y=1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Shield.objects.create(game_session=game, shield_type='yellow', position_x=1, position_y=1)
+
+    def test_hot_queries_do_not_scan_tables(self):
+        call_command('explain_queries', '--fail-on-scan', stdout=io.StringIO())
+
+
+class SeedDataTests(TestCase):
+    def test_seeded_rows_are_consistent(self):
+        counts = seed_database(rows=400, active=3, chunk_size=25)
+        self.assertEqual(counts['GameSession'], 83)
+        self.assertEqual(GameEvent.objects.count(), counts['GameEvent'])
+
+        live = GameSession.objects.filter(status='active')
+        self.assertEqual(live.count(), 3)
+        self.assertEqual(live.values('player').distinct().count(), 3)
+        self.assertEqual(set(live_games()), set(live))
+        for game in live:
+            active = Shield.objects.filter(game_session=game, is_active=True)
+            self.assertEqual(len(game.board_state), active.count())
+
+        for game in GameSession.objects.exclude(status='active'):
+            self.assertLess(game.game_start_time, game.game_end_time)
+            self.assertTrue(game.events.filter(event_type=f'game_{game.status}', timestamp=game.game_end_time).exists())
+
+        for entry in Leaderboard.objects.select_related('player'):
+            games = GameSession.objects.filter(player=entry.player).exclude(status='active')
+            self.assertEqual(entry.total_games, games.count())
+            self.assertEqual(entry.player.games_played, entry.total_games)
+            self.assertEqual(entry.player.games_won, games.filter(status='won').count())
+            self.assertEqual(entry.highest_score, max(game.score for game in games))
+
+
+class RankingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        # Scores 100, 100, 100, 90, ... with one win breaking each three-way tie
+        cls.entries = [
+            Leaderboard.objects.create(
+                player=User.objects.create_user(username=f'ranked{i}'),
+                highest_score=100 - 10 * (i // 3), games_won=int(i % 3 == 0), total_games=5
+            )
+            for i in range(12)
+        ]
+
+    def setUp(self):
+        ranking.ranking.clear()
+        self.addCleanup(ranking.ranking.clear)
+
+    def expected_rank(self, entry):
+        return 1 + sum(
+            (other.highest_score, other.games_won) > (entry.highest_score, entry.games_won)
+            for other in self.entries
+        )
+
+    def test_rank_index_matches_counting(self):
+        index = ranking.RankIndex()
+        keys = {}
+        rng = random.Random(1)
+        for step in range(2000):
+            player = rng.randrange(200)
+            new = (rng.randrange(300), rng.randrange(40))
+            index.move(keys.get(player), new)
+            keys[player] = new
+            key = (rng.randrange(300), rng.randrange(40))
+            self.assertEqual(index.rank(key), 1 + sum(other > key for other in keys.values()))
+        self.assertEqual(len(index), len(keys))
+
+    def test_rank_index_memory_follows_distinct_scores(self):
+        index = ranking.RankIndex()
+        for key in [(10 ** 9, 3), (10 ** 9, 3), (10 ** 6, 0), (0, 10 ** 6)]:
+            index.add(key)
+        self.assertEqual(len(index.scores.counts), 3)
+        self.assertEqual([index.rank(key) for key in [(10 ** 9, 3), (10 ** 6, 0), (0, 10 ** 6), (5, 0)]], [1, 3, 4, 4])
+
+    def test_pages_walk_the_leaderboard_in_rank_order(self):
+        seen = []
+        cursor = None
+        while True:
+            entries, next_cursor = ranking.page(cursor, limit=5)
+            seen.extend(entries)
+            if next_cursor is None:
+                break
+            cursor = ranking.parse_cursor(next_cursor)
+        self.assertEqual(len(seen), 12)
+        self.assertEqual([entry.rank for entry in seen], sorted(self.expected_rank(entry) for entry in self.entries))
+        for entry in seen:
+            self.assertEqual(entry.rank, self.expected_rank(entry))
+
+    def test_window_function_fallback_agrees(self):
+        with_index = {entry.id: entry.rank for entry in ranking.page(limit=12)[0]}
+        with override_settings(LEADERBOARD_RANK_INDEX=False):
+            self.assertEqual({entry.id: entry.rank for entry in ranking.page(limit=12)[0]}, with_index)
+
+    def test_around_a_player(self):
+        me = Leaderboard.objects.get(id=self.entries[6].id)
+        entries = ranking.around(me, count=2)
+        self.assertEqual(len(entries), 5)
+        self.assertIs(entries[2], me)
+        self.assertEqual(me.rank, self.expected_rank(me))
+        self.assertEqual([entry.rank for entry in entries], sorted(entry.rank for entry in entries))
+
+    def test_saves_move_the_player_once_committed(self):
+        last = Leaderboard.objects.get(id=self.entries[-1].id)
+        self.assertEqual(ranking.player_rank(last.player).rank, self.expected_rank(last))
+        with self.captureOnCommitCallbacks(execute=True):
+            last.highest_score = 500
+            last.save()
+        self.assertEqual(ranking.player_rank(last.player).rank, 1)
+        self.assertEqual(ranking.player_rank(self.entries[0].player).rank, 2)
+
+    def test_leaderboard_api(self):
+        self.client.force_login(self.entries[8].player)
+        first = self.client.get('/api/game/leaderboard/?limit=4').json()
+        self.assertEqual([entry['rank'] for entry in first['entries']], [1, 2, 2, 4])
+        second = self.client.get(f'/api/game/leaderboard/?limit=4&after={first["next"]}').json()
+        self.assertEqual(second['entries'][0]['rank'], 5)
+        around = self.client.get('/api/game/leaderboard/?around=me&limit=4').json()
+        self.assertEqual([entry['player'] for entry in around['entries']][2], 'ranked8')
+        self.assertEqual(self.client.get('/api/game/leaderboard/?after=bad').status_code, 400)
+
+    def test_async_leaderboard_view_matches(self):
+        player = self.entries[8].player
+
+        async def auser():
+            return player
+
+        for query in ('?limit=4', '?around=me&limit=4', '?after=bad'):
+            request = AsyncRequestFactory().get('/api/game/leaderboard/' + query)
+            request.user, request.auser = player, auser
+            response = async_to_sync(async_views.leaderboard)(request)
+            self.client.force_login(player)
+            expected = self.client.get('/api/game/leaderboard/' + query)
+            self.assertEqual((response.status_code, json.loads(response.content)), (expected.status_code, expected.json()))
+
+
+class RollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.players = [User.objects.create_user(username=f'rolled{i}') for i in range(3)]
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.now = timezone.now()
+
+    def finish(self, player, score, won, ended_at):
+        game = GameSession.objects.create(player=player, status='won' if won else 'lost', score=score, time_survived=30.0)
+        GameSession.objects.filter(id=game.id).update(game_start_time=ended_at - timedelta(seconds=30), game_end_time=ended_at)
+        record_results([(player.id, score, won, 30.0, ended_at)])
+
+    def test_results_roll_up_by_day_and_week(self):
+        alice, bob, carol = self.players
+        last_week = self.now - timedelta(days=7)
+        self.finish(alice, 100, False, self.now)
+        self.finish(alice, 300, True, self.now)
+        self.finish(bob, 300, False, self.now)
+        self.finish(carol, 900, True, last_week)
+
+        day = LeaderboardRollup.objects.get(period='day', period_start=period_start('day'), player=alice)
+        self.assertEqual((day.total_games, day.games_won, day.highest_score), (2, 1, 300))
+        self.assertEqual(LeaderboardRollup.objects.filter(period='week', player=carol).get().period_start,
+                         period_start('week', last_week))
+
+        page = window_page('day')
+        self.assertEqual([(entry['player']['username'], entry['rank']) for entry in page['entries']],
+                         [('rolled0', 1), ('rolled1', 2)])
+        self.assertEqual([entry['player_id'] for entry in window_page('week', moment=last_week)['entries']], [carol.id])
+
+    def test_pages_are_cached(self):
+        self.finish(self.players[0], 100, False, self.now)
+        self.assertEqual(len(window_page('week')['entries']), 1)
+        self.finish(self.players[1], 200, False, self.now)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(window_page('week')['entries']), 1)
+        cache.clear()
+        self.assertEqual(len(window_page('week')['entries']), 2)
+
+    def test_keyset_pages_rank_ties_together(self):
+        for player, score in zip(self.players, (500, 500, 400)):
+            self.finish(player, score, False, self.now)
+        first = window_page('day', limit=2)
+        second = window_page('day', cursor=first['next'], limit=2)
+        self.assertEqual([entry['rank'] for entry in first['entries'] + second['entries']], [1, 1, 3])
+        self.assertIsNone(second['next'])
+
+    def test_rebuild_matches_incremental_rollups(self):
+        alice, bob, carol = self.players
+        self.finish(alice, 100, False, self.now)
+        self.finish(alice, 250, True, self.now)
+        self.finish(bob, 50, False, self.now)
+        fields = ('player_id', 'highest_score', 'total_games', 'games_won', 'total_time_survived', 'last_played')
+        start = period_start('week')
+        incremental = list(LeaderboardRollup.objects.filter(period='week', period_start=start).order_by('player_id').values(*fields))
+
+        LeaderboardRollup.objects.all().delete()
+        self.assertEqual(rebuild_window('week', start, chunk_size=1), 2)
+        rebuilt = list(LeaderboardRollup.objects.filter(period='week', period_start=start).order_by('player_id').values(*fields))
+        self.assertEqual(rebuilt, incremental)
+
+
+class LeaderboardCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.players = [User.objects.create_user(username=f'cached{i}') for i in range(30)]
+        Leaderboard.objects.bulk_create([
+            Leaderboard(player=player, highest_score=1000 - 10 * i, total_games=3) for i, player in enumerate(cls.players)
+        ])
+        cls.viewer = cls.players[20]
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        ranking.ranking.clear()
+        self.addCleanup(ranking.ranking.clear)
+        self.client.force_login(self.viewer)
+
+    def page_queries(self, url='/game/leaderboard/'):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in queries]
+
+    def test_cached_page_costs_constant_queries(self):
+        for url in ('/game/leaderboard/?period=week', '/game/leaderboard/'):
+            self.page_queries(url)
+            response, queries = self.page_queries(url)
+            # Only the session and the user are read once the page is cached
+            self.assertFalse([sql for sql in queries if '"game_' in sql])
+        self.assertContains(response, 'cached0')
+        self.assertContains(response, 'cached19')  # Around the viewer
+
+        # More players change nothing once the page is cached
+        User = get_user_model()
+        Leaderboard.objects.bulk_create([
+            Leaderboard(player=User.objects.create_user(username=f'more{i}'), highest_score=i) for i in range(50)
+        ])
+        self.assertEqual(len(self.page_queries()[1]), len(queries))
+
+    def test_top_is_rendered_again_only_when_it_changes(self):
+        self.page_queries()
+        version = leaderboard_cache.version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.apply_results([(self.viewer.id, 5, True, 20.0, timezone.now())])
+        self.assertEqual(leaderboard_cache.version(), version)
+        response, _ = self.page_queries()
+        self.assertEqual(response.context['user_stats'].total_games, 4)  # Own stats are not cached past a change
+
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.apply_results([(self.viewer.id, 5000, True, 20.0, timezone.now())])
+        self.assertNotEqual(leaderboard_cache.version(), version)
+        response, _ = self.page_queries()
+        self.assertEqual(response.context['user_stats'].rank, 1)
+        self.assertContains(response, f'<tr data-player="{self.viewer.id}">\n    <td>1</td>', html=False)
+
+
+class StartupProfileTests(SimpleTestCase):
+    def test_cold_start_within_budget(self):
+        out = io.StringIO()
+        # Raises CommandError over STARTUP_BUDGET_MS, or when a deferred module is imported before the first response
+        call_command('startup_profile', '--top', '0', stdout=out)
+        self.assertIn('wsgi: first response 200', out.getvalue())
+        self.assertIn('asgi: first response 200', out.getvalue())
+
+    def test_import_times_per_package(self):
+        from .management.commands.startup_profile import import_times
+        packages = import_times(textwrap.dedent('''\
+            import time: self [us] | cumulative | imported package
+            import time:       100 |        100 |     django.utils
+            import time:       400 |        500 |   django
+            import time:      2000 |       2000 | yaml
+        '''))
+        self.assertEqual(packages, {'django': 0.0005, 'yaml': 0.002})
+
+
+class WarmupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.players = [User.objects.create_user(username=f'warm{i}') for i in range(15)]
+        Leaderboard.objects.bulk_create([
+            Leaderboard(player=player, highest_score=1000 - 10 * i, total_games=1) for i, player in enumerate(cls.players)
+        ])
+        cls.viewer = cls.players[12]
+        board = Board()
+        for y in range(0, 12):
+            board.add('blue', 5, y)
+        cls.game = GameSession.objects.create(player=cls.viewer, ultron_position_x=2, ultron_position_y=3, board=board.encode())
+
+    def setUp(self):
+        self.client.force_login(self.viewer)
+        cache.clear()
+        self.addCleanup(cache.clear)
+        ranking.ranking.clear()
+        self.addCleanup(ranking.ranking.clear)
+        shortest_path.cache_clear()
+
+    def test_first_requests_are_served_warm(self):
+        results = warmup.warm_up()
+        self.assertNotIn(None, [count for count, _ in results.values()])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/game/leaderboard/')
+        # Only the database session is loaded and refreshed
+        self.assertEqual([q['sql'] for q in queries if 'django_session' not in q['sql'] and 'SAVEPOINT' not in q['sql']], [])
+        self.assertContains(response, 'warm12')
+
+        hits = shortest_path.cache_info().hits
+        ai = UltronAI()
+        ai.set_position(self.game.ultron_position_x, self.game.ultron_position_y)
+        ai.set_target(self.game.ultron_target_x, self.game.ultron_target_y)
+        path = ai.find_path(self.game.board_state.obstacles())
+        self.assertEqual(shortest_path.cache_info().hits, hits + 1)
+        self.assertEqual(path[-1], (13, 13))
+        self.assertNotIn((5, 3), path)
+        ai.get_next_move(self.game.board_state.shields())
+        self.assertEqual(ai.find_path([]), list(shortest_path(15, path[0], (13, 13), frozenset())))  # Tables are not consumed
+
+    def test_readiness_flips_when_warm_up_finishes(self):
+        self.assertEqual(self.client.get('/ready/').status_code, 200)  # Nothing to wait for
+        with patch.object(warmup, '_thread', threading.Thread()), patch.object(warmup, '_done', threading.Event()) as done:
+            self.assertEqual(self.client.get('/ready/').status_code, 503)
+            done.set()
+            self.assertEqual(self.client.get('/ready/').status_code, 200)
+
+    @override_settings(WARMUP_ON_START=False)
+    def test_lifespan_startup_waits_for_warm_up(self):
+        from shield_defense.asgi import application
+        waited, sent = [], []
+        messages = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append((message['type'], list(waited)))
+
+        with patch.object(warmup, 'wait', lambda: waited.append(True)):
+            asyncio.run(application({'type': 'lifespan', 'asgi': {'version': '3.0'}}, receive, send))
+        self.assertEqual(sent, [('lifespan.startup.complete', [True]), ('lifespan.shutdown.complete', [True])])
+
+
+class AdminChangelistTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.admin = User.objects.create_superuser(username='root', password='x')
+        cls.games = [GameSession.objects.create(player=User.objects.create_user(username=f'admin{i}')) for i in range(4)]
+        start = timezone.now().replace(month=1, day=1) - timedelta(days=400)
+        GameEvent.objects.bulk_create([
+            GameEvent(game_session=cls.games[i % 4], event_type='ultron_moved', data='{}', timestamp=start + timedelta(days=11 * i, hours=i))
+            for i in range(60)
+        ])
+
+    def setUp(self):
+        isolate_event_sink(self)
+        self.client.force_login(self.admin)
+
+    def test_indexed_dates_match_distinct_dates(self):
+        indexed = IndexedDateQuerySet(GameEvent)
+        year = GameEvent.objects.order_by('timestamp').first().timestamp.year
+        for zone in ('UTC', 'America/New_York'):
+            with timezone.override(zone):
+                for kind, filters in [('year', {}), ('month', {'timestamp__year': year}), ('day', {'timestamp__year': year})]:
+                    for order in ('ASC', 'DESC'):
+                        self.assertEqual(
+                            indexed.filter(**filters).datetimes('timestamp', kind, order),
+                            list(GameEvent.objects.filter(**filters).datetimes('timestamp', kind, order)),
+                        )
+        self.assertEqual(indexed.dates('timestamp', 'month'), list(GameEvent.objects.dates('timestamp', 'month')))
+
+    @override_settings(ADMIN_COUNT_LIMIT=10)
+    def test_counts_stop_at_the_limit(self):
+        GameEvent.objects.filter(id=GameEvent.objects.order_by('id')[5].id).delete()
+        self.assertEqual(EstimatedCountPaginator(GameEvent.objects.filter(event_type='game_won').order_by('id'), 5).count, 0)
+        first = list(GameEvent.objects.order_by('id').values_list('id', flat=True)[:8])
+        self.assertEqual(EstimatedCountPaginator(GameEvent.objects.filter(id__in=first).order_by('id'), 5).count, 8)  # Exact below the limit
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(EstimatedCountPaginator(GameEvent.objects.order_by('id'), 5).count, 60)  # Primary key range
+            self.assertEqual(EstimatedCountPaginator(GameEvent.objects.filter(game_session=self.games[0]).order_by('id'), 5).count, 10)
+        self.assertTrue(all('LIMIT 11' in query['sql'] for query in queries if 'COUNT(*)' in query['sql']))
+
+    def test_changelists_cost_constant_queries(self):
+        urls = ['/admin/game/gamesession/', '/admin/game/shield/', '/admin/game/gameevent/',
+                '/admin/game/gameevent/?timestamp__year=%d' % GameEvent.objects.first().timestamp.year]
+        for game in self.games:
+            Shield.objects.create(game_session=game, shield_type='blue', position_x=1, position_y=1)
+
+        def page_queries():
+            counts = []
+            for url in urls:
+                with CaptureQueriesContext(connection) as queries:
+                    self.assertEqual(self.client.get(url).status_code, 200)
+                counts.append(len(queries))
+            return counts
+
+        page_queries()  # Caches the admin user
+        before = page_queries()
+        for i in range(6):
+            game = GameSession.objects.create(player=get_user_model().objects.create_user(username=f'more{i}'))
+            Shield.objects.create(game_session=game, shield_type='red', position_x=2, position_y=2)
+            GameEvent.objects.create(game_session=game, event_type='ultron_moved', data='{}')
+        self.assertEqual(page_queries(), before)
+
+    def test_end_stale_games_action(self):
+        stale, fresh, finished = self.games[:3]
+        GameSession.objects.filter(id__in=[stale.id, finished.id]).update(last_activity=timezone.now() - timedelta(hours=1))
+        GameSession.objects.filter(id=finished.id).update(status='won')
+        response = self.client.post('/admin/game/gamesession/', {
+            'action': 'end_stale_games', '_selected_action': [stale.id, fresh.id, finished.id],
+        }, follow=True)
+        self.assertContains(response, 'Ended 1 stale games.')
+        self.assertEqual(
+            dict(GameSession.objects.filter(id__in=[stale.id, fresh.id, finished.id]).values_list('id', 'status')),
+            {stale.id: 'lost', fresh.id: 'active', finished.id: 'won'},
+        )
+
+    def test_purge_old_events_action(self):
+        recent = GameEvent.objects.create(game_session=self.games[0], event_type='game_lost', data='{}')
+        selected = list(GameEvent.objects.order_by('id').values_list('id', flat=True)[:3]) + [recent.id]
+        with tempfile.TemporaryDirectory() as path, override_settings(GAME_EVENT_ARCHIVE_DIR=path):
+            response = self.client.post('/admin/game/gameevent/', {
+                'action': 'purge_old_events', '_selected_action': selected,
+            }, follow=True)
+            self.assertEqual(len(list(iter_archived_events())), 3)
+        self.assertContains(response, 'Archived 3 events')
+        self.assertEqual(GameEvent.objects.count(), 58)
+        self.assertTrue(GameEvent.objects.filter(id=recent.id).exists())
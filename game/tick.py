@@ -0,0 +1,593 @@
+"""
+Server-authoritative tick loop for WebSocket games.
+
+Each process runs at most one GameTicker per game, no matter how many sockets
+are connected to it. The ticker keeps the game state in memory, moves Ultron
+once per tick, writes any changes back in a single batched transaction and
+broadcasts the resulting frame once to the ``game_<id>`` group.
+
+Frames are encoded once per tick regardless of how many sockets (players or
+spectators) are subscribed. Sockets joining late get the cached snapshot and
+then follow the ``game_delta`` frames, which carry absolute values for the
+fields that changed.
+
+Every broadcast frame carries a sequence number and is kept in a bounded
+per-game replay buffer, so a reconnecting socket that reports its last seen
+sequence only receives the frames it missed. A ticker outlives its last
+socket by RELEASE_GRACE seconds, so a client that drops and reconnects
+within that window still resumes from the buffer instead of a snapshot.
+
+Player input is queued and applied at the start of the next tick, so a burst
+of placements becomes one validated batch, one write and one delta frame.
+
+Every tick is also appended to the game's binary replay files (see replay.py).
+
+Only a player's socket runs the loop. While a game has spectators but no
+player socket in this process, e.g. because the player plays over the HTTP
+API, the ticker reloads the game row every SPECTATOR_POLL_INTERVAL seconds
+and broadcasts what changed.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.db import IntegrityError
+from django.utils import timezone
+from .models import GameSession, Shield
+from .game_logic import UltronAI
+from .board import Board
+from .replay import ReplayRecorder
+from .writer import awrite
+
+TICK_INTERVAL = 0.8  # Seconds per tile
+REPLAY_BUFFER_SIZE = 256  # Frames kept for resuming sockets
+MAX_PENDING_INPUTS = 64  # Queued player actions per game between ticks
+RELEASE_GRACE = 30  # Seconds a ticker without sockets keeps its replay buffer
+SPECTATOR_POLL_INTERVAL = 1.0  # Seconds between reloads while only spectators are connected
+
+SHIELD_TYPES = [shield_type for shield_type, label in Shield.SHIELD_TYPES]
+
+GAME_FIELDS = [
+    'player_id', 'status', 'score', 'hostage_timer',
+    'ultron_position_x', 'ultron_position_y',
+    'ultron_target_x', 'ultron_target_y',
+]
+
+logger = logging.getLogger(__name__)
+
+# game_id -> GameTicker, for this process only
+_tickers = {}
+
+
+def group_name(game_id):
+    return f'game_{game_id}'
+
+
+class GameTicker:
+    """Runs the Ultron loop for one game and fans its frames out to the group"""
+
+    def __init__(self, game_id, channel_layer=None):
+        self.game_id = game_id
+        self.group_name = group_name(game_id)
+        self.channel_layer = channel_layer or get_channel_layer()
+        self.ultron_ai = UltronAI()
+        self.refs = 0
+        self.players = 0
+        self.task = None
+        self.watcher = None
+        self.expiry = None
+        self.lock = asyncio.Lock()
+        self.loaded = False
+        self.exists = False
+        self.state = {}
+        self.shields = {}  # (x, y) -> shield dict as sent to clients
+        self.dirty = set()
+        self.inputs = []
+        self.new_shields = []
+        self.clear_shields = False
+        self.changed = set()
+        self.shields_added = []
+        self._snapshot_text = None
+        # Start from the wall clock so sequence numbers keep increasing
+        # when a ticker is dropped and loaded again
+        self.seq = int(time.time() * 1000)
+        self.replay = deque(maxlen=REPLAY_BUFFER_SIZE)
+        self.recorder = None
+
+    # State
+
+    async def load(self):
+        """Load the game and its board with one primary key read"""
+        data = await self._load()
+        self.loaded = True
+        self.exists = data is not None
+        if data is None:
+            return
+        self.state, shields = data
+        self.shields = {tuple(s['position']): s for s in shields}
+        if self.recorder is not None:
+            self.recorder.close()
+        self.recorder = ReplayRecorder(self.game_id, shields)
+        self.ultron_ai.set_position(self.state['ultron_position_x'], self.state['ultron_position_y'])
+        self.ultron_ai.set_target(self.state['ultron_target_x'], self.state['ultron_target_y'])
+
+    async def reload(self):
+        """
+        Load a ticker again after it sat without sockets. If the game changed
+        in the meantime its buffered frames no longer lead to the current
+        state, so they are dropped and resuming falls back to a snapshot.
+        """
+        state = {name: self.state.get(name) for name in GAME_FIELDS}
+        shields = self.shields
+        await self.load()
+        if {name: self.state.get(name) for name in GAME_FIELDS} != state or self.shields != shields:
+            self.replay.clear()
+            self.seq += 1
+            self._snapshot_text = None
+
+    async def refresh(self):
+        """Pick up changes written outside this ticker and broadcast them"""
+        data = await self._load()
+        if data is None:
+            return
+        state, shields = data
+        shields = {tuple(s['position']): s for s in shields}
+        changed = {name for name in GAME_FIELDS if self.state.get(name) != state[name]}
+        if not changed and shields == self.shields:
+            return
+        self.state.update(state)
+        self.ultron_ai.set_position(state['ultron_position_x'], state['ultron_position_y'])
+        self.ultron_ai.set_target(state['ultron_target_x'], state['ultron_target_y'])
+        if self.recorder is not None:
+            self.recorder.open(list(shields.values()))  # Continue after ticks recorded elsewhere
+        if any(position not in shields for position in self.shields):
+            self.shields = shields
+            await self.broadcast_snapshot()
+            return
+        self.changed |= changed
+        self._snapshot_text = None
+        for position, shield in shields.items():
+            if position not in self.shields:
+                self.add_shield(shield)
+        await self.broadcast_delta()
+
+    def set(self, **fields):
+        for name, value in fields.items():
+            if self.state.get(name) != value:
+                self.state[name] = value
+                self.dirty.add(name)
+                self.changed.add(name)
+                self._snapshot_text = None
+
+    def touch(self):
+        """Mark the player as active; written with the next flush, not broadcast"""
+        self.state['last_activity'] = timezone.now()
+        self.dirty.add('last_activity')
+
+    def add_shield(self, shield):
+        self.shields[tuple(shield['position'])] = shield
+        self.shields_added.append(shield)
+        self._snapshot_text = None
+
+    def game_state(self):
+        return {
+            'type': 'game_state',
+            'ultron_position': [self.state['ultron_position_x'], self.state['ultron_position_y']],
+            'target_position': [self.state['ultron_target_x'], self.state['ultron_target_y']],
+            'hostage_timer': self.state['hostage_timer'],
+            'score': self.state['score'],
+            'status': self.state['status'],
+            'shields': list(self.shields.values())
+        }
+
+    def snapshot_text(self):
+        """Encoded game_state frame, rebuilt only after the state changes"""
+        if self._snapshot_text is None:
+            payload = self.game_state()
+            payload['seq'] = self.seq
+            self._snapshot_text = json.dumps(payload)
+        return self._snapshot_text
+
+    def frames_since(self, last_seq):
+        """
+        Return the encoded frames after last_seq, or None if they are no
+        longer buffered and the client needs a full snapshot
+        """
+        if last_seq > self.seq:
+            return None
+        if last_seq == self.seq:
+            return []
+        if not self.replay or self.replay[0][0] > last_seq + 1:
+            return None
+        return [text for seq, text in self.replay if seq > last_seq]
+
+    def delta(self):
+        """Collect the changes since the last broadcast into a game_delta frame"""
+        changed = self.changed
+        payload = {'type': 'game_delta'}
+        if 'ultron_position_x' in changed or 'ultron_position_y' in changed:
+            payload['ultron_position'] = [self.state['ultron_position_x'], self.state['ultron_position_y']]
+        if 'ultron_target_x' in changed or 'ultron_target_y' in changed:
+            payload['target_position'] = [self.state['ultron_target_x'], self.state['ultron_target_y']]
+        for name in ('hostage_timer', 'score', 'status'):
+            if name in changed:
+                payload[name] = self.state[name]
+        if self.shields_added:
+            payload['shields_added'] = self.shields_added
+        self.changed = set()
+        self.shields_added = []
+        return payload
+
+    async def broadcast(self, payload):
+        """Encode a frame once and send it to every socket on this game"""
+        self.seq += 1
+        payload['seq'] = self.seq
+        await self.send_frame(json.dumps(payload))
+
+    async def send_frame(self, text):
+        self.replay.append((self.seq, text))
+        self._snapshot_text = None
+        await self.channel_layer.group_send(self.group_name, {
+            'type': 'game.message',
+            'text': text
+        })
+
+    async def broadcast_delta(self):
+        if self.changed or self.shields_added:
+            await self.broadcast(self.delta())
+
+    async def broadcast_snapshot(self):
+        self.changed = set()
+        self.shields_added = []
+        self.seq += 1
+        self._snapshot_text = None
+        await self.send_frame(self.snapshot_text())
+
+    # Loop control
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                logger.exception('Game loop of game %s failed', self.game_id)
+        self.task = None
+
+    def watch(self):
+        """Follow the game row while only spectators are connected"""
+        if self.watcher is None or self.watcher.done():
+            self.watcher = asyncio.create_task(self.follow())
+
+    def stop_watching(self):
+        if self.watcher is not None:
+            self.watcher.cancel()
+            self.watcher = None
+
+    async def follow(self):
+        while self.refs and not self.players:
+            await asyncio.sleep(SPECTATOR_POLL_INTERVAL)
+            try:
+                async with self.lock:
+                    if not self.players:
+                        await self.refresh()
+            except Exception:
+                logger.exception('Refresh of game %s failed', self.game_id)
+
+    async def run(self):
+        """Main game loop for Ultron movement"""
+        while self.state.get('status') == 'active':
+            try:
+                await self.tick()
+            except Exception:
+                # One failed tick must not end the game for every socket
+                logger.exception('Tick of game %s failed', self.game_id)
+            await asyncio.sleep(TICK_INTERVAL)
+
+    async def tick(self, advance=True):
+        """
+        Apply queued player input and advance the game by one step.
+        All resulting writes go out in one transaction and one delta frame.
+        """
+        async with self.lock:
+            rejected = self.apply_inputs()
+            events = []
+            ended = None
+            if advance and self.state.get('status') == 'active':
+                events, ended = self.advance()
+            if advance or self.shields_added:
+                self.record()
+            if self.players:
+                self.touch()
+
+            await self.flush()
+            for channel_name, count in rejected.items():
+                await self.send_error(channel_name, 'Cannot place shield at this position', rejected=count)
+            for payload in events:
+                await self.broadcast(payload)
+            await self.broadcast_delta()
+            if ended is not None and self.state['status'] != 'active':
+                await self.broadcast(self.game_ended(won=ended))
+
+    def advance(self):
+        """
+        Move Ultron one step in memory.
+        Returns the effect frames to broadcast and whether the game was won,
+        lost or is still running (True, False or None).
+        """
+        # Check if Ultron can move (not paused)
+        if not self.ultron_ai.update_pause_status(TICK_INTERVAL):
+            return [], None
+
+        next_move = self.ultron_ai.get_next_move(list(self.shields.values()))
+        if not next_move:
+            # No path available - player wins
+            self.set(status='won')
+            return [], True
+
+        self.set(ultron_position_x=next_move[0], ultron_position_y=next_move[1])
+
+        # Check for shield effects
+        events = []
+        shield = self.shields.get(tuple(next_move))
+        if shield:
+            effect = self.ultron_ai.handle_shield_effect(shield['type'])
+            if effect['type'] == 'yellow':
+                self.set(hostage_timer=self.state['hostage_timer'] + 2.0)
+            events.append({
+                'type': 'shield_effect',
+                'shield_type': shield['type'],
+                'position': shield['position'],
+                'effect': effect
+            })
+
+        # Check win/lose conditions
+        if next_move == self.ultron_ai.target_position:
+            self.set(status='lost')
+            return events, False
+
+        return events, None
+
+    def record(self):
+        """Append the current state and this tick's new shields to the replay"""
+        if self.recorder is not None:
+            self.recorder.record(self.state, self.shields_added)
+
+    def game_ended(self, won):
+        if won:
+            final_score = int(self.state['hostage_timer'] * 10)
+        else:
+            final_score = int((40.0 - self.state['hostage_timer']) * 5)
+        return {
+            'type': 'game_ended',
+            'won': won,
+            'final_score': final_score,
+            'message': 'Victory! Hostages saved!' if won else 'Defeat! Ultron escaped!'
+        }
+
+    # Player actions
+
+    async def place_shield(self, shield_type, position_x, position_y, channel_name):
+        """
+        Queue a shield placement for the next tick. Rejections are sent back
+        to channel_name once the batch has been validated.
+        """
+        if len(self.inputs) >= MAX_PENDING_INPUTS:
+            await self.send_error(channel_name, 'Too many pending actions')
+            return
+        self.inputs.append((shield_type, position_x, position_y, channel_name))
+
+        # Without a running loop there is no tick to pick the input up
+        if self.task is None or self.task.done():
+            await self.tick(advance=False)
+
+    def apply_inputs(self):
+        """
+        Validate queued placements against the in-memory board, in order.
+        Accepted shields are added to the board and written by the next flush.
+        Returns the number of rejected placements per channel name.
+        """
+        inputs, self.inputs = self.inputs, []
+        rejected = {}
+        for shield_type, position_x, position_y, channel_name in inputs:
+            if self.validate_placement(shield_type, position_x, position_y):
+                shield = {
+                    'type': shield_type,
+                    'position': [position_x, position_y]
+                }
+                self.add_shield(shield)
+                self.new_shields.append(shield)
+            else:
+                rejected[channel_name] = rejected.get(channel_name, 0) + 1
+        return rejected
+
+    def validate_placement(self, shield_type, position_x, position_y):
+        if not self.exists:
+            return False
+        if shield_type not in SHIELD_TYPES:
+            return False
+        if not (isinstance(position_x, int) and isinstance(position_y, int)):
+            return False
+        if not (0 <= position_x <= 14 and 0 <= position_y <= 14):
+            return False
+        if (position_x, position_y) in self.shields:
+            return False
+        if (position_x == self.state['ultron_position_x'] and
+                position_y == self.state['ultron_position_y']):
+            return False
+        return True
+
+    async def send_error(self, channel_name, message, **extra):
+        """Send an error to a single socket; it carries the current sequence without advancing it"""
+        payload = {'type': 'error', 'message': message, 'seq': self.seq}
+        payload.update(extra)
+        await self.channel_layer.send(channel_name, {
+            'type': 'game.message',
+            'text': json.dumps(payload)
+        })
+
+    async def reset(self):
+        """Restart the game from the initial position with an empty board"""
+        await self.stop()
+        async with self.lock:
+            self.set(status='active', hostage_timer=40.0, score=0,
+                     ultron_position_x=0, ultron_position_y=7)
+            self.shields = {}
+            self.inputs = []
+            self.new_shields = []
+            self._snapshot_text = None
+            self.ultron_ai.set_position(0, 7)
+            self.ultron_ai.current_path = []
+            self.ultron_ai.is_paused = False
+            self.ultron_ai.pause_time_left = 0
+            if self.recorder is not None:
+                self.recorder.restart()
+            self.record()
+            await self.flush(clear_shields=True)
+            await self.broadcast_snapshot()
+        self.start()
+
+    async def pause(self):
+        await self.stop()
+        async with self.lock:
+            self.set(status='paused')
+            self.record()
+            await self.flush()
+            await self.broadcast_delta()
+
+    async def resume(self):
+        async with self.lock:
+            self.set(status='active')
+            self.record()
+            await self.flush()
+            await self.broadcast_delta()
+        self.start()
+
+    # Database operations
+
+    async def flush(self, clear_shields=False):
+        """
+        Write all pending changes in one transaction. A failed write is kept
+        pending for the next flush, except a conflict with the shields in the
+        database, after which the game is reloaded and sent out as a snapshot.
+        """
+        clear_shields = clear_shields or self.clear_shields
+        if not self.dirty and not self.new_shields and not clear_shields:
+            return
+        dirty, new_shields = self.dirty, self.new_shields
+        fields = {name: self.state[name] for name in dirty}
+        if new_shields or clear_shields:
+            fields['board'] = Board.from_shields(list(self.shields.values())).encode()
+        self.dirty, self.new_shields, self.clear_shields = set(), [], False
+        try:
+            await awrite(self._write, fields, new_shields, clear_shields)
+        except IntegrityError:
+            # A cell was taken outside this ticker, e.g. through the HTTP API
+            logger.warning('Write of game %s conflicted, reloading it', self.game_id, exc_info=True)
+            await self.load()
+            await self.broadcast_snapshot()
+        except BaseException as e:
+            self.dirty |= dirty
+            self.new_shields[:0] = new_shields
+            self.clear_shields = self.clear_shields or clear_shields
+            if not isinstance(e, Exception):
+                raise
+            logger.warning('Write of game %s failed, retrying with the next flush', self.game_id, exc_info=True)
+
+    @database_sync_to_async
+    def _load(self):
+        game = GameSession.objects.filter(id=self.game_id).values(*GAME_FIELDS, 'board').first()
+        if game is None:
+            return None
+        return game, Board.decode(game.pop('board')).shields()
+
+    def _write(self, fields, new_shields, clear_shields):
+        """Runs on the writer thread, inside its group transaction"""
+        if clear_shields:
+            Shield.objects.filter(game_session_id=self.game_id).delete()
+        if fields:
+            GameSession.objects.filter(id=self.game_id).update(**fields)
+        Shield.objects.bulk_create([
+            Shield(
+                game_session_id=self.game_id,
+                shield_type=shield['type'],
+                position_x=shield['position'][0],
+                position_y=shield['position'][1]
+            )
+            for shield in new_shields
+        ])
+
+
+async def acquire(game_id, channel_layer=None):
+    """Return the shared ticker for a game, loading it on first use"""
+    ticker = _tickers.get(game_id)
+    if ticker is None:
+        ticker = _tickers[game_id] = GameTicker(game_id, channel_layer)
+    ticker.refs += 1
+    idle, ticker.expiry = ticker.expiry, None
+    if idle is not None:
+        idle.cancel()
+    async with ticker.lock:
+        if not ticker.loaded:
+            await ticker.load()
+        elif idle is not None:
+            await ticker.reload()
+    if ticker.exists and not ticker.players:
+        ticker.watch()
+    return ticker
+
+
+def join_player(ticker):
+    """Mark a reference as the controlling player and run the loop if needed"""
+    ticker.players += 1
+    if ticker.state.get('status') == 'active':
+        ticker.start()
+
+
+async def release(ticker, player=False):
+    """
+    Drop a reference to a ticker, stopping it once no player is connected.
+    Without references its changes are written out at once, and it is
+    dropped after RELEASE_GRACE unless a socket acquires it again.
+    """
+    ticker.refs -= 1
+    if player:
+        ticker.players -= 1
+        if ticker.players == 0:
+            await ticker.stop()
+    if ticker.refs > 0:
+        if ticker.exists and ticker.players == 0:
+            ticker.watch()
+        return
+    ticker.stop_watching()
+    await ticker.stop()
+    async with ticker.lock:
+        await ticker.flush()
+    if ticker.refs == 0 and ticker.expiry is None:
+        ticker.expiry = asyncio.create_task(_expire(ticker))
+
+
+async def _expire(ticker):
+    await asyncio.sleep(RELEASE_GRACE)
+    async with ticker.lock:
+        await ticker.flush()  # Anything a failed write left pending
+    drop(ticker)
+
+
+def drop(ticker):
+    """Forget a ticker without sockets and close its replay files"""
+    if _tickers.get(ticker.game_id) is ticker:
+        del _tickers[ticker.game_id]
+    ticker.expiry = None
+    ticker.stop_watching()
+    if ticker.recorder is not None:
+        ticker.recorder.close()
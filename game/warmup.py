@@ -0,0 +1,187 @@
+"""
+Warm-up of a freshly started worker.
+
+After a deploy the first requests pay for compiling templates, opening the
+database and running the first queries, and they find the leaderboard cache,
+the user cache and the path table empty. warm_up() does that work up front:
+
+- templates: compiles the project's templates into the cached template loader
+- caches: renders the leaderboard tops and caches the user row and
+  leaderboard entry of players active in the last WARMUP_ACTIVE_WINDOW
+  seconds (the most recent WARMUP_PLAYERS of them)
+- paths: fills the path table (game_logic.shortest_path) for the empty board
+  from every cell to the usual targets, and for the board of every active
+  game from Ultron's position
+
+start() runs it once per process in a background thread. wsgi.py and asgi.py
+call it when WARMUP_ON_START is set, and the ASGI lifespan startup waits for
+it, so servers speaking lifespan only take connections once it is done.
+ready() turns true once it has finished, whether or not every step succeeded
+(failures are logged), and /ready/ answers 503 until then so a load balancer
+only routes to warm workers.
+
+python manage.py warmup runs it in the foreground. The template and path
+tables belong to the process that built them, so from a separate process it
+only warms shared cache backends, the database and the OS page cache.
+"""
+import logging
+import os
+import threading
+import time
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+EMPTY_BOARD_TARGETS = [(13, 13), (14, 7)]  # GameSession and UltronAI defaults
+
+_lock = threading.Lock()
+_done = threading.Event()
+_thread = None
+
+
+def preload_templates():
+    """Compile the project's templates into the cached loader, returns how many"""
+    from django.template import TemplateSyntaxError, engines
+
+    count = 0
+    for engine in engines.all():
+        for directory in engine.template_dirs:
+            directory = os.path.abspath(directory)
+            if not directory.startswith(str(settings.BASE_DIR)) or not os.path.isdir(directory):
+                continue  # Django's and third-party templates load on demand
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    if not name.endswith(('.html', '.txt')):
+                        continue
+                    template = os.path.relpath(os.path.join(root, name), directory).replace(os.sep, '/')
+                    try:
+                        engine.get_template(template)
+                        count += 1
+                    except TemplateSyntaxError:
+                        logger.warning('Could not compile template %s', template, exc_info=True)
+    return count
+
+
+def prime_caches(window=None, limit=None):
+    """Cache the leaderboard tops and the user and leaderboard rows of recently active players"""
+    from datetime import timedelta
+    from django.contrib.auth import get_user_model, load_backend
+    from django.db.models import Max
+    from django.utils import timezone
+    from . import leaderboard_cache
+    from .models import GameSession
+    from .rollups import PERIODS
+
+    window = window if window is not None else getattr(settings, 'WARMUP_ACTIVE_WINDOW', 3600)
+    limit = limit if limit is not None else getattr(settings, 'WARMUP_PLAYERS', 500)
+    for period in (None, *PERIODS):
+        leaderboard_cache.top(period)
+
+    # One range per status on the (status, last_activity) index
+    recent = (GameSession.objects
+              .filter(status__in=[status for status, _ in GameSession.GAME_STATUS_CHOICES],
+                      last_activity__gte=timezone.now() - timedelta(seconds=window))
+              .values('player_id').annotate(last=Max('last_activity')).order_by('-last')[:limit])
+    player_ids = [row['player_id'] for row in recent]
+    backend = load_backend(settings.AUTHENTICATION_BACKENDS[0])
+    for player_id in player_ids:
+        backend.get_user(player_id)
+    for player in get_user_model().objects.filter(id__in=player_ids).only('id'):
+        leaderboard_cache.player_stats(player)
+    return len(player_ids)
+
+
+def precompute_paths():
+    """Fill the path table for the empty board and the boards of active games, returns how many paths"""
+    from .board import GRID_SIZE
+    from .game_logic import shortest_path
+    from .models import GameSession
+
+    paths = set()
+    empty = frozenset()
+    for target in EMPTY_BOARD_TARGETS:
+        for x in range(GRID_SIZE):
+            for y in range(GRID_SIZE):
+                paths.add((GRID_SIZE, (x, y), target, empty))
+    games = GameSession.objects.filter(status='active').only(
+        'board', 'ultron_position_x', 'ultron_position_y', 'ultron_target_x', 'ultron_target_y')
+    for game in games.iterator():
+        paths.add((GRID_SIZE, (game.ultron_position_x, game.ultron_position_y),
+                   (game.ultron_target_x, game.ultron_target_y), frozenset(game.board_state.obstacles())))
+    for path in paths:
+        shortest_path(*path)
+    return len(paths)
+
+
+STEPS = [
+    ('templates', preload_templates),
+    ('caches', prime_caches),
+    ('paths', precompute_paths),
+]
+
+
+def warm_up():
+    """Run every step, returns {step: (count or None if it failed, seconds)}"""
+    from django.db import connections
+
+    results = {}
+    try:
+        for name, step in STEPS:
+            started = time.perf_counter()
+            try:
+                count = step()
+            except Exception:
+                logger.exception('Warm-up step %s failed', name)
+                count = None
+            results[name] = (count, time.perf_counter() - started)
+    finally:
+        if threading.current_thread() is not threading.main_thread():
+            connections.close_all()
+    logger.info('Warm-up done: %s', ', '.join(
+        f'{name} {count} in {seconds * 1000:.0f} ms' for name, (count, seconds) in results.items()))
+    return results
+
+
+def _run():
+    try:
+        warm_up()
+    finally:
+        _done.set()
+
+
+def start():
+    """Start warming up this process in the background, once; returns the thread or None when disabled"""
+    global _thread
+    if not getattr(settings, 'WARMUP_ON_START', True):
+        return None
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name='warmup', daemon=True)
+            _thread.start()
+        return _thread
+
+
+def wait(timeout=None):
+    """Block until a started warm-up has finished, returns ready()"""
+    if _thread is not None:
+        _done.wait(timeout)
+    return ready()
+
+
+def ready():
+    """False from start() until the warm-up has finished"""
+    return _thread is None or _done.is_set()
+
+
+def _after_fork():
+    # Servers importing the application before forking workers (uWSGI, gunicorn
+    # --preload) leave the thread behind; a warm-up that finished is inherited
+    global _done, _lock, _thread
+    _lock = threading.Lock()
+    if _thread is not None and not _done.is_set():
+        _done, _thread = threading.Event(), None
+        start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
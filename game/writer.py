@@ -0,0 +1,173 @@
+"""
+Single-writer group commit for database mutations.
+
+SQLite lets one connection write at a time, so many small autocommit
+transactions from request threads and the tick engine spend their time
+waiting on the write lock and on one fsync each. Instead, callers hand their
+mutation to the WriteCoordinator, whose thread collects everything queued
+within GAME_WRITE_GROUP_DELAY seconds and runs it in one transaction.
+
+Each mutation runs in its own savepoint, so a failing one only rolls back
+itself and raises to its own caller. Foreign keys are only checked when the
+group commits, so when the commit itself fails every mutation of the group is
+retried in a transaction of its own and only the offending ones fail. A
+mutation may therefore run twice, the first run rolled back: it must not
+build on in-memory changes of its own first run, so mutations that change
+their arguments reload them first (see api.advance_game). Events recorded
+by a mutation are only buffered once its transaction commits.
+Callers either wait for the commit (write, awrite) or fire and forget
+(write_later); a cancelled caller's mutation is skipped if it has not run yet.
+"""
+import asyncio
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+_writer_thread = threading.local()
+
+
+class WriteCoordinator:
+    """Owns the only writing connection and commits queued mutations in groups"""
+
+    def __init__(self, using='default', max_batch=None, max_delay=None):
+        self.using = using
+        self.max_batch = max_batch or getattr(settings, 'GAME_WRITE_GROUP_SIZE', 256)
+        self.max_delay = max_delay if max_delay is not None else getattr(settings, 'GAME_WRITE_GROUP_DELAY', 0.002)
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+        self.commits = 0
+        self.writes = 0
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) and return a Future for its result"""
+        future = Future()
+        if threading.current_thread() is self.thread:
+            # Already inside a group transaction
+            future.set_result(fn(*args, **kwargs))
+            return future
+        self._ensure_started()
+        self.queue.put((future, fn, args, kwargs))
+        return future
+
+    def _ensure_started(self):
+        if self.thread is not None and self.pid == os.getpid() and self.thread.is_alive():
+            return
+        with self.lock:
+            # A forked worker inherits the attribute but not the thread
+            if self.thread is None or self.pid != os.getpid() or not self.thread.is_alive():
+                self.queue = queue.Queue()
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self.thread.start()
+
+    def _next(self, timeout=None):
+        """The next queued item whose caller is still waiting, None to stop; raises queue.Empty"""
+        while True:
+            item = self.queue.get(timeout=timeout) if timeout is not None else self.queue.get()
+            if item is None or item[0].set_running_or_notify_cancel():
+                return item
+
+    def _run(self):
+        _writer_thread.active = True
+        try:
+            while True:
+                item = self._next()
+                if item is None:
+                    return
+                batch = [item]
+                deadline = time.monotonic() + self.max_delay
+                stop = False
+                while len(batch) < self.max_batch:
+                    try:
+                        item = self._next(timeout=max(0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+                try:
+                    self._commit(batch)
+                except Exception as e:
+                    # Never lose the thread, or every later caller waits forever
+                    logger.exception('Group commit of %d writes failed', len(batch))
+                    for future, fn, args, kwargs in batch:
+                        _resolve(future, e, None)
+                if stop:
+                    return
+        finally:
+            connections[self.using].close()
+
+    def _apply(self, fn, args, kwargs):
+        """(error, result) of one mutation in a savepoint"""
+        try:
+            with transaction.atomic(using=self.using):
+                return None, fn(*args, **kwargs)
+        except Exception as e:
+            return e, None
+
+    def _commit(self, batch):
+        try:
+            with transaction.atomic(using=self.using):
+                outcomes = [(future, *self._apply(fn, args, kwargs)) for future, fn, args, kwargs in batch]
+        except Exception as e:
+            # Most likely a deferred foreign key of one mutation; find it
+            logger.warning('Group commit of %d writes failed, retrying them one by one: %r', len(batch), e)
+            outcomes = [(future, *self._apply(fn, args, kwargs)) for future, fn, args, kwargs in batch]
+
+        self.commits += 1
+        self.writes += len(batch)
+        for future, error, result in outcomes:
+            if error is not None:
+                logger.warning('Queued write failed: %r', error)
+            _resolve(future, error, result)
+
+    def close(self, timeout=5):
+        """Commit everything queued so far and stop the thread"""
+        if self.thread is not None and self.pid == os.getpid() and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout)
+        self.thread = None
+
+
+def _resolve(future, error, result):
+    try:
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+    except InvalidStateError:
+        pass  # Already resolved
+
+
+write_coordinator = WriteCoordinator()
+atexit.register(write_coordinator.close)
+
+
+def on_writer_thread():
+    """Whether the current thread runs queued mutations"""
+    return getattr(_writer_thread, 'active', False)
+
+
+def write(fn, *args, **kwargs):
+    """Run a mutation in the next group commit and return its result once committed"""
+    return write_coordinator.submit(fn, *args, **kwargs).result(getattr(settings, 'GAME_WRITE_TIMEOUT', 30))
+
+
+async def awrite(fn, *args, **kwargs):
+    """Async version of write()"""
+    return await asyncio.wrap_future(write_coordinator.submit(fn, *args, **kwargs))
+
+
+def write_later(fn, *args, **kwargs):
+    """Queue a mutation without waiting for it; failures are logged"""
+    write_coordinator.submit(fn, *args, **kwargs)
@@ -9,17 +9,53 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-import game.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shield_defense.settings')
+# Serve /api/game/ from the async views, see game/api_urls.py
+os.environ.setdefault('GAME_API_ASYNC', 'True')
+
+# Set up Django before importing anything that touches models
+django_asgi_app = get_asgi_application()
+
+import asyncio
+from channels.routing import ProtocolTypeRouter
+from game import warmup
+
+# Warm templates and caches in the background; /ready/ answers 503 until done
+warmup.start()
+
+
+class LazyWebsocketApplication:
+    """The websocket stack, imported on the first connection rather than at worker start"""
+
+    app = None
+
+    async def __call__(self, scope, receive, send):
+        if self.app is None:
+            from channels.auth import AuthMiddlewareStack
+            from channels.routing import URLRouter
+            import game.routing
+
+            self.app = AuthMiddlewareStack(URLRouter(game.routing.websocket_urlpatterns))
+        return await self.app(scope, receive, send)
+
+
+class Lifespan:
+    """ASGI lifespan protocol: startup completes once the warm-up has finished"""
+
+    async def __call__(self, scope, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await asyncio.to_thread(warmup.wait)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
-        URLRouter(
-            game.routing.websocket_urlpatterns
-        )
-    ),
+    "http": django_asgi_app,
+    "websocket": LazyWebsocketApplication(),
+    "lifespan": Lifespan(),
 })
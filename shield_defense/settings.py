@@ -48,6 +48,7 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'authentication.middleware.SessionRefreshMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -85,6 +86,30 @@ DATABASES = {
     }
 }
 
+# Production SQLite profile (opt in with SQLITE_PRODUCTION=true): WAL so
+# readers never block the writer, fsync only at checkpoints, wait for the
+# write lock instead of failing, and keep connections open between requests.
+# The pragmas are applied to each new connection by game/sqlite.py.
+SQLITE_PRODUCTION_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,  # ms
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # negative means KiB
+}
+
+if os.environ.get('SQLITE_PRODUCTION', 'False').lower() == 'true':
+    DATABASES['default'].update({
+        'PRAGMAS': SQLITE_PRODUCTION_PRAGMAS,
+        'CONN_MAX_AGE': int(os.environ.get('CONN_MAX_AGE', '600')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Take the write lock when the transaction begins so two writers
+            # never deadlock upgrading from a read lock
+            'transaction_mode': 'IMMEDIATE',
+        },
+    })
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -153,18 +178,122 @@ CORS_ALLOWED_ORIGINS = [
 
 CORS_ALLOW_CREDENTIALS = True
 
+# Channels configuration
+# Set REDIS_URL to share groups through Redis. Otherwise the local layer fans
+# out between worker processes on this host through Unix domain sockets.
+if os.environ.get('REDIS_URL'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [os.environ['REDIS_URL']],
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'game.channel_layers.LocalChannelLayer',
+            'CONFIG': {
+                'path': os.environ.get('CHANNEL_LAYER_PATH'),
+            },
+        },
+    }
+
+# Serve /api/game/ from the async views (game/async_views.py) instead of the
+# sync ones; asgi.py turns this on unless the environment says otherwise
+GAME_API_ASYNC = os.environ.get('GAME_API_ASYNC', 'False').lower() == 'true'
+
+# Group commit writer (game/writer.py): mutations queued within the delay
+# are committed together in one transaction
+GAME_WRITE_GROUP_DELAY = 0.002  # seconds
+GAME_WRITE_GROUP_SIZE = 256
+GAME_WRITE_TIMEOUT = 30  # seconds write() waits for its commit
+
+# Game event log: buffered inserts, archived to gzipped JSONL after retention
+GAME_EVENT_BATCH_SIZE = 100
+GAME_EVENT_FLUSH_INTERVAL = 1.0  # seconds
+GAME_EVENT_RETENTION_DAYS = int(os.environ.get('GAME_EVENT_RETENTION_DAYS', '30'))
+GAME_EVENT_ARCHIVE_DIR = os.environ.get('GAME_EVENT_ARCHIVE_DIR', str(BASE_DIR / 'archive' / 'events'))
+
+# Active games without a poll or player socket for this many seconds are ended by the reaper
+GAME_IDLE_TIMEOUT = int(os.environ.get('GAME_IDLE_TIMEOUT', '120'))
+
+# Finished games older than this are moved to the ArchivedGame table by archive_games
+GAME_ARCHIVE_AFTER_DAYS = int(os.environ.get('GAME_ARCHIVE_AFTER_DAYS', '30'))
+
+# Leaderboard ranks (game/ranking.py): counts kept in each process, rebuilt
+# from the database this often; set the index off to rank with a window function
+LEADERBOARD_RANK_INDEX = os.environ.get('LEADERBOARD_RANK_INDEX', 'True').lower() == 'true'
+LEADERBOARD_RANK_TTL = int(os.environ.get('LEADERBOARD_RANK_TTL', '300'))  # seconds
+
+# Daily and weekly leaderboard pages (game/rollups.py) are cached this long
+LEADERBOARD_WINDOW_CACHE_TTL = int(os.environ.get('LEADERBOARD_WINDOW_CACHE_TTL', '30'))  # seconds
+
+# Cached leaderboard page parts (game/leaderboard_cache.py): the rendered top,
+# re-rendered when its version bumps or after this long, and each player's stats
+LEADERBOARD_FRAGMENT_TTL = int(os.environ.get('LEADERBOARD_FRAGMENT_TTL', '300'))  # seconds
+LEADERBOARD_PLAYER_CACHE_TTL = int(os.environ.get('LEADERBOARD_PLAYER_CACHE_TTL', '30'))  # seconds
+
+# Post-game stats are applied in batches from a job queue, see game/jobs.py.
+# Set POST_GAME_JOBS_IN_PROCESS=False when a post_game_worker drains it instead.
+POST_GAME_JOB_BATCH_SIZE = int(os.environ.get('POST_GAME_JOB_BATCH_SIZE', '200'))
+POST_GAME_JOBS_IN_PROCESS = os.environ.get('POST_GAME_JOBS_IN_PROCESS', 'True').lower() == 'true'
+
+# Binary replays recorded by the tick engine, see game/replay.py
+GAME_REPLAY_DIR = os.environ.get('GAME_REPLAY_DIR', str(BASE_DIR / 'replays'))
+
+# Web worker cold start budget, checked by python manage.py startup_profile,
+# and modules that must stay out of it (imported on first use instead)
+STARTUP_BUDGET_MS = int(os.environ.get('STARTUP_BUDGET_MS', '2000'))
+STARTUP_DEFERRED_MODULES = ['google.auth', 'game.consumers', 'game.game_logic']
+
+# Workers warm their templates, caches and path table in the background when
+# they start, and /ready/ answers 503 until done, see game/warmup.py
+WARMUP_ON_START = os.environ.get('WARMUP_ON_START', 'True').lower() == 'true'
+WARMUP_ACTIVE_WINDOW = int(os.environ.get('WARMUP_ACTIVE_WINDOW', '3600'))  # seconds
+WARMUP_PLAYERS = int(os.environ.get('WARMUP_PLAYERS', '500'))
+
+# Admin changelists count exactly up to this many rows, then estimate (game/changelist.py)
+ADMIN_COUNT_LIMIT = int(os.environ.get('ADMIN_COUNT_LIMIT', '10000'))
+
 # Google OAuth2 settings
 GOOGLE_OAUTH2_CLIENT_ID = os.environ.get('GOOGLE_OAUTH2_CLIENT_ID', '')
 GOOGLE_OAUTH2_CLIENT_SECRET = os.environ.get('GOOGLE_OAUTH2_CLIENT_SECRET', '')
 
+# Google's signing certificates are cached in memory and in this file, and used
+# past their expiry for GRACE seconds while Google is unreachable, see
+# authentication/google_tokens.py
+GOOGLE_OAUTH2_CERTS_URL = os.environ.get('GOOGLE_OAUTH2_CERTS_URL', 'https://www.googleapis.com/oauth2/v1/certs')
+GOOGLE_OAUTH2_CERTS_FILE = os.environ.get('GOOGLE_OAUTH2_CERTS_FILE', str(BASE_DIR / 'google_certs.json'))
+GOOGLE_OAUTH2_CERTS_GRACE = int(os.environ.get('GOOGLE_OAUTH2_CERTS_GRACE', '86400'))  # seconds
+
 # Login URLs
 LOGIN_URL = '/auth/login/'
 LOGIN_REDIRECT_URL = '/game/'
 LOGOUT_REDIRECT_URL = '/'
 
-# Session settings
+# Session settings. Sessions stay in the database so logging out revokes them
+# server side. django.contrib.sessions.backends.signed_cookies keeps session
+# reads off the database, but logging out then only clears the browser's copy:
+# a copied cookie stays valid until it expires, only a password change ends it.
+SESSION_ENGINE = os.environ.get('SESSION_ENGINE', 'django.contrib.sessions.backends.db')
 SESSION_COOKIE_AGE = 86400  # 24 hours
-SESSION_SAVE_EVERY_REQUEST = True
+# Expiry slides by saving the session at most this often instead of on every
+# request, and never on the polled read-only API routes
+# (authentication.middleware.SessionRefreshMiddleware)
+SESSION_REFRESH_INTERVAL = int(os.environ.get('SESSION_REFRESH_INTERVAL', '900'))  # seconds
+SESSION_READ_ONLY_PATHS = [
+    r'^/api/game/state/',
+    r'^/game/api/game/state/',
+    r'^/api/game/leaderboard/',
+    r'^/api/game/replay/',
+]
 
 # Custom user model
 AUTH_USER_MODEL = 'authentication.User'
+
+# request.user comes from a cached projection of the user row, see
+# authentication/backends.py
+AUTHENTICATION_BACKENDS = ['authentication.backends.CachedModelBackend']
+AUTH_USER_CACHE_TTL = int(os.environ.get('AUTH_USER_CACHE_TTL', '60'))  # seconds
@@ -19,6 +19,7 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from django.views.generic import RedirectView
+from game.views import readiness
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -26,6 +27,7 @@ urlpatterns = [
     path('auth/', include('authentication.urls')),
     path('game/', include('game.urls')),
     path('api/game/', include('game.api_urls')),
+    path('ready/', readiness, name='ready'),
 ]
 
 if settings.DEBUG:
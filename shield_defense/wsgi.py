@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shield_defense.settings')
 
 application = get_wsgi_application()
+
+# Warm templates and caches in the background; /ready/ answers 503 until done
+from game import warmup  # noqa: E402
+
+warmup.start()